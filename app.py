@@ -1,14 +1,34 @@
 import os
+import atexit
 import hmac
-import hashlib
 import json
 import base64
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template
+import time
+from datetime import datetime, timedelta, timezone
+from flask import Flask, request, jsonify, render_template, send_file, g, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
-import urllib.parse
-import requests
+import click
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+
+from auth import InitDataValidator
+from bot import Bot, create_webapp_keyboard
+from broadcast import BroadcastRunner, broadcast_summary
+from catalog import Catalog
+from catalog_import import CatalogWatcher, load_catalog_dir
+from hours import HoursIndex
+from http_cache import cached_json_response
+from leaderboard import Leaderboards
+from idempotency import IdempotencyCache, scoped_key, HEADER as IDEMPOTENCY_HEADER
+from max_api import MaxApiClient, MaxApiError
+from metrics import MetricsRegistry, Sample
+from outbox import SendQueue
+from phash import ReceiptHashIndex
+from qr_assets import QrAssetStore, FORMATS as QR_FORMATS
+from storage import create_storage, analytics_hour, InsufficientFunds, DuplicateReceipt, ANALYTICS_EPOCH
+from updates import iter_updates
+from uploads import ReceiptStore, UploadTooLarge, UploadBusy
 
 load_dotenv()
 
@@ -17,146 +37,173 @@ CORS(app)
 
 MAX_SECRET_KEY = os.getenv('MAX_SECRET_KEY', '')
 BOT_TOKEN = os.getenv('BOT_TOKEN', '')
-API_BASE_URL = 'https://platform-api.max.ru'
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+API_BASE_URL = os.getenv('MAX_API_BASE_URL', 'https://platform-api.max.ru')
 WEBAPP_URL = os.getenv('WEBAPP_URL', 'http://46.173.29.103/')
 YANDEX_MAPS_API_KEY = os.getenv('YANDEX_MAPS_API_KEY', '')
+INIT_DATA_CACHE_SIZE = int(os.getenv('INIT_DATA_CACHE_SIZE', '10000'))
+INIT_DATA_CACHE_TTL = int(os.getenv('INIT_DATA_CACHE_TTL', '300'))
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', '60'))
+CATALOG_DIR = os.getenv('CATALOG_DIR', os.path.join(app.root_path, 'catalog_data'))
+CATALOG_WATCH_INTERVAL = float(os.getenv('CATALOG_WATCH_INTERVAL', '5'))
+CATALOG_TIMEZONE = os.getenv('CATALOG_TIMEZONE', 'Europe/Moscow')
+QR_DIR = os.getenv('QR_DIR', 'data/qr')
+QR_SIZES = tuple(int(size) for size in os.getenv('QR_SIZES', '256,512,1024').split(',') if size.strip())
+QR_DEFAULT_SIZE = int(os.getenv('QR_DEFAULT_SIZE', '512'))
+QR_WORKERS = int(os.getenv('QR_WORKERS', '1'))
+QR_PRERENDER = os.getenv('QR_PRERENDER', '1') != '0'
+SUBMIT_BATCH_MAX = int(os.getenv('SUBMIT_BATCH_MAX', '50'))
+LEADERBOARD_SNAPSHOT = os.getenv('LEADERBOARD_SNAPSHOT', 'data/leaderboard.json')
+LEADERBOARD_REFRESH_INTERVAL = float(os.getenv('LEADERBOARD_REFRESH_INTERVAL', '1'))
+LEADERBOARD_SNAPSHOT_INTERVAL = float(os.getenv('LEADERBOARD_SNAPSHOT_INTERVAL', '300'))
+METRICS_DIR = os.getenv('METRICS_DIR', 'data/metrics')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', 'data/uploads')
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '2'))
+UPLOAD_MAX_PENDING = int(os.getenv('UPLOAD_MAX_PENDING', '32'))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+RECEIPT_DUPLICATE_DISTANCE = int(os.getenv('RECEIPT_DUPLICATE_DISTANCE', '6'))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+UPDATE_DEDUP_TTL = int(os.getenv('UPDATE_DEDUP_TTL', '600'))
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', '4'))
+SEND_QUEUE_SIZE = int(os.getenv('SEND_QUEUE_SIZE', '1000'))
+SEND_RATE = float(os.getenv('SEND_RATE', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_RETRIES = int(os.getenv('SEND_RETRIES', '3'))
 
-users_db = {}
-recycling_points_db = [
-    {
-        'id': 1,
-        'name': 'ЭкоПункт "Невский"',
-        'address': 'Санкт-Петербург, Невский проспект, д. 28',
-        'lat': 59.9343,
-        'lng': 30.3351,
-        'hours': '09:00-20:00',
-        'types': ['пластик', 'бумага', 'стекло', 'металл'],
-        'qr_code': 'TRASH_001'
-    },
-    {
-        'id': 2,
-        'name': 'ЭкоПункт "Васильевский"',
-        'address': 'Санкт-Петербург, Васильевский остров, 6-я линия, д. 15',
-        'lat': 59.9398,
-        'lng': 30.2808,
-        'hours': '10:00-19:00',
-        'types': ['пластик', 'бумага', 'стекло'],
-        'qr_code': 'TRASH_002'
-    },
-    {
-        'id': 3,
-        'name': 'ЭкоПункт "Петроградский"',
-        'address': 'Санкт-Петербург, Каменноостровский проспект, д. 42',
-        'lat': 59.9658,
-        'lng': 30.3114,
-        'hours': '08:00-21:00',
-        'types': ['пластик', 'стекло', 'металл', 'электроника'],
-        'qr_code': 'TRASH_003'
-    },
-    {
-        'id': 4,
-        'name': 'ЭкоПункт "Центральный"',
-        'address': 'Санкт-Петербург, Лиговский проспект, д. 50',
-        'lat': 59.9272,
-        'lng': 30.3609,
-        'hours': '09:00-20:00',
-        'types': ['пластик', 'бумага', 'металл'],
-        'qr_code': 'TRASH_004'
-    },
-    {
-        'id': 5,
-        'name': 'ЭкоПункт "Московский"',
-        'address': 'Санкт-Петербург, Московский проспект, д. 212',
-        'lat': 59.8708,
-        'lng': 30.3194,
-        'hours': '10:00-18:00',
-        'types': ['пластик', 'бумага', 'стекло', 'металл', 'электроника'],
-        'qr_code': 'TRASH_005'
-    },
-    {
-        'id': 6,
-        'name': 'ЭкоПункт "Приморский"',
-        'address': 'Санкт-Петербург, Приморский проспект, д. 78',
-        'lat': 59.9808,
-        'lng': 30.2500,
-        'hours': '09:00-19:00',
-        'types': ['пластик', 'бумага', 'стекло'],
-        'qr_code': 'TRASH_006'
-    }
-]
-
-rewards_catalog = [
-    {
-        'id': 1,
-        'name': 'Промокод на кофе -20%',
-        'description': 'Скидка 20% в сети кофеен "КофеМакс"',
-        'price': 50,
-        'type': 'promo',
-        'image': '/static/images/coffee.png'
-    },
-    {
-        'id': 2,
-        'name': 'Эко-сумка',
-        'description': 'Многоразовая сумка-шопер из переработанного материала',
-        'price': 100,
-        'type': 'product',
-        'image': '/static/images/bag.png'
-    },
-    {
-        'id': 3,
-        'name': 'Многоразовая кружка',
-        'description': 'Термокружка из нержавеющей стали',
-        'price': 150,
-        'type': 'product',
-        'image': '/static/images/cup.png'
-    },
-    {
-        'id': 4,
-        'name': 'Донат в фонд "Помощь детям"',
-        'description': 'Перевести средства в благотворительный фонд',
-        'price': 200,
-        'type': 'donation',
-        'image': '/static/images/donation.png',
-        'charity_id': 'vk_dobro_001'
-    }
-]
+storage = create_storage()
+init_data_validator = InitDataValidator(MAX_SECRET_KEY, INIT_DATA_CACHE_SIZE, INIT_DATA_CACHE_TTL)
+send_queue = SendQueue(
+    workers=SEND_WORKERS,
+    maxsize=SEND_QUEUE_SIZE,
+    rate=SEND_RATE,
+    chat_rate=SEND_CHAT_RATE,
+    retries=SEND_RETRIES
+)
+atexit.register(send_queue.stop)
+max_api = MaxApiClient(BOT_TOKEN, API_BASE_URL)
+bot = Bot(max_api, send_queue, storage, WEBAPP_URL, UPDATE_DEDUP_TTL)
+broadcast_runner = BroadcastRunner(storage, max_api, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS)
+atexit.register(broadcast_runner.stop)
+receipt_store = ReceiptStore(
+    UPLOAD_DIR,
+    max_bytes=UPLOAD_MAX_BYTES,
+    workers=UPLOAD_WORKERS,
+    max_pending=UPLOAD_MAX_PENDING
+)
+atexit.register(receipt_store.shutdown)
+receipt_index = ReceiptHashIndex(storage, RECEIPT_DUPLICATE_DISTANCE)
+idempotency_cache = IdempotencyCache(storage, IDEMPOTENCY_CACHE_SIZE)
+leaderboards = Leaderboards(
+    storage,
+    LEADERBOARD_SNAPSHOT,
+    refresh_interval=LEADERBOARD_REFRESH_INTERVAL,
+    snapshot_interval=LEADERBOARD_SNAPSHOT_INTERVAL
+)
+atexit.register(leaderboards.stop)
+catalog = Catalog(CATALOG_TIMEZONE)
+qr_assets = QrAssetStore(QR_DIR, QR_SIZES, QR_DEFAULT_SIZE, QR_WORKERS)
+if QR_PRERENDER:
+    catalog.add_listener(qr_assets.schedule)
+atexit.register(qr_assets.stop)
+catalog_watcher = CatalogWatcher(catalog, CATALOG_DIR, CATALOG_WATCH_INTERVAL)
+catalog_watcher.reload()
+atexit.register(catalog_watcher.stop)
+
+metrics = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+atexit.register(metrics.stop)
+http_requests = metrics.counter('http_requests_total', 'HTTP-запросы по эндпоинтам и кодам ответа',
+                                ('method', 'endpoint', 'status'))
+http_latency = metrics.histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса',
+                                 ('method', 'endpoint'))
+http_in_flight = metrics.gauge('http_requests_in_flight', 'Запросы в обработке')
+
+
+def collect_component_metrics():
+    api = max_api.stats()
+    samples = [
+        Sample('max_api_fallbacks_total', 'counter', 'Успешные вызовы MAX API запасным способом авторизации',
+               {}, api['fallbacks']),
+        Sample('max_api_rejected_total', 'counter', 'Вызовы MAX API, отклоненные circuit breaker',
+               {}, api['rejected'])
+    ]
+    for variant, state in api['circuits'].items():
+        samples.append(Sample('max_api_circuit_open', 'gauge', 'Circuit breaker варианта открыт',
+                              {'variant': variant}, int(state == 'open'), 'max'))
+    for key, endpoint in api['endpoints'].items():
+        method, variant = key.split(':', 1)
+        labels = {'method': method, 'variant': variant}
+        samples.append(Sample('max_api_requests_total', 'counter', 'Вызовы MAX API', labels, endpoint['calls']))
+        samples.append(Sample('max_api_errors_total', 'counter', 'Ошибки вызовов MAX API', labels, endpoint['errors']))
+    for (method, variant), histogram in max_api.latency_histograms().items():
+        samples.append(Sample('max_api_request_duration_seconds', 'histogram', 'Время вызова MAX API',
+                              {'method': method, 'variant': variant}, histogram))
+
+    queue = send_queue.stats()
+    for outcome in ('sent', 'failed', 'retried', 'dropped'):
+        samples.append(Sample('send_queue_messages_total', 'counter', 'Сообщения очереди отправки бота',
+                              {'outcome': outcome}, queue[outcome]))
+    samples.append(Sample('send_queue_size', 'gauge', 'Сообщения в очереди отправки', {}, queue['queued']))
+
+    bot_stats = bot.stats()
+    samples.append(Sample('bot_send_errors_total', 'counter', 'Ошибки sendMessage в ответах бота',
+                          {}, bot_stats['send_errors']))
+    for kind, count in bot_stats['fallbacks'].items():
+        samples.append(Sample('bot_send_fallbacks_total', 'counter', 'Повторные отправки без кнопки мини-приложения',
+                              {'kind': kind}, count))
+    seen = bot.seen_updates.stats()
+    samples.append(Sample('bot_duplicate_updates_total', 'counter', 'Отброшенные повторные обновления (в памяти воркера)',
+                          {}, seen['duplicates']))
+    samples.append(Sample('bot_seen_updates', 'gauge', 'Ключи обновлений в окне дедупликации', {}, seen['size']))
 
-recycling_rates = {
-    'пластик': 10,
-    'бумага': 8,
-    'стекло': 12,
-    'металл': 15,
-    'электроника': 25
-}
+    for cache, stats in (('init_data', init_data_validator.stats()), ('idempotency', idempotency_cache.stats())):
+        samples.append(Sample('cache_hits_total', 'counter', 'Попадания в кэш', {'cache': cache}, stats['hits']))
+        samples.append(Sample('cache_misses_total', 'counter', 'Промахи кэша', {'cache': cache}, stats['misses']))
+        samples.append(Sample('cache_entries', 'gauge', 'Записи в кэше', {'cache': cache}, stats['size']))
+
+    samples.append(Sample('init_data_rejected_total', 'counter', 'initData с неверной подписью или форматом',
+                          {}, init_data_validator.stats()['rejected']))
+
+    receipts = receipt_store.stats()
+    samples.append(Sample('receipts_pending', 'gauge', 'Фото чеков в обработке', {}, receipts['pending']))
+    for outcome in ('processed', 'failed'):
+        samples.append(Sample('receipts_processed_total', 'counter', 'Обработанные фото чеков',
+                              {'outcome': outcome}, receipts[outcome]))
+    samples.append(Sample('receipt_hashes', 'gauge', 'Хэши чеков в индексе дубликатов',
+                          {}, receipt_index.stats()['hashes'], 'max'))
+
+    broadcasts = broadcast_runner.stats()
+    samples.append(Sample('broadcasts_running', 'gauge', 'Выполняющиеся рассылки', {}, broadcasts['running']))
+    samples.append(Sample('broadcast_retries_total', 'counter', 'Повторы отправки в рассылках',
+                          {}, broadcasts['retried']))
+    samples.append(Sample('broadcast_pauses_total', 'counter', 'Паузы рассылок из-за недоступности MAX API',
+                          {}, broadcasts['pauses']))
+
+    catalog_stats = catalog_watcher.stats()
+    samples.append(Sample('catalog_points', 'gauge', 'Пункты приема в каталоге', {}, catalog_stats['points'], 'max'))
+    samples.append(Sample('catalog_reloads_total', 'counter', 'Перезагрузки каталога', {}, catalog_stats['reloads']))
+    samples.append(Sample('catalog_reload_failures_total', 'counter', 'Неудачные перезагрузки каталога',
+                          {}, catalog_stats['failures']))
+    samples.append(Sample('leaderboard_users', 'gauge', 'Пользователи в общем рейтинге',
+                          {}, leaderboards.stats()['users'], 'max'))
+    qr_stats = qr_assets.stats()
+    samples.append(Sample('qr_assets_rendered_total', 'counter', 'Отрендеренные изображения QR-кодов',
+                          {}, qr_stats['rendered']))
+    return samples
+
+
+metrics.add_collector(collect_component_metrics)
 
 
 def validate_init_data(init_data: str) -> dict:
-    if not MAX_SECRET_KEY:
-        return {'user': {'id': 123456, 'first_name': 'Test', 'last_name': 'User'}}
-    
-    try:
-        parsed = urllib.parse.parse_qs(init_data)
-        data_str = parsed.get('data', [''])[0]
-        hash_str = parsed.get('hash', [''])[0]
-        
-        if not data_str or not hash_str:
-            return None
-        
-        secret_key = hashlib.sha256(MAX_SECRET_KEY.encode()).digest()
-        calculated_hash = hmac.new(
-            secret_key,
-            data_str.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        if calculated_hash != hash_str:
-            return None
-        
-        data = json.loads(data_str)
-        return data
-    except Exception as e:
-        print(f"Ошибка валидации initData: {e}")
-        return None
+    return init_data_validator.validate(init_data)
+
+
+def is_admin_request():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
 
 
 def get_user_id_from_request():
@@ -170,6 +217,43 @@ def get_user_id_from_request():
     return None
 
 
+@app.before_request
+def start_request():
+    catalog_watcher.ensure_running()
+    qr_assets.ensure_running()
+    leaderboards.ensure_running()
+    metrics.ensure_running()
+    http_in_flight.inc()
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exc):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    http_in_flight.dec()
+    # Шаблон маршрута, а не путь: /api/recycling-points/<int:point_id> — одна метка на все id.
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    status = g.pop('response_status', 500)
+    http_requests.inc(method=request.method, endpoint=endpoint, status=status)
+    http_latency.observe(time.perf_counter() - started, method=request.method, endpoint=endpoint)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not is_admin_request() and not (ADMIN_TOKEN and hmac.compare_digest(token, ADMIN_TOKEN)):
+        return jsonify({'error': 'Forbidden'}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def index():
     return render_template('index.html', yandex_maps_api_key=YANDEX_MAPS_API_KEY)
@@ -184,12 +268,7 @@ def validate():
     if validated:
         user_id = validated.get('user', {}).get('id')
         if user_id:
-            if user_id not in users_db:
-                users_db[user_id] = {
-                    'balance': 0,
-                    'transactions': [],
-                    'rewards': []
-                }
+            storage.ensure_user(user_id)
             return jsonify({
                 'valid': True,
                 'userId': user_id,
@@ -205,37 +284,153 @@ def get_balance():
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    if user_id not in users_db:
-        users_db[user_id] = {'balance': 0, 'transactions': [], 'rewards': []}
-    
     return jsonify({
-        'balance': users_db[user_id]['balance'],
+        'balance': storage.get_balance(user_id),
         'userId': user_id
     })
 
 
+def parse_bbox(value):
+    try:
+        lat1, lng1, lat2, lng2 = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    return min(lat1, lat2), min(lng1, lng2), max(lat1, lat2), max(lng1, lng2)
+
+
+def parse_materials(values):
+    materials = set()
+    for value in values:
+        materials.update(part.strip() for part in value.split(',') if part.strip())
+    return materials
+
+
+def parse_open_at(args):
+    if args.get('open_at'):
+        try:
+            return datetime.fromisoformat(args['open_at'])
+        except ValueError:
+            raise ValueError('Invalid open_at') from None
+    if args.get('open_now', '').lower() in ('1', 'true', 'yes'):
+        return datetime.now(timezone.utc)
+    return None
+
+
+def make_point_filter(materials=None, bbox=None, is_open=None):
+    checks = []
+    if is_open:
+        checks.append(is_open)
+    if materials:
+        checks.append(lambda p: materials.issubset(p['types']))
+    if bbox:
+        lat_min, lng_min, lat_max, lng_max = bbox
+        checks.append(lambda p: lat_min <= p['lat'] <= lat_max and lng_min <= p['lng'] <= lng_max)
+    if not checks:
+        return None
+    return lambda p: all(check(p) for check in checks)
+
+
+def find_points(args):
+    user_lat = args.get('lat', type=float)
+    user_lng = args.get('lng', type=float)
+    limit = args.get('limit', type=int)
+    radius_km = args.get('radius_km', type=float)
+    materials = parse_materials(args.getlist('material'))
+    
+    bbox = None
+    if args.get('bbox'):
+        bbox = parse_bbox(args['bbox'])
+        if not bbox:
+            raise ValueError('Invalid bbox')
+    
+    if limit is not None and limit < 0:
+        raise ValueError('Invalid limit')
+    
+    open_at = parse_open_at(args)
+    snapshot = catalog.current
+    points_index = snapshot.points_index
+    is_open = snapshot.opening_hours.predicate(open_at) if open_at else None
+    
+    if user_lat is not None and user_lng is not None:
+        nearest = points_index.nearest(
+            user_lat, user_lng,
+            limit=limit,
+            radius_km=radius_km,
+            predicate=make_point_filter(materials, bbox, is_open)
+        )
+        points = [dict(point, distance=round(distance, 2)) for distance, point in nearest]
+    elif bbox:
+        points = points_index.within_bbox(*bbox, predicate=make_point_filter(materials, is_open=is_open))
+        points = points[:limit] if limit is not None else points
+    else:
+        points_filter = make_point_filter(materials, is_open=is_open)
+        points = [p for p in points_index.points if not points_filter or points_filter(p)]
+        points = points[:limit] if limit is not None else points
+    
+    return points
+
+
 @app.route('/api/recycling-points', methods=['GET'])
 def get_recycling_points():
-    user_lat = request.args.get('lat', type=float)
-    user_lng = request.args.get('lng', type=float)
+    if not request.args:
+        return cached_json_response(catalog.current.points_response, CATALOG_CACHE_MAX_AGE)
     
-    points = recycling_points_db.copy()
-    
-    if user_lat and user_lng:
-        for point in points:
-            distance = ((point['lat'] - user_lat)**2 + (point['lng'] - user_lng)**2)**0.5
-            point['distance'] = round(distance * 111, 2)
-        points.sort(key=lambda x: x.get('distance', float('inf')))
+    try:
+        points = find_points(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({'points': points})
 
 
+@app.route('/api/recycling-points/clusters', methods=['GET'])
+def get_recycling_point_clusters():
+    bbox = parse_bbox(request.args.get('bbox'))
+    zoom = request.args.get('zoom', type=int)
+    if not bbox:
+        return jsonify({'error': 'Invalid bbox'}), 400
+    if zoom is None or not 0 <= zoom <= 23:
+        return jsonify({'error': 'Invalid zoom'}), 400
+    
+    try:
+        clusters = catalog.current.point_clusters.clusters(*bbox, zoom)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'zoom': zoom, 'clusters': clusters})
+
+
 @app.route('/api/recycling-points/<int:point_id>', methods=['GET'])
 def get_recycling_point(point_id):
-    point = next((p for p in recycling_points_db if p['id'] == point_id), None)
-    if not point:
+    cached = catalog.current.point_response(point_id)
+    if not cached:
         return jsonify({'error': 'Point not found'}), 404
-    return jsonify(point)
+    return cached_json_response(cached, CATALOG_CACHE_MAX_AGE)
+
+
+def parse_qr_size(args):
+    size = args.get('size')
+    if size is None:
+        return None
+    try:
+        return int(size)
+    except ValueError:
+        return -1
+
+
+@app.route('/api/recycling-points/<int:point_id>/qr.<fmt>', methods=['GET'])
+def get_recycling_point_qr(point_id, fmt):
+    point = catalog.current.get_point(point_id)
+    if not point or not point.get('qr_code'):
+        return jsonify({'error': 'Point not found'}), 404
+    
+    try:
+        path, etag = qr_assets.asset(point['qr_code'], fmt, parse_qr_size(request.args))
+    except ValueError:
+        return jsonify({'error': 'Unsupported format or size', 'formats': list(QR_FORMATS),
+                        'sizes': list(qr_assets.sizes)}), 400
+    return send_file(os.path.abspath(path), mimetype=QR_FORMATS[fmt], etag=etag,
+                     max_age=CATALOG_CACHE_MAX_AGE)
 
 
 @app.route('/api/recycling/submit', methods=['POST'])
@@ -244,23 +439,43 @@ def submit_recycling():
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
+    try:
+        idempotency_key = scoped_key('submit', request.headers.get(IDEMPOTENCY_HEADER))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if idempotency_key:
+        replay = idempotency_cache.get(user_id, idempotency_key)
+        if replay is not None:
+            return replayed(recycling_response(*replay))
+    
     data = request.json
     method = data.get('method')
     point_id = data.get('pointId')
     qr_code = data.get('qrCode')
-    receipt_photo = data.get('receiptPhoto')
+    receipt_id = data.get('receiptId')
     material_type = data.get('materialType')
     weight = data.get('weight', 1.0)
+    snapshot = catalog.current
     
     if method == 'qr':
-        point = next((p for p in recycling_points_db if p['qr_code'] == qr_code), None)
+        point = snapshot.get_point_by_qr(qr_code)
         if not point:
             return jsonify({'error': 'Invalid QR code'}), 400
-        point_id = point['id']
     elif method == 'receipt':
-        point = next((p for p in recycling_points_db if p['id'] == point_id), None)
+        point = snapshot.get_point(point_id)
         if not point:
             return jsonify({'error': 'Point not found'}), 404
+        status = receipt_store.status(receipt_id)
+        if status is None:
+            return jsonify({'error': 'Receipt not found'}), 400
+        if status == 'processing':
+            return jsonify({'error': 'Фото чека еще обрабатывается', 'status': status}), 409
+        if status == 'failed':
+            return jsonify({'error': 'Не удалось обработать фото чека', 'status': status}), 400
+        receipt_info = receipt_store.info(receipt_id)
+        # Быстрый отказ без записи; окончательная проверка — внутри начисления (receipt_check).
+        if receipt_index.find(receipt_info['phash']):
+            return jsonify({'error': 'Этот чек уже был отправлен', 'duplicate': True}), 409
     else:
         return jsonify({'error': 'Invalid method'}), 400
     
@@ -269,38 +484,183 @@ def submit_recycling():
             'error': f'Этот пункт не принимает {material_type}'
         }), 400
     
-    rate = recycling_rates.get(material_type, 10)
-    coins = int(weight * rate)
-    
-    if user_id not in users_db:
-        users_db[user_id] = {'balance': 0, 'transactions': [], 'rewards': []}
-    
-    users_db[user_id]['balance'] += coins
+    transaction = recycling_transaction(snapshot, point, material_type, weight, method)
+    receipt = None
+    if method == 'receipt':
+        transaction['receipt_id'] = receipt_id
+        receipt = (receipt_id, receipt_info['phash'])
+    try:
+        result = storage.credit(user_id, transaction, receipt, idempotency_key=idempotency_key,
+                                receipt_check=receipt_index.check)
+    except DuplicateReceipt:
+        return jsonify({'error': 'Этот чек уже был отправлен', 'duplicate': True}), 409
     
-    transaction = {
-        'id': len(users_db[user_id]['transactions']) + 1,
+    if idempotency_key:
+        idempotency_cache.put(user_id, idempotency_key, result)
+    # Рейтинг дочитывает журнал в фоне: запрос только будит поток обновления.
+    leaderboards.request_refresh()
+    return recycling_response(*result)
+
+
+def recycling_transaction(snapshot, point, material_type, weight, method):
+    rate = snapshot.rates.get(material_type, 10)
+    return {
         'date': datetime.now().isoformat(),
         'type': 'recycling',
-        'point_id': point_id,
+        'point_id': point['id'],
         'point_name': point['name'],
         'material_type': material_type,
         'weight': weight,
-        'coins': coins,
+        'coins': int(weight * rate),
         'method': method
     }
-    users_db[user_id]['transactions'].insert(0, transaction)
+
+
+def batch_drop_transaction(drop, snapshot):
+    """Транзакция для сдачи из пачки или текст ошибки."""
+    if drop.get('method', 'qr') != 'qr':
+        return None, 'В пачке принимаются только сдачи по QR-коду'
+    point = snapshot.get_point_by_qr(drop.get('qrCode'))
+    if not point:
+        return None, 'Invalid QR code'
+    material_type = drop.get('materialType')
+    if material_type not in point['types']:
+        return None, f'Этот пункт не принимает {material_type}'
+    weight = drop.get('weight', 1.0)
+    if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not 0 < weight < float('inf'):
+        return None, 'Invalid weight'
+    transaction = recycling_transaction(snapshot, point, material_type, weight, 'qr')
+    if isinstance(drop.get('recordedAt'), str):
+        # Время сдачи на устройстве — только для истории, начисление идет по времени сервера.
+        transaction['recorded_at'] = drop['recordedAt'][:40]
+    return transaction, None
+
+
+@app.route('/api/recycling/submit-batch', methods=['POST'])
+def submit_recycling_batch():
+    user_id = get_user_id_from_request()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    body = request.get_json(silent=True)
+    drops = body.get('drops') if isinstance(body, dict) else None
+    if not isinstance(drops, list) or not 0 < len(drops) <= SUBMIT_BATCH_MAX:
+        return jsonify({'error': 'Invalid drops', 'max': SUBMIT_BATCH_MAX}), 400
+    
+    snapshot = catalog.current
+    results = [None] * len(drops)
+    items, positions = [], []
+    for index, drop in enumerate(drops):
+        client_id = drop.get('clientId') if isinstance(drop, dict) else None
+        try:
+            key = scoped_key('submit', client_id) if isinstance(client_id, str) else None
+        except ValueError:
+            key = None
+        if key is None:
+            results[index] = {'clientId': client_id, 'status': 'error', 'error': 'Invalid clientId'}
+            continue
+        # Ключ общий с Idempotency-Key одиночной сдачи: дошедший до сервера запрос не зачтется дважды.
+        replay = idempotency_cache.get(user_id, key)
+        if replay is not None:
+            results[index] = {'clientId': client_id, 'status': 'duplicate', 'transaction': replay[1]}
+            continue
+        transaction, error = batch_drop_transaction(drop, snapshot)
+        if error:
+            results[index] = {'clientId': client_id, 'status': 'error', 'error': error}
+            continue
+        items.append((transaction, key))
+        positions.append(index)
     
+    if items:
+        balance, credited = storage.credit_batch(user_id, items)
+        for index, (transaction, key), (stored, replayed) in zip(positions, items, credited):
+            if not replayed:
+                idempotency_cache.put(user_id, key, (balance, stored))
+            results[index] = {'clientId': drops[index]['clientId'], 'transaction': stored,
+                              'status': 'duplicate' if replayed else 'credited'}
+        leaderboards.request_refresh()
+    else:
+        balance = storage.get_balance(user_id)
+    
+    return jsonify({
+        'success': True,
+        'balance': balance,
+        'coins': sum(result['transaction']['coins'] for result in results if result['status'] == 'credited'),
+        'results': results
+    })
+
+
+def recycling_response(balance, transaction):
     return jsonify({
         'success': True,
-        'coins': coins,
-        'balance': users_db[user_id]['balance'],
+        'coins': transaction['coins'],
+        'balance': balance,
         'transaction': transaction
     })
 
 
+def replayed(response):
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+@app.route('/api/receipts/upload', methods=['POST'])
+def upload_receipt():
+    user_id = get_user_id_from_request()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES + 64 * 1024:
+        return jsonify({'error': UploadTooLarge.description}), 413
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            receipt_id = receipt_store.save_multipart(request.environ)
+        elif request.mimetype.startswith('image/'):
+            receipt_id = receipt_store.save_stream(request.stream)
+        else:
+            return jsonify({'error': 'Ожидается изображение'}), 415
+    except (UploadTooLarge, UploadBusy) as e:
+        return jsonify({'error': e.description}), e.code
+    except HTTPException as e:
+        return jsonify({'error': 'Некорректная загрузка'}), e.code or 400
+    
+    if not receipt_id:
+        return jsonify({'error': 'Пустой файл'}), 400
+    
+    return jsonify({
+        'receiptId': receipt_id,
+        'status': receipt_store.status(receipt_id)
+    }), 201
+
+
+@app.route('/api/receipts/<receipt_id>', methods=['GET'])
+def get_receipt_status(receipt_id):
+    user_id = get_user_id_from_request()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    status = receipt_store.status(receipt_id)
+    if not status:
+        return jsonify({'error': 'Receipt not found'}), 404
+    return jsonify({'receiptId': receipt_id, 'status': status})
+
+
+@app.route('/api/receipts/<receipt_id>/thumbnail', methods=['GET'])
+def get_receipt_thumbnail(receipt_id):
+    user_id = get_user_id_from_request()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    path = receipt_store.thumbnail_path(receipt_id)
+    if not path:
+        return jsonify({'error': 'Receipt not found'}), 404
+    return send_file(os.path.abspath(path), mimetype='image/jpeg', etag=receipt_id, max_age=86400)
+
+
 @app.route('/api/rewards', methods=['GET'])
 def get_rewards():
-    return jsonify({'rewards': rewards_catalog})
+    return cached_json_response(catalog.current.rewards_response, CATALOG_CACHE_MAX_AGE)
 
 
 @app.route('/api/rewards/<int:reward_id>/purchase', methods=['POST'])
@@ -309,61 +669,113 @@ def purchase_reward(reward_id):
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    reward = next((r for r in rewards_catalog if r['id'] == reward_id), None)
+    try:
+        idempotency_key = scoped_key(f'purchase:{reward_id}', request.headers.get(IDEMPOTENCY_HEADER))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if idempotency_key:
+        replay = idempotency_cache.get(user_id, idempotency_key)
+        if replay is not None:
+            return replayed(purchase_response(*replay))
+    
+    reward = catalog.current.get_reward(reward_id)
     if not reward:
         return jsonify({'error': 'Reward not found'}), 404
     
-    if user_id not in users_db:
-        users_db[user_id] = {'balance': 0, 'transactions': [], 'rewards': []}
-    
-    if users_db[user_id]['balance'] < reward['price']:
-        return jsonify({'error': 'Недостаточно средств'}), 400
-    
-    users_db[user_id]['balance'] -= reward['price']
-    
     purchase = {
-        'id': len(users_db[user_id]['rewards']) + 1,
         'reward_id': reward_id,
         'reward_name': reward['name'],
         'date': datetime.now().isoformat(),
         'price': reward['price'],
         'type': reward['type']
     }
-    users_db[user_id]['rewards'].append(purchase)
-    
     transaction = {
-        'id': len(users_db[user_id]['transactions']) + 1,
         'date': datetime.now().isoformat(),
         'type': 'purchase',
         'reward_id': reward_id,
         'reward_name': reward['name'],
         'coins': -reward['price']
     }
-    users_db[user_id]['transactions'].insert(0, transaction)
+    
+    try:
+        result = storage.purchase(user_id, reward['price'], purchase, transaction,
+                                  idempotency_key=idempotency_key)
+    except InsufficientFunds:
+        return jsonify({'error': 'Недостаточно средств'}), 400
     
     if reward['type'] == 'donation':
         charity_id = reward.get('charity_id')
     
+    if idempotency_key:
+        idempotency_cache.put(user_id, idempotency_key, result)
+    return purchase_response(*result)
+
+
+def purchase_response(balance, purchase, transaction):
     return jsonify({
         'success': True,
-        'balance': users_db[user_id]['balance'],
+        'balance': balance,
         'purchase': purchase
     })
 
 
+def transactions_page(user_id, args):
+    limit = min(max(args.get('limit', 50, type=int), 1), 200)
+    before = args.get('before', type=int)
+    after = args.get('after', type=int)
+    types = parse_materials(args.getlist('type'))
+    material = args.get('material')
+    
+    try:
+        date_from = parse_date_bound(args.get('date_from'))
+        date_to = parse_date_bound(args.get('date_to'), end=True)
+    except ValueError:
+        raise ValueError('Invalid date')
+    
+    transactions = storage.list_transactions(
+        user_id,
+        limit=limit + 1,
+        before=before,
+        after=after,
+        types=types,
+        material=material,
+        date_from=date_from,
+        date_to=date_to
+    )
+    has_more = len(transactions) > limit
+    if has_more:
+        transactions = transactions[1:] if after is not None and before is None else transactions[:limit]
+    
+    return {
+        'transactions': transactions,
+        'hasMore': has_more,
+        'cursor': {
+            'before': transactions[-1]['id'] if transactions else before,
+            'after': transactions[0]['id'] if transactions else after
+        }
+    }
+
+
 @app.route('/api/transactions', methods=['GET'])
 def get_transactions():
     user_id = get_user_id_from_request()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    if user_id not in users_db:
-        users_db[user_id] = {'balance': 0, 'transactions': [], 'rewards': []}
-    
-    limit = request.args.get('limit', 50, type=int)
-    transactions = users_db[user_id]['transactions'][:limit]
-    
-    return jsonify({'transactions': transactions})
+    try:
+        return jsonify(transactions_page(user_id, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+def parse_date_bound(value, end=False):
+    if not value:
+        return None
+    if len(value) == 10:
+        day = datetime.fromisoformat(value)
+        return (day + timedelta(days=1) if end else day).isoformat()
+    moment = datetime.fromisoformat(value)
+    return (moment + timedelta(microseconds=1) if end else moment).isoformat()
 
 
 @app.route('/api/rewards/my', methods=['GET'])
@@ -372,10 +784,46 @@ def get_my_rewards():
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    if user_id not in users_db:
-        users_db[user_id] = {'balance': 0, 'transactions': [], 'rewards': []}
+    return jsonify({'rewards': storage.list_rewards(user_id)})
+
+
+def build_user_stats(user_id):
+    user_stats = storage.get_stats(user_id)
+    total_recycled = user_stats['total_weight']
+    
+    level = int(total_recycled / 100) + 1
+    points = int(total_recycled % 100)
+    
+    stats = {
+        'totalRecycled': round(total_recycled, 1),
+        'totalTransactions': user_stats['transaction_count'],
+        'totalRewards': user_stats['purchase_count'],
+        'level': level,
+        'points': points,
+        'coinsEarned': user_stats['coins_earned'],
+        'coinsSpent': user_stats['coins_spent'],
+        'materials': {
+            material: round(weight, 1) for material, weight in user_stats['materials'].items()
+        },
+        'rank': leaderboards.rank(user_id) if leaderboards.ready else None
+    }
     
-    return jsonify({'rewards': users_db[user_id]['rewards']})
+    return stats
+
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    period = request.args.get('period', 'all')
+    material = request.args.get('material') or None
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if period not in ('all', 'week'):
+        return jsonify({'error': 'Invalid period'}), 400
+    if not leaderboards.ready:
+        return jsonify({'error': 'Рейтинг загружается, попробуйте позже'}), 503
+    
+    page = leaderboards.page(period, material, offset, limit, get_user_id_from_request())
+    return jsonify(dict(page, period=period, material=material, offset=offset, limit=limit))
 
 
 @app.route('/api/user/stats', methods=['GET'])
@@ -384,127 +832,281 @@ def get_user_stats():
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    if user_id not in users_db:
-        users_db[user_id] = {'balance': 0, 'transactions': [], 'rewards': []}
-    
-    user = users_db[user_id]
+    return jsonify({'stats': build_user_stats(user_id)})
+
+
+BOOTSTRAP_SECTIONS = ('balance', 'stats', 'myRewards', 'transactions', 'rewards', 'points')
+
+
+def query_value(value):
+    """Значение поля JSON-тела в виде, в котором оно пришло бы в query string."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        raise ValueError('Nested values are not supported')
+    return str(value)
+
+
+def bootstrap_options(body):
+    options = MultiDict(request.args)
+    for key, value in body.items():
+        if key not in options:
+            options.setlist(key, [query_value(item) for item in (value if isinstance(value, list) else [value])])
+    return options
+
+
+@app.route('/api/bootstrap', methods=['GET', 'POST'])
+def bootstrap():
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({'error': 'JSON body must be an object'}), 400
+    try:
+        options = bootstrap_options(body)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    total_recycled = 0
-    total_transactions = len(user['transactions'])
-    total_rewards = len(user['rewards'])
+    init_data = request.headers.get('X-Init-Data') or options.get('initData')
+    validated = validate_init_data(init_data) if init_data else None
+    user = (validated or {}).get('user') or {}
+    user_id = user.get('id')
+    if not user_id:
+        return jsonify({'valid': False}), 401
     
-    for transaction in user['transactions']:
-        if transaction.get('type') == 'recycling' and transaction.get('weight'):
-            total_recycled += transaction['weight']
+    sections = parse_materials(options.getlist('sections')) or set(BOOTSTRAP_SECTIONS)
+    unknown = sections.difference(BOOTSTRAP_SECTIONS)
+    if unknown:
+        return jsonify({'error': f"Unknown sections: {', '.join(sorted(unknown))}"}), 400
     
-    level = int(total_recycled / 100) + 1
-    points = int(total_recycled % 100)
+    storage.ensure_user(user_id)
+    result = {'valid': True, 'userId': user_id, 'user': user}
     
-    stats = {
-        'totalRecycled': round(total_recycled, 1),
-        'totalTransactions': total_transactions,
-        'totalRewards': total_rewards,
-        'level': level,
-        'points': points
-    }
+    try:
+        if 'balance' in sections:
+            result['balance'] = storage.get_balance(user_id)
+        if 'stats' in sections:
+            result['stats'] = build_user_stats(user_id)
+        if 'myRewards' in sections:
+            result['myRewards'] = storage.list_rewards(user_id)
+        if 'transactions' in sections:
+            page_options = MultiDict({'limit': options.getlist('transactions_limit')})
+            page = transactions_page(user_id, page_options)
+            result['transactions'] = page.pop('transactions')
+            result['transactionsPage'] = page
+        if 'rewards' in sections:
+            result['rewards'] = list(catalog.current.rewards)
+        if 'points' in sections:
+            point_options = MultiDict(options)
+            point_options.setlist('limit', options.getlist('points_limit'))
+            result['points'] = find_points(point_options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except TypeError:
+        return jsonify({'error': 'Invalid parameters'}), 400
     
-    return jsonify({'stats': stats})
+    return jsonify(result)
 
 
-@app.route('/legal/agreement')
-def agreement():
-    return render_template('legal/agreement.html')
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    users = storage.rebuild_stats()
+    print(f"Статистика пересчитана для {users} пользователей")
 
 
-@app.route('/legal/privacy')
-def privacy():
-    return render_template('legal/privacy.html')
+@app.route('/api/admin/broadcasts', methods=['GET', 'POST'])
+def admin_broadcasts():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if request.method == 'GET':
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        return jsonify({'broadcasts': [broadcast_summary(job) for job in storage.list_broadcasts(limit)]})
+    
+    data = request.get_json(silent=True) or {}
+    text = data.get('text')
+    if not isinstance(text, str) or not text.strip() or len(text) > 4000:
+        return jsonify({'error': 'Invalid text'}), 400
+    
+    payload = {'text': text}
+    if data.get('button'):
+        payload['reply_markup'] = create_webapp_keyboard(str(data['button']), WEBAPP_URL)['webapp']
+    job = storage.create_broadcast(payload, storage.count_chats())
+    if data.get('start', True):
+        broadcast_runner.start(job['id'])
+    return jsonify(broadcast_summary(job)), 202
 
 
-def send_message(chat_id, text, reply_markup=None, use_simple_link=False):
-    if not BOT_TOKEN:
-        return None
+@app.route('/api/admin/broadcasts/<int:job_id>', methods=['GET'])
+def admin_broadcast(job_id):
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
     
-    if use_simple_link and WEBAPP_URL:
-        text += f"\n\n🔗 Открыть приложение: {WEBAPP_URL}"
-        reply_markup = None
+    job = storage.get_broadcast(job_id)
+    if not job:
+        return jsonify({'error': 'Broadcast not found'}), 404
+    return jsonify(broadcast_summary(job))
+
+
+@app.route('/api/admin/broadcasts/<int:job_id>/<action>', methods=['POST'])
+def admin_broadcast_action(job_id, action):
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
     
-    payload = {
-        "chat_id": chat_id,
-        "text": text,
-        "parse_mode": "HTML"
-    }
+    if action == 'resume':
+        job = storage.get_broadcast(job_id)
+        if job and job['status'] not in ('done', 'cancelled'):
+            broadcast_runner.start(job_id)
+    elif action == 'cancel':
+        job = storage.cancel_broadcast(job_id)
+    else:
+        return jsonify({'error': 'Unknown action'}), 404
     
-    if reply_markup and not use_simple_link:
-        if isinstance(reply_markup, dict) and "webapp" in reply_markup and "url" in reply_markup:
-            payload["reply_markup"] = reply_markup["webapp"]
-        elif isinstance(reply_markup, dict) and "webapp" in reply_markup:
-            payload["reply_markup"] = reply_markup["webapp"]
-        elif isinstance(reply_markup, dict) and "url" in reply_markup:
-            payload["reply_markup"] = reply_markup["url"]
-        else:
-            payload["reply_markup"] = reply_markup
+    if not job:
+        return jsonify({'error': 'Broadcast not found'}), 404
+    return jsonify(broadcast_summary(job))
+
+
+@app.cli.command('broadcast-run')
+@click.argument('job_id', type=int)
+def broadcast_run_command(job_id):
+    """Выполняет или продолжает рассылку в текущем процессе."""
+    job = broadcast_runner.run(job_id)
+    if not job:
+        print(f"Рассылка {job_id} не найдена")
+        return
+    print(json.dumps(broadcast_summary(job), ensure_ascii=False, indent=2))
+
+
+@app.route('/api/admin/catalog', methods=['GET'])
+def admin_catalog():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(catalog_watcher.stats())
+
+
+@app.route('/api/admin/catalog/reload', methods=['POST'])
+def admin_catalog_reload():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
     
-    url1 = f"{API_BASE_URL}/bot{BOT_TOKEN}/sendMessage"
-    headers1 = {"Content-Type": "application/json"}
+    try:
+        catalog_watcher.trigger()
+    except ValueError as e:
+        errors = getattr(e, 'errors', [str(e)])
+        return jsonify({'error': 'Invalid catalog', 'errors': errors[:100]}), 422
+    return jsonify(catalog_watcher.stats())
+
+
+@app.route('/api/admin/qr-codes.<fmt>.zip', methods=['GET'])
+def admin_qr_export(fmt):
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
     
+    snapshot = catalog.current
     try:
-        response = requests.post(url1, json=payload, headers=headers1, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise requests.exceptions.HTTPError(f"Status code: {response.status_code}")
-    except requests.exceptions.RequestException:
-        url2 = f"{API_BASE_URL}/bot/sendMessage"
-        headers2 = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {BOT_TOKEN}"
-        }
-        
-        try:
-            response = requests.post(url2, json=payload, headers=headers2, timeout=10)
-            if response.status_code == 200:
-                return response.json()
-        except requests.exceptions.RequestException:
-            if reply_markup and isinstance(reply_markup, dict) and "url" in reply_markup:
-                payload["reply_markup"] = reply_markup["url"]
-                try:
-                    response = requests.post(url1, json=payload, headers=headers1, timeout=10)
-                    if response.status_code == 200:
-                        return response.json()
-                except:
-                    pass
-        return None
+        chunks = qr_assets.iter_zip(snapshot, fmt, parse_qr_size(request.args))
+    except ValueError:
+        return jsonify({'error': 'Unsupported format or size', 'formats': list(QR_FORMATS),
+                        'sizes': list(qr_assets.sizes)}), 400
+    filename = f'qr-codes-v{snapshot.version}-{fmt}.zip'
+    return Response(chunks, mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
-def create_webapp_keyboard(button_text="Открыть мини-приложение", url=None):
-    webapp_url = url or WEBAPP_URL
-    
-    keyboard_webapp = {
-        "inline_keyboard": [
-            [
-                {
-                    "text": button_text,
-                    "web_app": {
-                        "url": webapp_url
-                    }
-                }
-            ]
-        ]
-    }
+@app.route('/api/admin/qr-codes', methods=['GET'])
+def admin_qr_codes():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(qr_assets.stats())
+
+
+# Размер корзины в часах и самый длинный период, который можно запросить с такими корзинами.
+ANALYTICS_GRANULARITY = {'hour': (1, 31 * 24), 'day': (24, 366 * 24), 'total': (None, None)}
+ANALYTICS_COUNTERS = ('weight', 'drops', 'coinsIssued', 'coinsRedeemed', 'purchases')
+
+
+def analytics_entry(row, snapshot):
+    start, point_id, material, *counters = row
+    entry = {}
+    if start is not None:
+        entry['start'] = (ANALYTICS_EPOCH + timedelta(hours=start)).isoformat()
+    if point_id is not None:
+        point = snapshot.get_point(point_id)
+        entry['pointId'] = point_id or None
+        entry['pointName'] = point['name'] if point else None
+    if material is not None:
+        entry['material'] = material or None
+    entry.update(zip(ANALYTICS_COUNTERS, counters))
+    entry['weight'] = round(entry['weight'], 3)
+    return entry
+
+
+@app.route('/api/admin/analytics', methods=['GET'])
+def admin_analytics():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
     
-    keyboard_url = {
-        "inline_keyboard": [
-            [
-                {
-                    "text": button_text,
-                    "url": webapp_url
-                }
-            ]
-        ]
-    }
+    args = request.args
+    granularity = args.get('granularity', 'day')
+    group = parse_materials(args.getlist('group'))
+    if granularity not in ANALYTICS_GRANULARITY or not group <= {'point', 'material'}:
+        return jsonify({'error': 'Invalid granularity or group'}), 400
+    
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    try:
+        date_from = parse_date_bound(args.get('from')) or (today - timedelta(days=6)).isoformat()
+        date_to = parse_date_bound(args.get('to'), end=True) or datetime.now().isoformat()
+        hour_from = analytics_hour(date_from)
+        hour_to = analytics_hour(date_to, round_up=True)
+    except ValueError:
+        return jsonify({'error': 'Invalid date'}), 400
+    bucket_hours, max_hours = ANALYTICS_GRANULARITY[granularity]
+    if hour_to <= hour_from or (max_hours and hour_to - hour_from > max_hours):
+        return jsonify({'error': 'Invalid range', 'maxDays': max_hours // 24 if max_hours else None}), 400
     
-    return {"webapp": keyboard_webapp, "url": keyboard_url}
+    filters = {'point_id': args.get('point', type=int), 'material': args.get('material') or None}
+    rows = storage.analytics(hour_from, hour_to, bucket_hours, 'point' in group, 'material' in group, **filters)
+    totals = storage.analytics(hour_from, hour_to, **filters)
+    snapshot = catalog.current
+    return jsonify({
+        'from': (ANALYTICS_EPOCH + timedelta(hours=hour_from)).isoformat(),
+        'to': (ANALYTICS_EPOCH + timedelta(hours=hour_to)).isoformat(),
+        'granularity': granularity,
+        'group': sorted(group),
+        'buckets': [analytics_entry(row, snapshot) for row in rows],
+        'totals': analytics_entry(totals[0], snapshot) if totals else dict.fromkeys(ANALYTICS_COUNTERS, 0)
+    })
+
+
+@app.cli.command('catalog-check')
+@click.argument('directory', required=False)
+def catalog_check_command(directory):
+    """Проверяет файлы каталога, не загружая их в работающее приложение."""
+    try:
+        points, rewards, rates = load_catalog_dir(directory or CATALOG_DIR)
+    except ValueError as e:
+        for error in getattr(e, 'errors', [str(e)]):
+            print(error)
+        raise SystemExit(1)
+    print(f"Каталог в порядке: пунктов {len(points)}, наград {len(rewards)}, материалов {len(rates)}")
+    opening_hours = HoursIndex(points, CATALOG_TIMEZONE)
+    if opening_hours.unparsed:
+        print(f"Не разобраны часы работы у {opening_hours.unparsed} пунктов: они не попадут в выборку open_now")
+    for point_id, zone_name in sorted(opening_hours.bad_timezones.items()):
+        print(f"Пункт {point_id}: неизвестный часовой пояс {zone_name}, пункт не попадет в выборку open_now")
+
+
+@app.route('/legal/agreement')
+def agreement():
+    return render_template('legal/agreement.html')
+
+
+@app.route('/legal/privacy')
+def privacy():
+    return render_template('legal/privacy.html')
 
 
 @app.route('/webhook', methods=['POST', 'GET'])
@@ -516,79 +1118,9 @@ def webhook():
         return jsonify({"ok": False, "error": "BOT_TOKEN не настроен"}), 500
     
     try:
-        if request.is_json:
-            update = request.json
-        else:
-            update = request.get_json(force=True) or {}
-        
-        if 'message' in update:
-            message = update['message']
-            chat_id = message.get('chat', {}).get('id')
-            text = message.get('text', '')
-            user = message.get('from', {})
-            user_id = user.get('id')
-            user_name = user.get('first_name', 'Пользователь')
-            
-            if text and text.startswith('/start'):
-                welcome_text = f"""👋 Привет, {user_name}!
-
-Добро пожаловать в <b>ТрешКеш</b> - мини-приложение для сдачи мусора с системой наград!
-
-🗺️ <b>Что можно делать:</b>
-• Найти ближайшие пункты приема вторсырья на карте
-• Сканировать QR-коды для быстрой фиксации сдачи
-• Загружать фото чеков для подтверждения сдачи
-• Получать трешкоины за сданный мусор
-• Обменивать баллы на награды и промокоды
-
-🔗 <b>Открыть приложение:</b> {WEBAPP_URL}
-
-Нажмите кнопку ниже или перейдите по ссылке выше."""
-                
-                keyboard = create_webapp_keyboard("🚀 Открыть ТрешКеш", WEBAPP_URL)
-                result = send_message(chat_id, welcome_text, keyboard)
-                
-                if not result:
-                    send_message(chat_id, welcome_text, use_simple_link=True)
-                
-            elif text and text.startswith('/help'):
-                help_text = f"""<b>Доступные команды:</b>
-/start - Начать работу с ботом
-/help - Показать справку
-/app - Открыть мини-приложение
-
-<b>Мини-приложение ТрешКеш:</b>
-• Карта пунктов приема
-• Сканирование QR-кодов
-• Загрузка чеков
-• Система начислений
-• Каталог наград
-
-🔗 <b>Открыть приложение:</b> {WEBAPP_URL}"""
-                
-                keyboard = create_webapp_keyboard("🚀 Открыть приложение", WEBAPP_URL)
-                result = send_message(chat_id, help_text, keyboard)
-                if not result:
-                    send_message(chat_id, help_text, use_simple_link=True)
-                
-            elif text and text.startswith('/app'):
-                app_text = f"🔗 Откройте мини-приложение по ссылке:\n\n{WEBAPP_URL}\n\nИли нажмите кнопку ниже:"
-                
-                keyboard = create_webapp_keyboard("🚀 Открыть мини-приложение", WEBAPP_URL)
-                result = send_message(chat_id, app_text, keyboard)
-                if not result:
-                    send_message(chat_id, app_text, use_simple_link=True)
-            else:
-                default_text = f"""Используйте команду /start для начала работы.
-
-🔗 <b>Открыть мини-приложение:</b> {WEBAPP_URL}"""
-                
-                keyboard = create_webapp_keyboard("🚀 Открыть приложение", WEBAPP_URL)
-                result = send_message(chat_id, default_text, keyboard)
-                if not result:
-                    send_message(chat_id, default_text, use_simple_link=True)
-        
-        return jsonify({"ok": True})
+        payload = request.get_json(force=True, silent=True)
+        result = bot.process_updates(iter_updates(payload))
+        return jsonify(dict(result, ok=True))
         
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -604,30 +1136,10 @@ def set_webhook():
     if not webhook_url:
         return jsonify({"ok": False, "error": "WEBHOOK_URL не указан"}), 400
     
-    url = f"{API_BASE_URL}/bot{BOT_TOKEN}/setWebhook"
-    payload = {
-        "url": webhook_url
-    }
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json())
-    except requests.exceptions.RequestException:
-        url = f"{API_BASE_URL}/bot/setWebhook"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {BOT_TOKEN}"
-        }
-        try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            return jsonify(response.json())
-        except requests.exceptions.RequestException as e2:
-            return jsonify({"ok": False, "error": str(e2)}), 500
+        return jsonify(max_api.call('setWebhook', {"url": webhook_url}))
+    except MaxApiError as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
 
 
 @app.route('/test-send', methods=['GET'])
@@ -643,13 +1155,13 @@ def test_send():
 Это тестовое сообщение для проверки работы бота."""
     
     keyboard = create_webapp_keyboard("🚀 Открыть ТрешКеш", WEBAPP_URL)
-    result = send_message(chat_id, test_text, keyboard)
+    result = bot.send_message(chat_id, test_text, keyboard)
     
-    if result:
+    if result is not None:
         return jsonify({"ok": True, "message": "Сообщение отправлено", "result": result}), 200
     else:
-        result2 = send_message(chat_id, test_text, use_simple_link=True)
-        if result2:
+        result2 = bot.send_message(chat_id, test_text, use_simple_link=True)
+        if result2 is not None:
             return jsonify({"ok": True, "message": "Сообщение отправлено (без кнопки)", "result": result2}), 200
         else:
             return jsonify({"ok": False, "error": "Не удалось отправить сообщение. Проверьте логи."}), 500
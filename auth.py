@@ -0,0 +1,89 @@
+"""Проверка подписи initData мини-приложения MAX.
+
+Мини-приложение присылает одну и ту же строку initData в каждом запросе
+сессии, поэтому успешно проверенные строки кэшируются (LRU + TTL), а ключ
+HMAC вычисляется один раз при создании валидатора.
+"""
+import hashlib
+import hmac
+import json
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+
+class InitDataValidator:
+    def __init__(self, secret_key, cache_size=10000, ttl=300):
+        self.enabled = bool(secret_key)
+        self._key = hashlib.sha256(secret_key.encode()).digest() if secret_key else b''
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def validate(self, init_data):
+        """Возвращает разобранные данные или None. Результат общий для кэша — не изменять."""
+        if not self.enabled:
+            return {'user': {'id': 123456, 'first_name': 'Test', 'last_name': 'User'}}
+        if not init_data:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(init_data)
+            if entry is not None:
+                data, expires_at = entry
+                if expires_at > now:
+                    self._cache.move_to_end(init_data)
+                    self.hits += 1
+                    return data
+                del self._cache[init_data]
+            self.misses += 1
+
+        data = self._verify(init_data)
+        if data is None:
+            with self._lock:
+                self.rejected += 1
+            return None
+
+        with self._lock:
+            self._cache[init_data] = (data, now + self.ttl)
+            self._cache.move_to_end(init_data)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+
+    def _verify(self, init_data):
+        try:
+            parsed = urllib.parse.parse_qs(init_data)
+            data_str = parsed.get('data', [''])[0]
+            hash_str = parsed.get('hash', [''])[0]
+
+            if not data_str or not hash_str:
+                return None
+
+            calculated_hash = hmac.new(self._key, data_str.encode(), hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(calculated_hash, hash_str):
+                return None
+
+            return json.loads(data_str)
+        except Exception as e:
+            print(f"Ошибка валидации initData: {e}")
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'rejected': self.rejected
+            }
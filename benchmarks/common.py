@@ -0,0 +1,158 @@
+"""Общие части бенчмарков: подписанный initData, синтетический каталог,
+перцентили и запись результата в JSON.
+
+Результат любого бенчмарка — объект
+
+    {"benchmark": ..., "environment": {...}, "config": {...},
+     "results": {"<имя>": {"count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", ...}}}
+
+который сравнивает compare.py.
+"""
+import hashlib
+import hmac
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Прямоугольник, в котором раскладываются синтетические пункты (Москва и область).
+AREA = (55.4, 37.2, 56.0, 38.0)
+
+
+def sign_init_data(secret_key, user, auth_date=None):
+    """initData в том формате, который проверяет auth.InitDataValidator."""
+    data = json.dumps({'user': user, 'auth_date': int(auth_date or time.time())},
+                      ensure_ascii=False, separators=(',', ':'))
+    key = hashlib.sha256(secret_key.encode()).digest()
+    signature = hmac.new(key, data.encode(), hashlib.sha256).hexdigest()
+    return urllib.parse.urlencode({'data': data, 'hash': signature})
+
+
+def bench_user(index):
+    return {'id': 1_000_000 + index, 'first_name': f'Bench{index}', 'last_name': 'User'}
+
+
+def load_rates():
+    with open(os.path.join(ROOT, 'catalog_data', 'rates.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def synthetic_points(count, rates, seed=1):
+    rnd = random.Random(seed)
+    materials = sorted(rates)
+    lat_min, lng_min, lat_max, lng_max = AREA
+    points = []
+    for i in range(1, count + 1):
+        points.append({
+            'id': i,
+            'name': f'Пункт {i}',
+            'address': f'Адрес {i}',
+            'lat': round(rnd.uniform(lat_min, lat_max), 6),
+            'lng': round(rnd.uniform(lng_min, lng_max), 6),
+            'hours': rnd.choice(('09:00-20:00', 'Пн-Пт 08:00-22:00; Сб-Вс 10:00-18:00', 'круглосуточно')),
+            'types': rnd.sample(materials, rnd.randint(1, len(materials))),
+            'qr_code': f'BENCH_{i:06d}'
+        })
+    return points
+
+
+def seed_history(storage, user_id, length, rates):
+    materials = sorted(rates)
+
+    def credit(i):
+        storage.credit(user_id, {
+            'date': f'2024-01-01T00:00:{i % 60:02d}',
+            'type': 'recycling',
+            'material_type': materials[i % len(materials)],
+            'weight': 1.0,
+            'coins': rates[materials[i % len(materials)]]
+        })
+
+    # Параллельные начисления SQLite фиксирует пакетами, заполнение занимает секунды.
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(credit, range(length)))
+
+
+def random_location(rnd):
+    lat_min, lng_min, lat_max, lng_max = AREA
+    return rnd.uniform(lat_min, lat_max), rnd.uniform(lng_min, lng_max)
+
+
+def percentile(ordered, fraction):
+    """Перцентиль по уже отсортированному списку (метод nearest-rank)."""
+    if not ordered:
+        return None
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def to_ms(value):
+    return round(value * 1000, 4) if value is not None else None
+
+
+def summarize(durations, elapsed=None, errors=0):
+    """Сводка по длительностям в секундах; elapsed — для пропускной способности."""
+    ordered = sorted(durations)
+    summary = {
+        'count': len(ordered),
+        'errors': errors,
+        'mean_ms': to_ms(sum(ordered) / len(ordered)) if ordered else None,
+        'min_ms': to_ms(ordered[0]) if ordered else None,
+        'p50_ms': to_ms(percentile(ordered, 0.50)),
+        'p95_ms': to_ms(percentile(ordered, 0.95)),
+        'p99_ms': to_ms(percentile(ordered, 0.99)),
+        'max_ms': to_ms(ordered[-1]) if ordered else None
+    }
+    if elapsed:
+        summary['throughput_rps'] = round(len(ordered) / elapsed, 2)
+    return summary
+
+
+def measure(fn, repeat, warmup=10):
+    """Время каждого из repeat вызовов fn() после warmup прогревочных."""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    clock = time.perf_counter
+    for _ in range(repeat):
+        started = clock()
+        fn()
+        durations.append(clock() - started)
+    return durations
+
+
+def environment():
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True,
+                                  timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+
+    return {
+        'commit': git('rev-parse', 'HEAD') or None,
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+
+def write_result(result, output=None):
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,72 @@
+"""Сравнение двух результатов micro.py или load.py.
+
+    python benchmarks/compare.py before.json after.json
+    python benchmarks/compare.py before.json after.json --metric p99_ms --fail-above 10
+
+Для каждого бенчмарка, который есть в обоих файлах, печатает значения
+--metric и изменение в процентах (для времени рост — это замедление, для
+throughput_rps — ускорение). С --fail-above код выхода 1, если какой-то
+бенчмарк стал хуже больше чем на столько процентов.
+"""
+import argparse
+import json
+import sys
+
+# Для этих метрик больше — лучше.
+HIGHER_IS_BETTER = {'throughput_rps'}
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(before, after, metric):
+    """Строки (имя, было, стало, изменение %, ухудшение %) по общим бенчмаркам."""
+    rows = []
+    for name in sorted(set(before['results']) & set(after['results'])):
+        old = before['results'][name].get(metric)
+        new = after['results'][name].get(metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        regression = -change if metric in HIGHER_IS_BETTER else change
+        rows.append((name, old, new, change, regression))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение результатов бенчмарков')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--metric', default='p50_ms', help='p50_ms, p95_ms, p99_ms, mean_ms, throughput_rps')
+    parser.add_argument('--fail-above', type=float, help='допустимое ухудшение, проценты')
+    parser.add_argument('--json', action='store_true', help='вывести сравнение в JSON')
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    if before.get('benchmark') != after.get('benchmark'):
+        raise SystemExit(f"Разные бенчмарки: {before.get('benchmark')} и {after.get('benchmark')}")
+    rows = compare(before, after, args.metric)
+
+    if args.json:
+        print(json.dumps({
+            'metric': args.metric,
+            'before': before.get('environment', {}).get('commit'),
+            'after': after.get('environment', {}).get('commit'),
+            'results': {name: {'before': old, 'after': new, 'change_pct': round(change, 2)}
+                        for name, old, new, change, _ in rows}
+        }, ensure_ascii=False, indent=2))
+    else:
+        width = max((len(row[0]) for row in rows), default=10)
+        print(f"{'benchmark':<{width}}  {'before':>12}  {'after':>12}  {'change':>8}")
+        for name, old, new, change, regression in rows:
+            mark = '  !' if args.fail_above is not None and regression > args.fail_above else ''
+            print(f'{name:<{width}}  {old:>12.4f}  {new:>12.4f}  {change:>+7.1f}%{mark}')
+
+    if args.fail_above is not None and any(row[4] > args.fail_above for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""Нагрузочный тест полного приложения под gunicorn.
+
+    python benchmarks/load.py --duration 30 --concurrency 32 --output load.json
+
+Скрипт поднимает в отдельном временном каталоге всё окружение:
+синтетический каталог из --points пунктов, базу SQLite с историей
+пользователей, заглушку MAX Bot API (tools/max_api_stub.py, с задержкой
+--stub-delay) и gunicorn с --workers воркерами. Клиенты — потоки с
+собственными HTTP-сессиями; у каждого виртуального пользователя свой
+подписанный initData, как у мини-приложения. Запросы выбираются случайно
+по весам сценариев (--mix), замеры первых --warmup секунд отбрасываются.
+
+Результат — JSON с p50/p95/p99 и пропускной способностью по каждому
+сценарию и в целом (results._total), сравнивается через compare.py.
+Клиент работает на той же машине, поэтому для честных цифр держите
+--concurrency не больше, чем позволяют свободные ядра.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from common import (ROOT, bench_user, environment, load_rates, random_location, seed_history,
+                    sign_init_data, summarize, synthetic_points, write_result)
+
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+from max_api_stub import StubServer  # noqa: E402
+
+SECRET = 'load-secret'
+BOT_TOKEN = 'load-bot-token'
+DEFAULT_MIX = 'nearest=30,balance=20,validate=10,submit=10,transactions=10,stats=10,rewards=5,webhook=5'
+
+
+class Scenarios:
+    """Запросы мини-приложения и бота; каждый возвращает requests.Response."""
+
+    def __init__(self, points, rates, users):
+        self.points = points
+        self.rates = rates
+        self.users = users
+
+    def nearest(self, session, user, rnd):
+        lat, lng = random_location(rnd)
+        return session.get('/api/recycling-points', params={'lat': lat, 'lng': lng, 'limit': 20},
+                           headers=user['headers'])
+
+    def balance(self, session, user, rnd):
+        return session.get('/api/user/balance', headers=user['headers'])
+
+    def validate(self, session, user, rnd):
+        return session.post('/api/validate', json={'initData': user['init_data']})
+
+    def submit(self, session, user, rnd):
+        point = rnd.choice(self.points)
+        return session.post('/api/recycling/submit', headers=user['headers'], json={
+            'method': 'qr',
+            'qrCode': point['qr_code'],
+            'materialType': rnd.choice(point['types']),
+            'weight': round(rnd.uniform(0.5, 5.0), 1)
+        })
+
+    def submit_batch(self, session, user, rnd):
+        drops = []
+        for _ in range(5):
+            point = rnd.choice(self.points)
+            drops.append({
+                'clientId': f'load-{rnd.getrandbits(64):x}',
+                'qrCode': point['qr_code'],
+                'materialType': rnd.choice(point['types']),
+                'weight': round(rnd.uniform(0.5, 5.0), 1)
+            })
+        return session.post('/api/recycling/submit-batch', headers=user['headers'], json={'drops': drops})
+
+    def transactions(self, session, user, rnd):
+        return session.get('/api/transactions', params={'limit': 20}, headers=user['headers'])
+
+    def stats(self, session, user, rnd):
+        return session.get('/api/user/stats', headers=user['headers'])
+
+    def rewards(self, session, user, rnd):
+        return session.get('/api/rewards')
+
+    def webhook(self, session, user, rnd):
+        return session.post('/webhook', json={
+            'update_type': 'message_created',
+            'message': {
+                'message_id': f'load-{user["id"]}-{rnd.getrandbits(48)}',
+                'chat': {'id': user['id']},
+                'from': {'id': user['id'], 'first_name': 'Load'},
+                'text': rnd.choice(('/start', '/help', '/app'))
+            }
+        })
+
+
+class _BaseUrlSession(requests.Session):
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(method, self.base_url + url, *args, **kwargs)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if not hasattr(Scenarios, name):
+            raise SystemExit(f'Неизвестный сценарий: {name}')
+        if float(weight or 1) > 0:
+            mix[name] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare(directory, args, rates):
+    catalog_dir = os.path.join(directory, 'catalog')
+    os.makedirs(catalog_dir)
+    points = synthetic_points(args.points, rates, seed=args.seed)
+    with open(os.path.join(catalog_dir, 'points.json'), 'w', encoding='utf-8') as f:
+        json.dump(points, f, ensure_ascii=False)
+    for name in ('rewards.json', 'rates.json'):
+        shutil.copy(os.path.join(ROOT, 'catalog_data', name), catalog_dir)
+
+    # История пишется до старта gunicorn, напрямую в ту же базу.
+    from storage import create_storage
+
+    database = os.path.join(directory, 'load.db')
+    storage = create_storage('sqlite', database)
+    for index in range(args.users):
+        user_id = bench_user(index)['id']
+        storage.ensure_user(user_id)
+        if args.history:
+            seed_history(storage, user_id, args.history, rates)
+    storage.close()
+    return points, catalog_dir, database
+
+
+def start_gunicorn(directory, args, catalog_dir, database, stub_url):
+    port = free_port()
+    env = dict(
+        os.environ,
+        MAX_SECRET_KEY=SECRET,
+        BOT_TOKEN=BOT_TOKEN,
+        MAX_API_BASE_URL=stub_url,
+        STORAGE_BACKEND='sqlite',
+        DATABASE_PATH=database,
+        CATALOG_DIR=catalog_dir,
+        UPLOAD_DIR=os.path.join(directory, 'uploads'),
+        QR_DIR=os.path.join(directory, 'qr'),
+        QR_PRERENDER='0',
+        METRICS_DIR=os.path.join(directory, 'metrics')
+    )
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+    log = open(os.path.join(directory, 'gunicorn.log'), 'w')
+    # Рабочий каталог — корень репозитория: gunicorn подхватит gunicorn.conf.py.
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'gunicorn завершился с кодом {process.returncode}, см. {log.name}')
+        try:
+            if requests.get(base_url + '/webhook', timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn не ответил за 60 секунд')
+
+
+def run_clients(base_url, scenarios, mix, args):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    warmup_until = time.monotonic() + args.warmup
+    deadline = warmup_until + args.duration
+    samples = {name: [] for name in names}
+    errors = dict.fromkeys(names, 0)
+    lock = threading.Lock()
+
+    def client(number):
+        rnd = random.Random(args.seed * 1000 + number)
+        session = _BaseUrlSession(base_url)
+        local = {name: [] for name in names}
+        local_errors = dict.fromkeys(names, 0)
+        while True:
+            started = time.monotonic()
+            if started >= deadline:
+                break
+            name = rnd.choices(names, weights)[0]
+            user = rnd.choice(scenarios.users)
+            try:
+                response = getattr(scenarios, name)(session, user, rnd)
+                failed = response.status_code >= 400
+                response.content  # noqa: B018 — тело дочитывается в замер
+            except requests.RequestException:
+                failed = True
+            elapsed = time.monotonic() - started
+            if started < warmup_until:
+                continue
+            local[name].append(elapsed)
+            if failed:
+                local_errors[name] += 1
+        session.close()
+        with lock:
+            for name in names:
+                samples[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {name: summarize(samples[name], args.duration, errors[name]) for name in names}
+    results['_total'] = summarize([d for name in names for d in samples[name]], args.duration,
+                                  sum(errors.values()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест TrashCash под gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='воркеры gunicorn')
+    parser.add_argument('--threads', type=int, default=1, help='потоки в воркере gunicorn')
+    parser.add_argument('--concurrency', type=int, default=16, help='параллельные клиенты')
+    parser.add_argument('--duration', type=float, default=30, help='длительность замера, секунды')
+    parser.add_argument('--warmup', type=float, default=5, help='прогрев без замеров, секунды')
+    parser.add_argument('--points', type=int, default=10000, help='пунктов в каталоге')
+    parser.add_argument('--users', type=int, default=500, help='виртуальных пользователей')
+    parser.add_argument('--history', type=int, default=0, help='транзакций в истории каждого пользователя')
+    parser.add_argument('--stub-delay', type=float, default=0.02, help='задержка заглушки MAX API, секунды')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='веса сценариев: name=weight,...')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='не удалять временный каталог (логи, база)')
+    parser.add_argument('--output', help='файл JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    rates = load_rates()
+    directory = tempfile.mkdtemp(prefix='trashcash-load-')
+    stub = StubServer(delay=args.stub_delay).start()
+    process = None
+    try:
+        print(f'Подготовка данных в {directory}...', file=sys.stderr)
+        points, catalog_dir, database = prepare(directory, args, rates)
+        users = []
+        for index in range(args.users):
+            user = bench_user(index)
+            init_data = sign_init_data(SECRET, user)
+            users.append({'id': user['id'], 'init_data': init_data, 'headers': {'X-Init-Data': init_data}})
+
+        process, base_url = start_gunicorn(directory, args, catalog_dir, database, stub.url)
+        print(f'Нагрузка {args.concurrency} клиентов, {args.warmup:g}+{args.duration:g} с...', file=sys.stderr)
+        results = run_clients(base_url, Scenarios(points, rates, users), mix, args)
+        with stub.state.lock:
+            stub_messages = len(stub.state.messages)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        stub.stop()
+        if args.keep:
+            print(f'Временный каталог сохранен: {directory}', file=sys.stderr)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    write_result({
+        'benchmark': 'load',
+        'environment': environment(),
+        'config': {
+            'workers': args.workers, 'threads': args.threads, 'concurrency': args.concurrency,
+            'duration': args.duration, 'warmup': args.warmup, 'points': args.points,
+            'users': args.users, 'history': args.history, 'stub_delay': args.stub_delay,
+            'mix': mix, 'seed': args.seed
+        },
+        'results': results,
+        'stub_messages': stub_messages
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Микробенчмарки горячих путей API без сети и gunicorn.
+
+    python benchmarks/micro.py --output before.json
+    python benchmarks/micro.py --only nearest --sizes 1000,100000
+
+Группы (фильтр --only — подстрока имени):
+    init_data.*          проверка подписи initData: без кэша, попадание в кэш, неверная подпись
+    nearest.<n>.*        поиск ближайших пунктов в GridIndex на каталоге из n пунктов
+    points_route.<n>     GET /api/recycling-points?lat=..&lng=..&limit=20 через тестовый клиент Flask
+    storage.<backend>.<h>.*  статистика и страницы истории пользователя с h транзакциями
+
+Данные синтетические и детерминированные (--seed, свой генератор у
+каждого бенчмарка), поэтому результаты разных коммитов и разных наборов
+--only/--sizes сравнимы через compare.py.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from common import (bench_user, environment, load_rates, measure, random_location, seed_history,
+                    sign_init_data, summarize, synthetic_points, write_result)
+
+SECRET = 'benchmark-secret'
+
+
+def bench_init_data(results, repeat, seed):
+    rnd = random.Random(f'{seed}:init_data')
+    from auth import InitDataValidator
+
+    user_data = [sign_init_data(SECRET, bench_user(i)) for i in range(1000)]
+    # cache_size=0: каждая проверка считает HMAC и разбирает JSON заново.
+    cold = InitDataValidator(SECRET, cache_size=0)
+    warm = InitDataValidator(SECRET, cache_size=len(user_data))
+    for init_data in user_data:
+        warm.validate(init_data)
+    forged = user_data[0][:-4] + '0000'
+
+    results['init_data.verify'] = summarize(measure(lambda: cold.validate(rnd.choice(user_data)), repeat))
+    results['init_data.cached'] = summarize(measure(lambda: warm.validate(rnd.choice(user_data)), repeat))
+    results['init_data.invalid'] = summarize(measure(lambda: cold.validate(forged), repeat))
+
+
+def bench_nearest(results, sizes, repeat, seed, rates):
+    from geo import GridIndex
+
+    material = sorted(rates)[0]
+    for size in sizes:
+        rnd = random.Random(f'{seed}:nearest:{size}')
+        index = GridIndex(synthetic_points(size, rates))
+        locations = [random_location(rnd) for _ in range(256)]
+
+        def nearest(limit=20, radius_km=None, predicate=None):
+            lat, lng = rnd.choice(locations)
+            index.nearest(lat, lng, limit=limit, radius_km=radius_km, predicate=predicate)
+
+        results[f'nearest.{size}.limit20'] = summarize(measure(nearest, repeat))
+        results[f'nearest.{size}.radius2km'] = summarize(measure(lambda: nearest(None, 2.0), repeat))
+        results[f'nearest.{size}.material'] = summarize(
+            measure(lambda: nearest(predicate=lambda p: material in p['types']), repeat)
+        )
+
+
+def bench_points_route(results, sizes, repeat, seed, rates):
+    import app as application
+
+    client = application.app.test_client()
+    rewards = application.catalog.current.rewards
+    for size in sizes:
+        rnd = random.Random(f'{seed}:points_route:{size}')
+        application.catalog.load(synthetic_points(size, rates), rewards, rates)
+        locations = [random_location(rnd) for _ in range(256)]
+
+        def request():
+            lat, lng = rnd.choice(locations)
+            response = client.get(f'/api/recycling-points?lat={lat}&lng={lng}&limit=20')
+            assert response.status_code == 200, response.status_code
+
+        results[f'points_route.{size}'] = summarize(measure(request, repeat))
+
+
+def bench_storage(results, histories, repeat, seed, rates, directory):
+    from storage import create_storage
+
+    rare = sorted(rates)[-1]
+    for backend in ('memory', 'sqlite'):
+        storage = create_storage(backend, os.path.join(directory, 'bench.db'))
+        for user_index, length in enumerate(histories):
+            rnd = random.Random(f'{seed}:storage:{backend}:{length}')
+            user_id = bench_user(user_index)['id']
+            seed_history(storage, user_id, length, rates)
+            ids = [t['id'] for t in storage.list_transactions(user_id, limit=None)]
+            prefix = f'storage.{backend}.{length}'
+
+            results[f'{prefix}.stats'] = summarize(measure(lambda: storage.get_stats(user_id), repeat))
+            results[f'{prefix}.first_page'] = summarize(
+                measure(lambda: storage.list_transactions(user_id, limit=51), repeat)
+            )
+            results[f'{prefix}.cursor_page'] = summarize(
+                measure(lambda: storage.list_transactions(user_id, limit=51, before=rnd.choice(ids)), repeat)
+            )
+            results[f'{prefix}.material_page'] = summarize(
+                measure(lambda: storage.list_transactions(user_id, limit=51, material=rare), repeat)
+            )
+        storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки TrashCash')
+    parser.add_argument('--repeat', type=int, default=2000, help='замеров на бенчмарк')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='размеры каталога')
+    parser.add_argument('--histories', default='100,1000,10000', help='длины истории пользователя')
+    parser.add_argument('--only', default='', help='запускать только группы с этой подстрокой')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    histories = [int(length) for length in args.histories.split(',') if length]
+    rates = load_rates()
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix='trashcash-bench-') as directory:
+        # Приложение импортируется только для points_route; фоновые потоки ему не нужны.
+        os.environ.update(
+            MAX_SECRET_KEY=SECRET, STORAGE_BACKEND='memory', CATALOG_WATCH_INTERVAL='0',
+            METRICS_DIR='', METRICS_FLUSH_INTERVAL='0', UPLOAD_DIR=os.path.join(directory, 'uploads'),
+            QR_DIR=os.path.join(directory, 'qr'), QR_PRERENDER='0'
+        )
+        groups = [
+            ('init_data', lambda: bench_init_data(results, args.repeat, args.seed)),
+            ('nearest', lambda: bench_nearest(results, sizes, args.repeat, args.seed, rates)),
+            ('points_route', lambda: bench_points_route(results, sizes, args.repeat, args.seed, rates)),
+            ('storage', lambda: bench_storage(results, histories, args.repeat, args.seed, rates, directory))
+        ]
+        for name, run in groups:
+            if args.only and args.only not in name:
+                continue
+            print(f'{name}...', file=sys.stderr)
+            run()
+
+    write_result({
+        'benchmark': 'micro',
+        'environment': environment(),
+        'config': {'repeat': args.repeat, 'sizes': sizes, 'histories': histories, 'seed': args.seed},
+        'results': results
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Обработка обновлений бота ТрешКеш.
+
+Один и тот же диспетчер команд (/start, /help, /app) используется webhook'ом
+в app.py и отдельным процессом long polling (poller.py). Ответы ставятся в
+SendQueue, повторные доставки отбрасываются по ключу обновления.
+"""
+import threading
+
+from max_api import MaxApiError
+from updates import SeenUpdates, update_key
+
+
+def create_webapp_keyboard(button_text, webapp_url):
+    keyboard_webapp = {
+        "inline_keyboard": [
+            [
+                {
+                    "text": button_text,
+                    "web_app": {
+                        "url": webapp_url
+                    }
+                }
+            ]
+        ]
+    }
+    
+    keyboard_url = {
+        "inline_keyboard": [
+            [
+                {
+                    "text": button_text,
+                    "url": webapp_url
+                }
+            ]
+        ]
+    }
+    
+    return {"webapp": keyboard_webapp, "url": keyboard_url}
+
+
+class Bot:
+    def __init__(self, max_api, send_queue, storage, webapp_url, dedup_ttl=600):
+        self.max_api = max_api
+        self.send_queue = send_queue
+        self.storage = storage
+        self.webapp_url = webapp_url
+        self.dedup_ttl = dedup_ttl
+        self.seen_updates = SeenUpdates(dedup_ttl)
+        self.send_errors = 0
+        self.fallbacks = {'url': 0, 'simple_link': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count_fallback(self, kind):
+        with self._stats_lock:
+            self.fallbacks[kind] += 1
+
+    def send_message(self, chat_id, text, reply_markup=None, use_simple_link=False, raise_unavailable=False):
+        """Ответ sendMessage (тело может быть и пустым) или None, если отправить не удалось.
+
+        С raise_unavailable ошибка недоступности API пробрасывается: очередь
+        повторит отправку позже, а запасные варианты клавиатуры не пробуются.
+        """
+        if not self.max_api.token:
+            return None
+        
+        if use_simple_link and self.webapp_url:
+            text += f"\n\n🔗 Открыть приложение: {self.webapp_url}"
+            reply_markup = None
+        
+        payload = {
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML"
+        }
+        
+        if reply_markup and not use_simple_link:
+            if isinstance(reply_markup, dict) and "webapp" in reply_markup and "url" in reply_markup:
+                payload["reply_markup"] = reply_markup["webapp"]
+            elif isinstance(reply_markup, dict) and "webapp" in reply_markup:
+                payload["reply_markup"] = reply_markup["webapp"]
+            elif isinstance(reply_markup, dict) and "url" in reply_markup:
+                payload["reply_markup"] = reply_markup["url"]
+            else:
+                payload["reply_markup"] = reply_markup
+        
+        try:
+            return self.max_api.call('sendMessage', payload)
+        except MaxApiError as e:
+            with self._stats_lock:
+                self.send_errors += 1
+            print(f"Ошибка sendMessage в чат {chat_id}: {e}")
+            if e.unavailable:
+                if raise_unavailable:
+                    raise
+                return None
+            if reply_markup and isinstance(reply_markup, dict) and "url" in reply_markup:
+                self._count_fallback('url')
+                payload["reply_markup"] = reply_markup["url"]
+                try:
+                    return self.max_api.call('sendMessage', payload)
+                except MaxApiError as e:
+                    with self._stats_lock:
+                        self.send_errors += 1
+                    if raise_unavailable and e.unavailable:
+                        raise
+        return None
+
+    def queue_reply(self, chat_id, text, keyboard):
+        def job():
+            # Любой ответ без исключения — сообщение доставлено, даже если тело не разобралось.
+            if self.send_message(chat_id, text, keyboard, raise_unavailable=True) is not None:
+                return True
+            self._count_fallback('simple_link')
+            return self.send_message(chat_id, text, use_simple_link=True, raise_unavailable=True) is not None
+        
+        return self.send_queue.submit(chat_id, job)
+
+    def remember_chat(self, chat_id, user_id):
+        # Рассылки идут по чатам, в которых пользователь запускал бота.
+        if not isinstance(chat_id, int) or isinstance(chat_id, bool):
+            return
+        try:
+            self.storage.save_chat(chat_id, user_id)
+        except Exception as e:
+            print(f"Не удалось сохранить чат {chat_id}: {e}")
+
+    def handle_update(self, update):
+        if 'message' in update:
+            message = update['message']
+            chat_id = message.get('chat', {}).get('id')
+            text = message.get('text', '')
+            user = message.get('from', {})
+            user_id = user.get('id')
+            user_name = user.get('first_name', 'Пользователь')
+            
+            if text and text.startswith('/start'):
+                self.remember_chat(chat_id, user_id)
+                welcome_text = f"""👋 Привет, {user_name}!
+
+Добро пожаловать в <b>ТрешКеш</b> - мини-приложение для сдачи мусора с системой наград!
+
+🗺️ <b>Что можно делать:</b>
+• Найти ближайшие пункты приема вторсырья на карте
+• Сканировать QR-коды для быстрой фиксации сдачи
+• Загружать фото чеков для подтверждения сдачи
+• Получать трешкоины за сданный мусор
+• Обменивать баллы на награды и промокоды
+
+🔗 <b>Открыть приложение:</b> {self.webapp_url}
+
+Нажмите кнопку ниже или перейдите по ссылке выше."""
+                
+                keyboard = create_webapp_keyboard("🚀 Открыть ТрешКеш", self.webapp_url)
+                self.queue_reply(chat_id, welcome_text, keyboard)
+                
+            elif text and text.startswith('/help'):
+                help_text = f"""<b>Доступные команды:</b>
+/start - Начать работу с ботом
+/help - Показать справку
+/app - Открыть мини-приложение
+
+<b>Мини-приложение ТрешКеш:</b>
+• Карта пунктов приема
+• Сканирование QR-кодов
+• Загрузка чеков
+• Система начислений
+• Каталог наград
+
+🔗 <b>Открыть приложение:</b> {self.webapp_url}"""
+                
+                keyboard = create_webapp_keyboard("🚀 Открыть приложение", self.webapp_url)
+                self.queue_reply(chat_id, help_text, keyboard)
+                
+            elif text and text.startswith('/app'):
+                app_text = f"🔗 Откройте мини-приложение по ссылке:\n\n{self.webapp_url}\n\nИли нажмите кнопку ниже:"
+                
+                keyboard = create_webapp_keyboard("🚀 Открыть мини-приложение", self.webapp_url)
+                self.queue_reply(chat_id, app_text, keyboard)
+            else:
+                default_text = f"""Используйте команду /start для начала работы.
+
+🔗 <b>Открыть мини-приложение:</b> {self.webapp_url}"""
+                
+                keyboard = create_webapp_keyboard("🚀 Открыть приложение", self.webapp_url)
+                self.queue_reply(chat_id, default_text, keyboard)
+
+    def fresh_updates(self, updates):
+        """Новые обновления из пачки в исходном порядке, без повторных доставок."""
+        candidates = []
+        for update in updates:
+            key = update_key(update)
+            if key is None or self.seen_updates.add(key):
+                candidates.append((key, update))
+        
+        keys = [key for key, _ in candidates if key is not None]
+        claimed = set()
+        if keys:
+            try:
+                claimed = self.storage.claim_updates(keys, self.dedup_ttl)
+            except Exception as e:
+                # Лучше ответить дважды, чем потерять обновление, уже отмеченное в памяти.
+                print(f"Ошибка дедупликации обновлений: {e}")
+                claimed = set(keys)
+        return [update for key, update in candidates if key is None or key in claimed]
+
+    def release_updates(self, updates):
+        """Забывает обновления, которые были отобраны, но не обработаны: их повтор примется."""
+        keys = [key for key in map(update_key, updates) if key is not None]
+        for key in keys:
+            self.seen_updates.discard(key)
+        if keys:
+            try:
+                self.storage.release_updates(keys)
+            except Exception as e:
+                print(f"Не удалось снять отметки обновлений: {e}")
+
+    def dispatch(self, update):
+        try:
+            self.handle_update(update)
+        except Exception as e:
+            print(f"Ошибка обработки обновления: {e}")
+
+    def process_updates(self, updates):
+        fresh = self.fresh_updates(updates)
+        for update in fresh:
+            self.dispatch(update)
+        return {'received': len(updates), 'processed': len(fresh), 'duplicates': len(updates) - len(fresh)}
+
+    def stats(self):
+        with self._stats_lock:
+            return {'send_errors': self.send_errors, 'fallbacks': dict(self.fallbacks)}
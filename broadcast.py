@@ -0,0 +1,187 @@
+"""Массовые рассылки пользователям бота.
+
+Задание рассылки хранится в хранилище вместе с курсором — последним
+обработанным chat_id. Получатели — личные чаты, в которых пользователи
+запускали бота (/start), они читаются страницами по возрастанию id.
+Каждая страница отправляется пулом потоков через общий MaxApiClient с
+общим лимитом скорости, после чего курсор и счетчики фиксируются. После
+падения процесса задание продолжается с курсора: повторно может уйти не
+больше одной страницы.
+
+Если API недоступно (нет связи, 5xx, открыт circuit breaker), получатели
+не списываются в неудачные: курсор сдвигается только по обработанному
+началу страницы, а остаток отправляется заново после паузы.
+
+Выполнять задание может только владелец аренды (lease), которая
+продлевается на каждой странице, поэтому два воркера gunicorn или
+параллельный запуск из CLI не отправят одну рассылку дважды.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from max_api import MaxApiError
+from outbox import TokenBucket
+
+# Ошибки, после которых повтор бессмыслен: бот заблокирован, чат не найден и т.п.
+PERMANENT_STATUSES = frozenset({400, 403, 404})
+
+SENT, FAILED, UNAVAILABLE = 'sent', 'failed', 'unavailable'
+
+
+def broadcast_summary(job):
+    """Задание без служебных полей, с прогрессом и скоростью отправки."""
+    processed = job['sent'] + job['failed']
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'text': job['payload'].get('text'),
+        'total': job['total'],
+        'sent': job['sent'],
+        'failed': job['failed'],
+        'progress': round(processed / job['total'], 4) if job['total'] else 1.0,
+        'messages_per_second': round(processed / job['elapsed'], 2) if job['elapsed'] else 0.0,
+        'cursor': job['cursor'],
+        'created': job['created'],
+        'started': job['started'],
+        'finished': job['finished']
+    }
+
+
+class BroadcastRunner:
+    def __init__(self, storage, max_api, rate=25.0, workers=8, page_size=500,
+                 retries=2, backoff=1.0, lease=120, pause=None):
+        self.storage = storage
+        self.max_api = max_api
+        self.rate = rate
+        self.workers = workers
+        self.page_size = page_size
+        self.retries = retries
+        self.backoff = backoff
+        # По умолчанию пауза равна времени, через которое circuit breaker пропустит пробный запрос.
+        self.pause = pause if pause is not None else max(
+            breaker.reset_timeout for breaker in max_api.breakers.values()
+        )
+        # Аренда должна переживать отправку целой страницы с учетом лимита скорости и паузу.
+        lease = max(lease, 2 * self.pause)
+        self.lease = max(lease, 2 * page_size / rate) if rate > 0 else lease
+        self._instance = uuid.uuid4().hex
+        self._threads = {}
+        self._stops = {}
+        self._lock = threading.Lock()
+        self.retried = 0
+        self.pauses = 0
+
+    @property
+    def owner(self):
+        # pid в имени владельца: воркеры gunicorn с --preload делят один объект.
+        return f'{self._instance}-{os.getpid()}'
+
+    def _send(self, bucket, stop_event, unavailable, chat_id, payload):
+        for attempt in range(self.retries + 1):
+            # После сбоя API остаток страницы не отправляется: он уйдет после паузы.
+            if unavailable.is_set():
+                return UNAVAILABLE
+            if bucket is not None:
+                bucket.acquire(stop_event)
+            if stop_event.is_set():
+                return None
+            try:
+                self.max_api.call('sendMessage', dict(payload, chat_id=chat_id))
+                return SENT
+            except MaxApiError as e:
+                if e.unavailable:
+                    unavailable.set()
+                    return UNAVAILABLE
+                if e.status_code in PERMANENT_STATUSES:
+                    return FAILED
+            if attempt < self.retries:
+                with self._lock:
+                    self.retried += 1
+                if stop_event.wait(self.backoff * (2 ** attempt)):
+                    return None
+        return FAILED
+
+    def run(self, job_id, stop_event=None):
+        """Выполняет рассылку до конца, отмены или stop_event. Возвращает задание."""
+        stop_event = stop_event or threading.Event()
+        owner = self.owner
+        job = self.storage.claim_broadcast(job_id, owner, self.lease)
+        if job is None:
+            return self.storage.get_broadcast(job_id)
+
+        payload = {'text': job['payload']['text'], 'parse_mode': 'HTML'}
+        if job['payload'].get('reply_markup'):
+            payload['reply_markup'] = job['payload']['reply_markup']
+        bucket = TokenBucket(self.rate) if self.rate > 0 else None
+        cursor = job['cursor']
+
+        try:
+            with ThreadPoolExecutor(self.workers, thread_name_prefix=f'broadcast-{job_id}') as pool:
+                while not stop_event.is_set():
+                    page = self.storage.chat_ids(after=cursor, limit=self.page_size)
+                    started = time.monotonic()
+                    unavailable = threading.Event()
+                    results = list(pool.map(
+                        lambda chat_id: self._send(bucket, stop_event, unavailable, chat_id, payload), page
+                    ))
+                    if stop_event.is_set():
+                        # Страница прервана: не сдвигаем курсор, она будет отправлена заново.
+                        break
+                    done = results.index(UNAVAILABLE) if UNAVAILABLE in results else len(results)
+                    sent = results[:done].count(SENT)
+                    cursor = page[done - 1] if done else cursor
+                    if not self.storage.save_broadcast_progress(
+                        job_id, owner, cursor, sent, done - sent, time.monotonic() - started, self.lease,
+                        finished=done == len(page) and len(page) < self.page_size
+                    ):
+                        break
+                    if done < len(page):
+                        with self._lock:
+                            self.pauses += 1
+                        print(f"Рассылка {job_id}: MAX API недоступен, пауза {self.pause:g} с")
+                        if stop_event.wait(self.pause):
+                            break
+                        continue
+                    if len(page) < self.page_size:
+                        break
+        finally:
+            self.storage.release_broadcast(job_id, owner)
+        return self.storage.get_broadcast(job_id)
+
+    def start(self, job_id):
+        """Запускает рассылку в фоновом потоке этого процесса."""
+        with self._lock:
+            thread = self._threads.get(job_id)
+            if thread is not None and thread.is_alive():
+                return False
+            stop_event = threading.Event()
+            thread = threading.Thread(target=self._run_logged, args=(job_id, stop_event),
+                                      name=f'broadcast-{job_id}', daemon=True)
+            self._threads[job_id] = thread
+            self._stops[job_id] = stop_event
+            thread.start()
+            return True
+
+    def _run_logged(self, job_id, stop_event):
+        try:
+            job = self.run(job_id, stop_event)
+            if job:
+                print(f"Рассылка {job_id}: {job['status']}, отправлено {job['sent']}, ошибок {job['failed']}")
+        except Exception as e:
+            print(f"Ошибка рассылки {job_id}: {e}")
+
+    def stop(self, timeout=10.0):
+        with self._lock:
+            threads = list(self._threads.items())
+            for stop_event in self._stops.values():
+                stop_event.set()
+        for _, thread in threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for thread in self._threads.values() if thread.is_alive())
+            return {'running': running, 'retried': self.retried, 'pauses': self.pauses}
@@ -0,0 +1,102 @@
+"""Каталог пунктов приема, наград и тарифов.
+
+Каталог хранится как неизменяемый снимок вместе с производными индексами
+(по id, по QR-коду, пространственным, пирамидой кластеров для карты,
+разобранными часами работы) и заранее сериализованными ответами API. При
+перезагрузке новый снимок строится целиком и подменяется одним
+присваиванием, поэтому запрос, который уже взял catalog.current, до конца
+работает с согласованными данными.
+"""
+import threading
+
+from clusters import ClusterPyramid
+from geo import GridIndex
+from hours import HoursIndex, load_zone
+from http_cache import CachedBody
+
+
+class CatalogSnapshot:
+    def __init__(self, points, rewards, rates, version, timezone='Europe/Moscow'):
+        self.version = version
+        self.points = tuple(points)
+        self.rewards = tuple(rewards)
+        self.rates = dict(rates)
+
+        self.points_by_id = self._index(self.points, 'id', 'пункта')
+        self.points_by_qr = self._index(
+            (p for p in self.points if p.get('qr_code')), 'qr_code', 'QR-кода пункта'
+        )
+        self.rewards_by_id = self._index(self.rewards, 'id', 'награды')
+        self.points_index = GridIndex(self.points)
+        self.point_clusters = ClusterPyramid(self.points)
+        self.opening_hours = HoursIndex(self.points, timezone)
+
+        self.points_response = CachedBody.from_list('points', self.points)
+        self.rewards_response = CachedBody.from_list('rewards', self.rewards)
+        # Ответы по отдельным пунктам сериализуются при первом запросе: на
+        # десятках тысяч пунктов заранее это заметно удлиняет перезагрузку.
+        self._point_responses = {}
+
+    @staticmethod
+    def _index(items, key, label):
+        index = {}
+        for item in items:
+            value = item[key]
+            if value in index:
+                raise ValueError(f'Повторяющийся {key} {label}: {value}')
+            index[value] = item
+        return index
+
+    @staticmethod
+    def _lookup(index, key):
+        try:
+            return index.get(key)
+        except TypeError:
+            return None
+
+    def get_point(self, point_id):
+        return self._lookup(self.points_by_id, point_id)
+
+    def get_point_by_qr(self, qr_code):
+        return self._lookup(self.points_by_qr, qr_code)
+
+    def point_response(self, point_id):
+        cached = self._point_responses.get(point_id)
+        if cached is None:
+            point = self.get_point(point_id)
+            if point is None:
+                return None
+            # Гонка двух потоков безвредна: оба построят одинаковый ответ.
+            cached = self._point_responses.setdefault(point_id, CachedBody(point))
+        return cached
+
+    def get_reward(self, reward_id):
+        return self._lookup(self.rewards_by_id, reward_id)
+
+
+class Catalog:
+    def __init__(self, timezone='Europe/Moscow'):
+        # Неизвестный часовой пояс каталога — ошибка настройки: падаем при старте, а не на загрузке.
+        load_zone(timezone)
+        self.timezone = timezone
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    @property
+    def current(self):
+        return self._snapshot
+
+    def load(self, points, rewards, rates):
+        with self._lock:
+            snapshot = CatalogSnapshot(points, rewards, rates, self._version + 1, self.timezone)
+            self._version = snapshot.version
+            self._snapshot = snapshot
+        for listener in self._listeners:
+            listener(snapshot)
+        return snapshot
+
+    def add_listener(self, callback):
+        """callback(snapshot) вызывается после каждой успешной загрузки."""
+        self._listeners.append(callback)
@@ -0,0 +1,402 @@
+"""Загрузка каталога из файлов и горячая перезагрузка.
+
+Каталог лежит в каталоге CATALOG_DIR:
+
+    points.csv | points.geojson | points.jsonl | points.json  — пункты приема
+    rewards.json                                             — награды
+    rates.json                                               — тарифы {материал: монет за кг}
+
+CSV и JSON Lines читаются построчно, поэтому файл на десятки тысяч пунктов
+не загружается в память целиком. Каждая запись проверяется (обязательные
+поля, диапазоны координат, известные материалы, уникальность id и
+QR-кода); при ошибках каталог не подменяется, а в ответ возвращаются первые
+из них с номерами строк.
+
+CatalogWatcher раз в несколько секунд сравнивает размеры и mtime файлов и
+при изменении строит новый снимок в своем потоке, вне обработки запросов.
+Снимок подменяется одним присваиванием (Catalog.load), так что запросы,
+которые уже взяли старый снимок, дорабатывают с ним. У каждого воркера
+gunicorn свой наблюдатель; ручная перезагрузка обновляет файл-метку
+.reload, и остальные воркеры подхватывают ее на следующей проверке.
+"""
+import csv
+import json
+import os
+import threading
+import time
+
+from hours import load_zone
+
+POINT_FILES = ('points.csv', 'points.geojson', 'points.jsonl', 'points.json')
+REWARDS_FILE = 'rewards.json'
+RATES_FILE = 'rates.json'
+RELOAD_MARKER = '.reload'
+MAX_ERRORS = 20
+
+
+class CatalogImportError(ValueError):
+    def __init__(self, errors):
+        self.errors = list(errors)
+        message = '; '.join(self.errors[:MAX_ERRORS])
+        if len(self.errors) > MAX_ERRORS:
+            message += f' (и еще {len(self.errors) - MAX_ERRORS})'
+        super().__init__(message)
+
+
+def _text(value, field, required=True):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise ValueError(f'не заполнено поле {field}')
+        return ''
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        raise ValueError(f'поле {field} должно быть строкой')
+    return str(value).strip()
+
+
+def _int(value, field, minimum=None):
+    if isinstance(value, str):
+        value = value.strip()
+    try:
+        if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+            raise ValueError
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'поле {field} должно быть целым числом') from None
+    if minimum is not None and number < minimum:
+        raise ValueError(f'поле {field} должно быть не меньше {minimum}')
+    return number
+
+
+def _coordinate(value, field, limit):
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'поле {field} должно быть числом') from None
+    if not -limit <= number <= limit:
+        raise ValueError(f'поле {field} вне диапазона [-{limit}, {limit}]')
+    return number
+
+
+def parse_types(value):
+    """Материалы пункта: список или строка через ';', '|' или ','."""
+    if isinstance(value, str):
+        for separator in ('|', ','):
+            value = value.replace(separator, ';')
+        value = value.split(';')
+    if not isinstance(value, (list, tuple)):
+        raise ValueError('поле types должно быть списком материалов')
+    types = []
+    for item in value:
+        item = _text(item, 'types', required=False).lower()
+        if item and item not in types:
+            types.append(item)
+    if not types:
+        raise ValueError('не указаны материалы (types)')
+    return types
+
+
+def validate_point(raw, rates=None):
+    """Проверенная и приведенная к нужным типам запись пункта приема."""
+    if not isinstance(raw, dict):
+        raise ValueError('запись пункта должна быть объектом')
+    point = {key: value for key, value in raw.items() if value not in (None, '')}
+    point['id'] = _int(raw.get('id'), 'id', minimum=1)
+    point['name'] = _text(raw.get('name'), 'name')
+    point['address'] = _text(raw.get('address'), 'address')
+    point['lat'] = _coordinate(raw.get('lat'), 'lat', 90)
+    point['lng'] = _coordinate(raw.get('lng'), 'lng', 180)
+    point['hours'] = _text(raw.get('hours'), 'hours', required=False)
+    point['types'] = parse_types(raw.get('types'))
+    if rates is not None:
+        unknown = [t for t in point['types'] if t not in rates]
+        if unknown:
+            raise ValueError(f"неизвестные материалы: {', '.join(unknown)}")
+    timezone = _text(raw.get('timezone'), 'timezone', required=False)
+    if timezone:
+        load_zone(timezone)
+    qr_code = _text(raw.get('qr_code'), 'qr_code', required=False)
+    if qr_code:
+        point['qr_code'] = qr_code
+    else:
+        point.pop('qr_code', None)
+    return point
+
+
+def _feature_point(feature):
+    """Запись пункта из GeoJSON Feature с геометрией Point."""
+    if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+        return feature
+    geometry = feature.get('geometry') or {}
+    coordinates = geometry.get('coordinates')
+    if geometry.get('type') != 'Point' or not isinstance(coordinates, list) or len(coordinates) < 2:
+        raise ValueError('геометрия должна быть Point с координатами [lng, lat]')
+    point = dict(feature.get('properties') or {})
+    point.setdefault('id', feature.get('id'))
+    point['lng'], point['lat'] = coordinates[0], coordinates[1]
+    return point
+
+
+def _iter_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            # Лишние ячейки без заголовка DictReader складывает под ключ None.
+            row.pop(None, None)
+            yield reader.line_num, row
+
+
+def _iter_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, _feature_point(json.loads(line))
+            except ValueError as e:
+                yield line_num, e
+
+
+def _iter_json(path):
+    # Обычный JSON стандартная библиотека разбирает только целиком; для очень
+    # больших файлов удобнее CSV или JSON Lines.
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and data.get('type') == 'FeatureCollection':
+        items = data.get('features')
+    elif isinstance(data, dict):
+        items = data.get('points')
+    else:
+        items = data
+    if not isinstance(items, list):
+        raise CatalogImportError([f'{os.path.basename(path)}: ожидается массив пунктов'])
+    for index, item in enumerate(items, 1):
+        try:
+            yield index, _feature_point(item)
+        except ValueError as e:
+            yield index, e
+
+
+def read_points(path, rates=None):
+    """Пункты из файла; CatalogImportError со всеми найденными ошибками."""
+    name = os.path.basename(path)
+    if name.endswith('.csv'):
+        rows = _iter_csv(path)
+    elif name.endswith('.jsonl'):
+        rows = _iter_jsonl(path)
+    else:
+        rows = _iter_json(path)
+
+    points = []
+    errors = []
+    ids = {}
+    qr_codes = {}
+    try:
+        for position, raw in rows:
+            where = f'{name}:{position}'
+            try:
+                if isinstance(raw, Exception):
+                    raise raw
+                point = validate_point(raw, rates)
+            except ValueError as e:
+                errors.append(f'{where}: {e}')
+                continue
+            if point['id'] in ids:
+                errors.append(f"{where}: id {point['id']} уже встречался в {ids[point['id']]}")
+                continue
+            if point.get('qr_code') in qr_codes:
+                errors.append(f"{where}: QR-код {point['qr_code']} уже встречался в {qr_codes[point['qr_code']]}")
+                continue
+            ids[point['id']] = where
+            if 'qr_code' in point:
+                qr_codes[point['qr_code']] = where
+            points.append(point)
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as e:
+        errors.append(f'{name}: файл не разобран: {e}')
+    if errors:
+        raise CatalogImportError(errors)
+    return points
+
+
+def read_rewards(path):
+    name = os.path.basename(path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise CatalogImportError([f'{name}: файл не разобран: {e}']) from None
+    if isinstance(data, dict):
+        data = data.get('rewards')
+    if not isinstance(data, list):
+        raise CatalogImportError([f'{name}: ожидается массив наград'])
+
+    rewards = []
+    errors = []
+    ids = set()
+    for index, raw in enumerate(data, 1):
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError('запись награды должна быть объектом')
+            reward = dict(raw)
+            reward['id'] = _int(raw.get('id'), 'id', minimum=1)
+            reward['name'] = _text(raw.get('name'), 'name')
+            reward['price'] = _int(raw.get('price'), 'price', minimum=1)
+            reward['type'] = _text(raw.get('type'), 'type')
+            if reward['id'] in ids:
+                raise ValueError(f"id {reward['id']} повторяется")
+        except ValueError as e:
+            errors.append(f'{name}:{index}: {e}')
+            continue
+        ids.add(reward['id'])
+        rewards.append(reward)
+    if errors:
+        raise CatalogImportError(errors)
+    return rewards
+
+
+def read_rates(path):
+    name = os.path.basename(path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise CatalogImportError([f'{name}: файл не разобран: {e}']) from None
+    if not isinstance(data, dict) or not data:
+        raise CatalogImportError([f'{name}: ожидается объект {{материал: монет за кг}}'])
+
+    rates = {}
+    errors = []
+    for material, rate in data.items():
+        try:
+            rates[_text(material, 'материал').lower()] = _int(rate, f'тариф «{material}»', minimum=0)
+        except ValueError as e:
+            errors.append(f'{name}: {e}')
+    if errors:
+        raise CatalogImportError(errors)
+    return rates
+
+
+def points_path(directory):
+    found = [name for name in POINT_FILES if os.path.exists(os.path.join(directory, name))]
+    if not found:
+        raise CatalogImportError([f"в {directory} нет файла пунктов ({', '.join(POINT_FILES)})"])
+    if len(found) > 1:
+        raise CatalogImportError([f"в {directory} несколько файлов пунктов: {', '.join(found)}"])
+    return os.path.join(directory, found[0])
+
+
+def load_catalog_dir(directory):
+    """(points, rewards, rates) из каталога; все файлы проверяются вместе."""
+    try:
+        rates = read_rates(os.path.join(directory, RATES_FILE))
+        rewards = read_rewards(os.path.join(directory, REWARDS_FILE))
+        points = read_points(points_path(directory), rates)
+    except FileNotFoundError as e:
+        raise CatalogImportError([f'нет файла {e.filename}']) from None
+    return points, rewards, rates
+
+
+def catalog_signature(directory):
+    """Размеры и mtime файлов каталога: меняются при любой замене файла."""
+    signature = []
+    for name in (*POINT_FILES, REWARDS_FILE, RATES_FILE, RELOAD_MARKER):
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        signature.append((name, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+class CatalogWatcher:
+    def __init__(self, catalog, directory, interval=5.0):
+        self.catalog = catalog
+        self.directory = directory
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self.loaded_at = None
+        self._signature = None
+        self._reload_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def reload(self, force=False):
+        """Перечитывает каталог, если файлы изменились. Возвращает новый снимок или None."""
+        with self._reload_lock:
+            signature = catalog_signature(self.directory)
+            if not force and signature == self._signature:
+                return None
+            try:
+                points, rewards, rates = load_catalog_dir(self.directory)
+                if catalog_signature(self.directory) != signature:
+                    # Файл дописывается прямо сейчас: дочитаем на следующей проверке.
+                    return None
+                snapshot = self.catalog.load(points, rewards, rates)
+            except ValueError as e:
+                # Битые файлы не перечитываются, пока их не заменят.
+                self._signature = signature
+                self.failures += 1
+                self.last_error = str(e)
+                raise
+            self._signature = signature
+            self.reloads += 1
+            self.last_error = None
+            self.loaded_at = time.time()
+            return snapshot
+
+    def trigger(self):
+        """Ручная перезагрузка: здесь сразу, в остальных воркерах — по метке."""
+        marker = os.path.join(self.directory, RELOAD_MARKER)
+        try:
+            with open(marker, 'w') as f:
+                f.write(str(time.time()))
+        except OSError as e:
+            # Каталог только для чтения: перезагружаем хотя бы этот воркер.
+            print(f"Не удалось обновить {marker}: {e}")
+        return self.reload(force=True)
+
+    def ensure_running(self):
+        # После fork (gunicorn --preload) поток родителя в воркере не существует.
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='catalog-watcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                snapshot = self.reload()
+            except ValueError as e:
+                print(f"Каталог не перезагружен: {e}")
+                continue
+            except OSError as e:
+                print(f"Ошибка чтения каталога: {e}")
+                continue
+            if snapshot is not None:
+                print(f"Каталог перезагружен: версия {snapshot.version}, пунктов {len(snapshot.points)}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(self.interval + 1)
+
+    def stats(self):
+        snapshot = self.catalog.current
+        return {
+            'directory': self.directory,
+            'version': snapshot.version if snapshot else None,
+            'points': len(snapshot.points) if snapshot else 0,
+            'rewards': len(snapshot.rewards) if snapshot else 0,
+            'points_without_hours': snapshot.opening_hours.unparsed if snapshot else 0,
+            'points_with_bad_timezone': len(snapshot.opening_hours.bad_timezones) if snapshot else 0,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'loaded_at': self.loaded_at,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,141 @@
+"""Кластеры пунктов приема для карты.
+
+Пункты группируются по сетке в проекции Web Mercator: на зуме z мир —
+квадрат 256 * 2^z пикселей, ячейка — CELL_PX x CELL_PX пикселей. Размер
+ячейки — степень двойки, поэтому ячейка зума z - 1 — ровно четыре ячейки
+зума z, и пирамида считается снизу вверх слиянием соседей: O(n) на самом
+подробном уровне и O(число ячеек) на каждом следующем. Строится она вместе
+со снимком каталога; запрос только перебирает ячейки видимой области, число
+которых ограничено размером экрана, а не каталога.
+
+Уровни подробнее первого, на котором все пункты разошлись по отдельным
+ячейкам, не хранятся: запрос с большим зумом отвечает по этому уровню.
+"""
+import math
+
+CELL_PX = 64
+TILE_PX = 256
+MAX_ZOOM = 18
+# Не больше 64 x 64 ячеек (4096 x 4096 пикселей) на запрос.
+MAX_VIEW_CELLS = 64 * 64
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def mercator(lat, lng):
+    """Координаты на карте мира в долях от ее стороны: x, y в [0, 1)."""
+    lat = min(MAX_MERCATOR_LAT, max(-MAX_MERCATOR_LAT, lat))
+    sin_lat = math.sin(math.radians(lat))
+    x = (lng + 180) / 360
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(x, 0.0), 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+
+def cells_per_side(zoom):
+    return TILE_PX * (1 << zoom) // CELL_PX
+
+
+class Cluster:
+    __slots__ = ('count', 'lat_sum', 'lng_sum', 'materials', 'bounds', 'point')
+
+    def __init__(self, count, lat_sum, lng_sum, materials, bounds, point=None):
+        self.count = count
+        self.lat_sum = lat_sum
+        self.lng_sum = lng_sum
+        self.materials = materials
+        self.bounds = bounds
+        self.point = point
+
+    @classmethod
+    def single(cls, point):
+        lat, lng = point['lat'], point['lng']
+        return cls(1, lat, lng, None, (lat, lng, lat, lng), point)
+
+    def material_counts(self):
+        if self.materials is None:
+            return {material: 1 for material in self.point['types']}
+        return self.materials
+
+    def copy(self):
+        return Cluster(self.count, self.lat_sum, self.lng_sum, dict(self.material_counts()), self.bounds)
+
+    def add(self, other):
+        """Добавляет other к этому кластеру; вызывается только для собственной копии."""
+        self.count += other.count
+        self.lat_sum += other.lat_sum
+        self.lng_sum += other.lng_sum
+        for material, count in other.material_counts().items():
+            self.materials[material] = self.materials.get(material, 0) + count
+        a, b = self.bounds, other.bounds
+        self.bounds = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+    def to_dict(self):
+        if self.count == 1:
+            point = self.point
+            return {'count': 1, 'lat': point['lat'], 'lng': point['lng'],
+                    'materials': self.material_counts(), 'point': point}
+        return {
+            'count': self.count,
+            'lat': round(self.lat_sum / self.count, 6),
+            'lng': round(self.lng_sum / self.count, 6),
+            'materials': self.materials,
+            'bounds': list(self.bounds)
+        }
+
+
+def _merge_into(level, key, cluster, owned):
+    existing = level.get(key)
+    if existing is None:
+        # Одиночная ячейка переходит на уровень выше тем же объектом, без копирования.
+        level[key] = cluster
+        return
+    if key not in owned:
+        existing = level[key] = existing.copy()
+        owned.add(key)
+    existing.add(cluster)
+
+
+class ClusterPyramid:
+    def __init__(self, points, max_zoom=MAX_ZOOM):
+        finest = {}
+        owned = set()
+        side = cells_per_side(max_zoom)
+        for point in points:
+            x, y = mercator(point['lat'], point['lng'])
+            _merge_into(finest, (int(y * side), int(x * side)), Cluster.single(point), owned)
+
+        levels = [finest]
+        for _ in range(max_zoom):
+            parent = {}
+            owned = set()
+            for (row, col), cluster in levels[-1].items():
+                _merge_into(parent, (row >> 1, col >> 1), cluster, owned)
+            levels.append(parent)
+        levels.reverse()
+
+        # Первый уровень, где все пункты в отдельных ячейках; дальше ничего не меняется.
+        self.max_zoom = max_zoom
+        for zoom, level in enumerate(levels):
+            if len(level) == len(finest) and all(c.count == 1 for c in level.values()):
+                self.max_zoom = zoom
+                break
+        self.levels = levels[:self.max_zoom + 1]
+
+    def clusters(self, lat_min, lng_min, lat_max, lng_max, zoom):
+        """Кластеры уровня zoom в прямоугольнике; ValueError, если он больше экрана."""
+        zoom = min(max(int(zoom), 0), self.max_zoom)
+        level = self.levels[zoom]
+        side = cells_per_side(zoom)
+        x_min, y_max = mercator(min(lat_min, lat_max), min(lng_min, lng_max))
+        x_max, y_min = mercator(max(lat_min, lat_max), max(lng_min, lng_max))
+        row_min, row_max = int(y_min * side), int(y_max * side)
+        col_min, col_max = int(x_min * side), int(x_max * side)
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > MAX_VIEW_CELLS:
+            raise ValueError('bbox is too large for zoom')
+
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(level):
+            keys = [key for key in level
+                    if row_min <= key[0] <= row_max and col_min <= key[1] <= col_max]
+        else:
+            keys = [(i, j) for i in range(row_min, row_max + 1)
+                    for j in range(col_min, col_max + 1) if (i, j) in level]
+        return [level[key].to_dict() for key in keys]
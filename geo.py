@@ -0,0 +1,185 @@
+"""Пространственный индекс пунктов приема.
+
+Точки раскладываются по равномерной сетке из примерно квадратных ячеек
+со стороной cell_km (по умолчанию подбирается так, чтобы в ячейке было
+несколько точек). Поиск ближайших обходит кольца ячеек вокруг ячейки запроса и
+останавливается, как только следующее кольцо заведомо дальше k-го найденного
+пункта или радиуса поиска, поэтому стоимость запроса зависит от плотности
+точек рядом с пользователем, а не от размера всего каталога.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    def __init__(self, points, cell_km=None, points_per_cell=4):
+        self.points = list(points)
+        if self.points:
+            lats = [p['lat'] for p in self.points]
+            lngs = [p['lng'] for p in self.points]
+            self.ref_lat = sum(lats) / len(lats)
+            self.max_abs_lat = max(abs(lat) for lat in lats)
+            ref_cos = max(0.01, math.cos(math.radians(self.ref_lat)))
+            if cell_km is None:
+                area = ((max(lats) - min(lats)) * KM_PER_DEGREE
+                        * (max(lngs) - min(lngs)) * KM_PER_DEGREE * ref_cos)
+                cell_km = math.sqrt(max(area, 0.01) * points_per_cell / len(self.points))
+                cell_km = min(50.0, max(0.05, cell_km))
+        else:
+            self.ref_lat = 0.0
+            self.max_abs_lat = 0.0
+            ref_cos = 1.0
+            cell_km = cell_km or 1.0
+        self.cell_km = cell_km
+        self.lat_step = cell_km / KM_PER_DEGREE
+        self.lng_step = cell_km / (KM_PER_DEGREE * ref_cos)
+
+        cells = {}
+        for point in self.points:
+            cells.setdefault(self._cell(point['lat'], point['lng']), []).append(point)
+        self.cells = {key: tuple(bucket) for key, bucket in cells.items()}
+        if self.cells:
+            rows = [key[0] for key in self.cells]
+            cols = [key[1] for key in self.cells]
+            self.bounds = (min(rows), min(cols), max(rows), max(cols))
+        else:
+            self.bounds = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.lat_step), math.floor(lng / self.lng_step)
+
+    def _cell_sizes_km(self, lat):
+        max_lat = min(89.9, max(self.max_abs_lat, abs(lat)) + self.lat_step)
+        return self.cell_km, self.lng_step * KM_PER_DEGREE * math.cos(math.radians(max_lat))
+
+    def _ring(self, row, col, r):
+        if r == 0:
+            yield row, col
+            return
+        for j in range(col - r, col + r + 1):
+            yield row - r, j
+            yield row + r, j
+        for i in range(row - r + 1, row + r):
+            yield i, col - r
+            yield i, col + r
+
+    def nearest(self, lat, lng, limit=None, radius_km=None, predicate=None):
+        """Возвращает список (расстояние_км, пункт), отсортированный по расстоянию."""
+        if not self.cells or limit == 0:
+            return []
+
+        row, col = self._cell(lat, lng)
+        min_row, min_col, max_row, max_col = self.bounds
+        first_ring = max(min_row - row, row - max_row, min_col - col, col - max_col, 0)
+        last_ring = max(row - min_row, max_row - row, col - min_col, max_col - col)
+        lat_km, lng_km = self._cell_sizes_km(lat)
+        cell_km = min(lat_km, lng_km)
+
+        found = []
+        seq = 0
+
+        def visit(bucket):
+            nonlocal seq
+            for point in bucket:
+                if predicate is not None and not predicate(point):
+                    continue
+                distance = haversine_km(lat, lng, point['lat'], point['lng'])
+                if radius_km is not None and distance > radius_km:
+                    continue
+                seq += 1
+                if limit is None:
+                    found.append((distance, seq, point))
+                elif len(found) < limit:
+                    heapq.heappush(found, (-distance, -seq, point))
+                elif distance < -found[0][0]:
+                    heapq.heapreplace(found, (-distance, -seq, point))
+
+        def done(reach):
+            if radius_km is not None and reach > radius_km:
+                return True
+            return limit is not None and len(found) >= limit and -found[0][0] <= reach
+
+        r = first_ring
+        scanned = 0
+        while r <= last_ring:
+            scanned += max(1, 8 * r)
+            if scanned > len(self.cells):
+                break
+            for key in self._ring(row, col, r):
+                bucket = self.cells.get(key)
+                if bucket:
+                    visit(bucket)
+            if done(r * cell_km):
+                return self._sorted(found, limit)
+            r += 1
+
+        if r <= last_ring:
+            # Обход колец стал дороже перебора непустых ячеек: дальше обходим
+            # сами ячейки в порядке нижней оценки расстояния до них — расстояния
+            # до ближайшей точки прямоугольника ячейки за вычетом ее диагонали.
+            slack = math.hypot(self.lat_step * KM_PER_DEGREE, self.lng_step * KM_PER_DEGREE)
+            remaining = []
+            for key in self.cells:
+                if max(abs(key[0] - row), abs(key[1] - col)) < r:
+                    continue
+                near_lat = min(max(lat, key[0] * self.lat_step), (key[0] + 1) * self.lat_step)
+                near_lng = min(max(lng, key[1] * self.lng_step), (key[1] + 1) * self.lng_step)
+                bound = haversine_km(lat, lng, near_lat, near_lng) - slack
+                remaining.append((bound, key))
+            remaining.sort()
+            for bound, key in remaining:
+                if done(bound):
+                    break
+                visit(self.cells[key])
+
+        return self._sorted(found, limit)
+
+    @staticmethod
+    def _sorted(found, limit):
+        if limit is None:
+            found.sort(key=lambda item: (item[0], item[1]))
+            return [(distance, point) for distance, _, point in found]
+        found.sort(key=lambda item: (-item[0], -item[1]))
+        return [(-distance, point) for distance, _, point in found]
+
+    def within_bbox(self, lat_min, lng_min, lat_max, lng_max, predicate=None):
+        if not self.cells:
+            return []
+        lat_min, lat_max = min(lat_min, lat_max), max(lat_min, lat_max)
+        lng_min, lng_max = min(lng_min, lng_max), max(lng_min, lng_max)
+        row_min, col_min = self._cell(lat_min, lng_min)
+        row_max, col_max = self._cell(lat_max, lng_max)
+        b_row_min, b_col_min, b_row_max, b_col_max = self.bounds
+        row_min, col_min = max(row_min, b_row_min), max(col_min, b_col_min)
+        row_max, col_max = min(row_max, b_row_max), min(col_max, b_col_max)
+        if row_min > row_max or col_min > col_max:
+            return []
+
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self.cells):
+            keys = (key for key in self.cells
+                    if row_min <= key[0] <= row_max and col_min <= key[1] <= col_max)
+        else:
+            keys = ((i, j) for i in range(row_min, row_max + 1) for j in range(col_min, col_max + 1))
+
+        result = []
+        for key in keys:
+            for point in self.cells.get(key, ()):
+                if not (lat_min <= point['lat'] <= lat_max and lng_min <= point['lng'] <= lng_max):
+                    continue
+                if predicate is not None and not predicate(point):
+                    continue
+                result.append(point)
+        return result
@@ -0,0 +1,26 @@
+"""Хуки мастера gunicorn (файл подхватывается автоматически из рабочего каталога).
+
+Метрики воркеров лежат в METRICS_DIR по файлу на процесс (см. metrics.py):
+при старте каталог очищается, а значения завершившегося воркера переносятся
+в общий архив, чтобы счетчики в /metrics не уменьшались.
+"""
+import os
+
+from dotenv import load_dotenv
+
+from metrics import clear_directory, mark_process_dead
+
+load_dotenv()
+
+METRICS_DIR = os.getenv('METRICS_DIR', 'data/metrics')
+
+
+def on_starting(server):
+    clear_directory(METRICS_DIR)
+
+
+def child_exit(server, worker):
+    try:
+        mark_process_dead(METRICS_DIR, worker.pid)
+    except OSError as e:
+        server.log.warning("Не удалось перенести метрики воркера %s: %s", worker.pid, e)
@@ -0,0 +1,203 @@
+"""Часы работы пунктов приема.
+
+Строка hours разбирается один раз, при загрузке каталога, в
+отсортированные интервалы в минутах от начала недели (понедельник 00:00).
+Проверка «открыт ли пункт в момент t» — бинарный поиск по началам
+интервалов, O(log k), без разбора строк в запросе.
+
+Поддерживаемые записи (правила через «;», более позднее правило
+переопределяет дни предыдущих, как в OpenStreetMap):
+
+    09:00-20:00                          ежедневно
+    круглосуточно | 24/7                 всегда открыт
+    Пн-Пт 09:00-20:00; Сб 10:00-18:00; Вс выходной
+    Пн,Ср,Пт 09:00-13:00, 14:00-20:00    перерыв
+    22:00-06:00                          через полночь
+    Mo-Fr 09:00-20:00                    дни по-английски
+    Пн-Пт 9-18                           минуты можно не указывать
+
+Часы указаны по местному времени пункта: поле timezone или часовой пояс
+каталога по умолчанию.
+"""
+import re
+from bisect import bisect_right
+from zoneinfo import ZoneInfo
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAYS = {
+    'пн': 0, 'вт': 1, 'ср': 2, 'чт': 3, 'пт': 4, 'сб': 5, 'вс': 6,
+    'mo': 0, 'tu': 1, 'we': 2, 'th': 3, 'fr': 4, 'sa': 5, 'su': 6
+}
+EVERY_DAY = ('ежедневно', 'daily')
+ALWAYS_OPEN = ('круглосуточно', '24/7')
+CLOSED = ('выходной', 'выходные', 'закрыто', 'off', 'closed')
+
+_DAY = '(?:' + '|'.join(DAYS) + ')'
+_DAYS_RE = re.compile(rf'^({_DAY}(?:\s*[-–,]\s*{_DAY})*)\b\s*:?\s*', re.IGNORECASE)
+_RANGE_RE = re.compile(r'^(\d{1,2})(?:[:.](\d{2}))?\s*[-–—]\s*(\d{1,2})(?:[:.](\d{2}))?$')
+
+
+def _parse_days(spec):
+    days = []
+    for part in re.split(r'\s*,\s*', spec.lower()):
+        bounds = re.split(r'\s*[-–]\s*', part)
+        first, last = DAYS[bounds[0]], DAYS[bounds[-1]]
+        day = first
+        while True:
+            days.append(day)
+            if day == last:
+                break
+            day = (day + 1) % 7
+    return days
+
+
+def _parse_ranges(text):
+    text = text.strip().lower()
+    if text in ALWAYS_OPEN:
+        return [(0, MINUTES_PER_DAY)]
+    if text in CLOSED:
+        return []
+    ranges = []
+    for part in re.split(r'\s*,\s*', text):
+        match = _RANGE_RE.match(part)
+        if not match:
+            raise ValueError(f'не разобраны часы: {part!r}')
+        h1, m1, h2, m2 = (int(value or 0) for value in match.groups())
+        if h1 > 24 or h2 > 24 or m1 > 59 or m2 > 59:
+            raise ValueError(f'некорректное время: {part!r}')
+        start, end = h1 * 60 + m1, h2 * 60 + m2
+        if end <= start:
+            # Через полночь: конец на следующий день.
+            end += MINUTES_PER_DAY
+        ranges.append((start, end))
+    return ranges
+
+
+class OpeningHours:
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, intervals):
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = tuple(start for start, _ in merged)
+        self.ends = tuple(end for _, end in merged)
+
+    @classmethod
+    def parse(cls, text):
+        """OpeningHours из строки часов; ValueError, если строка не разобрана."""
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError('часы не указаны')
+        schedule = {}
+        for rule in text.split(';'):
+            rule = rule.strip()
+            if not rule:
+                continue
+            match = _DAYS_RE.match(rule)
+            if match:
+                days = _parse_days(match.group(1))
+                rule = rule[match.end():]
+            else:
+                days = range(7)
+                for prefix in EVERY_DAY:
+                    if rule.lower().startswith(prefix):
+                        rule = rule[len(prefix):]
+                        break
+            ranges = _parse_ranges(rule)
+            for day in days:
+                schedule[day] = ranges
+
+        intervals = []
+        for day, ranges in schedule.items():
+            for start, end in ranges:
+                start += day * MINUTES_PER_DAY
+                end += day * MINUTES_PER_DAY
+                if end > MINUTES_PER_WEEK:
+                    # Ночь с воскресенья на понедельник переходит в начало недели.
+                    intervals.append((0, end - MINUTES_PER_WEEK))
+                    end = MINUTES_PER_WEEK
+                intervals.append((start, end))
+        return cls(intervals)
+
+    @property
+    def always_open(self):
+        return self.starts == (0,) and self.ends == (MINUTES_PER_WEEK,)
+
+    def is_open(self, minute_of_week):
+        index = bisect_right(self.starts, minute_of_week) - 1
+        return index >= 0 and minute_of_week < self.ends[index]
+
+
+def load_zone(name):
+    """ZoneInfo по имени; ValueError, если такого часового пояса нет."""
+    try:
+        return ZoneInfo(name)
+    except (KeyError, ValueError, TypeError):
+        # ZoneInfoNotFoundError — подкласс KeyError.
+        raise ValueError(f'неизвестный часовой пояс: {name}') from None
+
+
+def minute_of_week(moment):
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+class HoursIndex:
+    """Разобранные часы всех пунктов снимка каталога."""
+
+    def __init__(self, points, default_timezone):
+        self.default_timezone = default_timezone
+        self._zones = {default_timezone: load_zone(default_timezone)}
+        self._hours = {}
+        self.unparsed = 0
+        # id пункта → часовой пояс, которого нет в базе tzdata.
+        self.bad_timezones = {}
+        # Строк часов намного меньше, чем пунктов: каждая разбирается один раз.
+        parsed = {}
+        for point in points:
+            text = point.get('hours')
+            hours = parsed.get(text)
+            if hours is None and text not in parsed:
+                try:
+                    hours = OpeningHours.parse(text)
+                except ValueError:
+                    hours = None
+                if isinstance(text, str):
+                    parsed[text] = hours
+            if hours is None:
+                # Пункт без понятных часов не попадает в выборку «открыто».
+                self.unparsed += 1
+                continue
+            zone_name = point.get('timezone') or default_timezone
+            if zone_name not in self._zones:
+                try:
+                    self._zones[zone_name] = load_zone(zone_name)
+                except ValueError:
+                    # Как и пункт без часов, он не попадает в выборку «открыто», но снимок строится.
+                    self.bad_timezones[point['id']] = zone_name
+                    continue
+            self._hours[point['id']] = (hours, zone_name)
+
+    def __len__(self):
+        return len(self._hours)
+
+    def predicate(self, moment):
+        """Фильтр «открыт в момент moment» для make_point_filter.
+
+        Минута недели считается заранее для каждого часового пояса каталога;
+        время без часового пояса считается местным временем пункта.
+        """
+        if moment.tzinfo is None:
+            minutes = dict.fromkeys(self._zones, minute_of_week(moment))
+        else:
+            minutes = {name: minute_of_week(moment.astimezone(zone)) for name, zone in self._zones.items()}
+        hours = self._hours
+
+        def is_open(point):
+            entry = hours.get(point['id'])
+            return entry is not None and entry[0].is_open(minutes[entry[1]])
+        return is_open
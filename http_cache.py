@@ -0,0 +1,58 @@
+"""Заранее сериализованные JSON-ответы с ETag и gzip.
+
+Данные каталога меняются только при его перезагрузке, поэтому тела ответов
+(и их gzip-версии) собираются один раз вместе со снимком каталога. ETag
+считается от содержимого, а не от номера версии, и потому совпадает во всех
+воркерах gunicorn.
+"""
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+GZIP_MIN_SIZE = 1024
+
+
+def _dumps(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+
+class CachedBody:
+    __slots__ = ('body', 'gzip_body', 'etag')
+
+    def __init__(self, payload, body=None):
+        self.body = body if body is not None else _dumps(payload).encode()
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.gzip_body = gzip.compress(self.body, 6, mtime=0) if len(self.body) >= GZIP_MIN_SIZE else None
+
+    @classmethod
+    def from_list(cls, key, items, chunk_size=500):
+        """То же, что CachedBody({key: list(items)}), но сериализуется кусками.
+
+        json.dumps большого списка держит GIL до конца, и запросы остальных
+        потоков воркера ждут; между кусками GIL отпускается.
+        """
+        items = list(items)
+        parts = [_dumps(items[i:i + chunk_size])[1:-1] for i in range(0, len(items), chunk_size)]
+        return cls(None, ('{%s:[%s]}' % (_dumps(key), ','.join(parts))).encode())
+
+
+def cached_json_response(cached, max_age=60):
+    use_gzip = cached.gzip_body is not None and request.accept_encodings['gzip'] > 0
+    etag = cached.etag + '-gz' if use_gzip else cached.etag
+
+    if_none_match = request.if_none_match
+    if if_none_match and (if_none_match.star_tag
+                          or if_none_match.contains_weak(cached.etag)
+                          or if_none_match.contains_weak(cached.etag + '-gz')):
+        response = Response(status=304)
+    else:
+        response = Response(cached.gzip_body if use_gzip else cached.body, mimetype='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,70 @@
+"""Ключи идемпотентности для операций с балансом.
+
+Клиент передает заголовок Idempotency-Key; повтор запроса с тем же ключом
+(например, после обрыва связи) возвращает результат первого выполнения,
+а не начисляет или списывает монеты еще раз. Источник истины — хранилище:
+ключ сохраняется в той же транзакции, что и изменение баланса, поэтому
+повтор, попавший в другой воркер, тоже узнается. Перед хранилищем стоит
+ограниченный LRU-кэш результатов воркера.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def scoped_key(operation, key):
+    """Ключ с именем операции: один ключ в разных эндпоинтах не смешивается."""
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError('Invalid Idempotency-Key')
+    return f'{operation}:{key}'
+
+
+class IdempotencyCache:
+    def __init__(self, storage, cache_size=10000, ttl=None):
+        self.storage = storage
+        self.cache_size = cache_size
+        # Кэш не должен помнить ключ дольше хранилища (и наоборот).
+        self.ttl = storage.idempotency_ttl if ttl is None else ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, key):
+        cache_key = (user_id, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is not None:
+                result, expires_at = entry
+                if expires_at > now:
+                    self._cache.move_to_end(cache_key)
+                    self.hits += 1
+                    return result
+                del self._cache[cache_key]
+            self.misses += 1
+
+        result = self.storage.idempotent_result(user_id, key)
+        if result is not None:
+            self.put(user_id, key, result)
+        return result
+
+    def put(self, user_id, key, result):
+        with self._lock:
+            self._cache[(user_id, key)] = (result, time.monotonic() + self.ttl)
+            self._cache.move_to_end((user_id, key))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses
+            }
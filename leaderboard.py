@@ -0,0 +1,401 @@
+"""Рейтинги пользователей по сданному весу: общий, по материалам и за неделю.
+
+Каждый рейтинг — словарь «пользователь → вес» плюс упорядоченное множество
+ключей (-вес, user_id) с порядковой статистикой (RankedSet): место
+пользователя ищется за O(log n), страница топа — за O(log n + k), а сдача
+меняет только один ключ. Сортировать всех пользователей на каждый запрос
+не нужно.
+
+Воркеры gunicorn не видят памяти друг друга, поэтому рейтинги строятся не
+из запросов, а из общего журнала транзакций (storage.transactions_after):
+каждый воркер дочитывает его по последнему примененному id в фоновом
+потоке раз в refresh_interval секунд, так что чужие сдачи появляются в
+рейтинге с такой задержкой. Своя сдача только будит фоновый поток
+(request_refresh): запрос не ждет чтения журнала и не встает в очередь за
+другими запросами. Чтобы после перезапуска не
+перечитывать всю историю, состояние периодически сохраняется в файл
+снимка вместе с id, до которого журнал уже учтен.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+SNAPSHOT_VERSION = 1
+
+
+class RankedSet:
+    """Упорядоченное множество с доступом по номеру.
+
+    Ключи лежат в отсортированных корзинах размером до 2 * load; поверх длин
+    корзин — дерево Фенвика. Вставка и удаление — бинарный поиск корзины и
+    сдвиг внутри нее, номер ключа и ключ по номеру — O(log n).
+    """
+
+    def __init__(self, keys=(), load=512):
+        """keys должны быть отсортированы и уникальны (например, из снимка)."""
+        self.load = load
+        self._lists = [list(keys[i:i + load]) for i in range(0, len(keys), load)]
+        self._maxes = [items[-1] for items in self._lists]
+        self._tree = None
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def _build_tree(self):
+        tree = [len(items) for items in self._lists]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update(self, pos, delta):
+        if self._tree is None:
+            return
+        tree = self._tree
+        while pos < len(tree):
+            tree[pos] += delta
+            pos |= pos + 1
+
+    def _prefix(self, pos):
+        """Число ключей в корзинах [0, pos)."""
+        if self._tree is None:
+            self._build_tree()
+        tree = self._tree
+        total = 0
+        while pos > 0:
+            total += tree[pos - 1]
+            pos &= pos - 1
+        return total
+
+    def _locate(self, index):
+        """(корзина, смещение) ключа с номером index."""
+        if self._tree is None:
+            self._build_tree()
+        tree = self._tree
+        pos = 0
+        step = 1 << (len(tree).bit_length() - 1) if tree else 0
+        while step:
+            nxt = pos + step
+            if nxt <= len(tree) and tree[nxt - 1] <= index:
+                index -= tree[nxt - 1]
+                pos = nxt
+            step >>= 1
+        return pos, index
+
+    def add(self, key):
+        self._len += 1
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._tree = None
+            return
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._lists[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            insort(self._lists[pos], key)
+        self._update(pos, 1)
+        items = self._lists[pos]
+        if len(items) > 2 * self.load:
+            # Деление корзины меняет нумерацию корзин: дерево перестраивается лениво.
+            self._lists[pos:pos + 1] = [items[:self.load], items[self.load:]]
+            self._maxes[pos:pos + 1] = [items[self.load - 1], items[-1]]
+            self._tree = None
+
+    def remove(self, key):
+        pos = bisect_left(self._maxes, key)
+        items = self._lists[pos] if pos < len(self._lists) else None
+        index = bisect_left(items, key) if items else 0
+        if not items or index == len(items) or items[index] != key:
+            raise KeyError(key)
+        del items[index]
+        self._len -= 1
+        if items:
+            self._maxes[pos] = items[-1]
+            self._update(pos, -1)
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._tree = None
+
+    def index(self, key):
+        """Число ключей меньше key."""
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        return self._prefix(pos) + bisect_left(self._lists[pos], key)
+
+    def islice(self, start, stop):
+        """Ключи с номерами [start, stop) по порядку."""
+        stop = min(stop, self._len)
+        if start >= stop:
+            return
+        pos, offset = self._locate(start)
+        remaining = stop - start
+        while remaining > 0:
+            items = self._lists[pos][offset:offset + remaining]
+            yield from items
+            remaining -= len(items)
+            pos += 1
+            offset = 0
+
+
+class Leaderboard:
+    def __init__(self, scores=None):
+        self.scores = dict(scores or {})
+        self.ranked = RankedSet(sorted((-score, user_id) for user_id, score in self.scores.items()))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add(self, user_id, amount):
+        old = self.scores.get(user_id)
+        if old is not None:
+            self.ranked.remove((-old, user_id))
+        score = (old or 0) + amount
+        self.scores[user_id] = score
+        self.ranked.add((-score, user_id))
+
+    def rank(self, user_id):
+        """(место с 1, вес) или None, если пользователь ничего не сдавал."""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self.ranked.index((-score, user_id)) + 1, round(score, 3)
+
+    def page(self, offset=0, limit=20):
+        return [
+            {'rank': offset + i + 1, 'userId': user_id, 'score': round(-negative, 3)}
+            for i, (negative, user_id) in enumerate(self.ranked.islice(offset, offset + limit))
+        ]
+
+
+def week_key(moment):
+    year, week, _ = moment.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+class Leaderboards:
+    def __init__(self, storage, snapshot_path=None, refresh_interval=1.0, snapshot_interval=300.0,
+                 weeks=2, batch_size=5000):
+        self.storage = storage
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.snapshot_interval = snapshot_interval
+        self.weeks = weeks
+        self.batch_size = batch_size
+        self.ready = False
+        self.applied = 0
+        self.snapshots = 0
+        self.last_error = None
+        self._boards = {}
+        self._cursor = 0
+        self._snapshot_cursor = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._pid = None
+
+    def _oldest_week(self):
+        return week_key(datetime.now() - timedelta(weeks=self.weeks - 1))
+
+    @staticmethod
+    def _deltas(rows, oldest_week):
+        """Прибавки весов пачки журнала по рейтингам: {(период, материал): {user_id: кг}}."""
+        deltas = {}
+        applied = 0
+        for _, user_id, transaction in rows:
+            weight = transaction.get('weight') or 0
+            if transaction.get('type') != 'recycling' or weight <= 0:
+                continue
+            material = transaction.get('material_type')
+            periods = ['all']
+            try:
+                week = week_key(datetime.fromisoformat(transaction['date']))
+            except (KeyError, TypeError, ValueError):
+                week = None
+            if week is not None and week >= oldest_week:
+                periods.append(week)
+            for period in periods:
+                for key in ((period, None), (period, material)) if material else ((period, None),):
+                    board = deltas.setdefault(key, {})
+                    board[user_id] = board.get(user_id, 0) + weight
+            applied += 1
+        return deltas, applied
+
+    def _merge(self, deltas):
+        for key, changes in deltas.items():
+            board = self._boards.get(key)
+            if board is None or len(changes) > len(board) // 4 + 1000:
+                # Большая пачка (пересчет по журналу): сортировка заново дешевле вставок по одной.
+                scores = dict(board.scores) if board is not None else {}
+                for user_id, amount in changes.items():
+                    scores[user_id] = scores.get(user_id, 0) + amount
+                self._boards[key] = Leaderboard(scores)
+            else:
+                for user_id, amount in changes.items():
+                    board.add(user_id, amount)
+
+    def refresh(self):
+        """Дочитывает журнал транзакций; возвращает число новых записей."""
+        with self._refresh_lock:
+            oldest_week = self._oldest_week()
+            total = 0
+            while True:
+                rows = self.storage.transactions_after(self._cursor, self.batch_size)
+                if not rows:
+                    break
+                deltas, applied = self._deltas(rows, oldest_week)
+                with self._lock:
+                    self._merge(deltas)
+                    self._cursor = rows[-1][0]
+                    self.applied += applied
+                total += len(rows)
+                if len(rows) < self.batch_size:
+                    break
+            with self._lock:
+                # Недели старше окна больше не нужны.
+                for key in [key for key in self._boards if key[0] != 'all' and key[0] < oldest_week]:
+                    del self._boards[key]
+            return total
+
+    def request_refresh(self):
+        """Просит фоновый поток дочитать журнал, не дожидаясь интервала."""
+        self._wake_event.set()
+
+    def load_snapshot(self):
+        if not self.snapshot_path:
+            return False
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            print(f"Снимок рейтингов поврежден, пересчет по журналу: {e}")
+            return False
+        cursor = data.get('cursor', 0)
+        if cursor:
+            rows = self.storage.transactions_after(cursor - 1, 1)
+            if not rows or rows[0][0] != cursor:
+                cursor = None
+        if data.get('version') != SNAPSHOT_VERSION or cursor is None:
+            # Снимок от другой базы (или старого формата): считаем заново.
+            return False
+        boards = {(period, material): Leaderboard(scores) for period, material, scores in data['boards']}
+        with self._lock:
+            self._boards = boards
+            self._cursor = self._snapshot_cursor = cursor
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return False
+        with self._lock:
+            if self._cursor == self._snapshot_cursor:
+                return False
+            cursor = self._cursor
+            boards = [[period, material, list(board.scores.items())]
+                      for (period, material), board in self._boards.items()]
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        os.makedirs(directory, exist_ok=True)
+        # Снимок пишут все воркеры; у каждого потока свой временный файл.
+        partial = f'{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.part'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'cursor': cursor, 'saved_at': time.time(),
+                       'boards': boards}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(partial, self.snapshot_path)
+        self._snapshot_cursor = cursor
+        self.snapshots += 1
+        return True
+
+    def ensure_running(self):
+        # У каждого воркера свои рейтинги и свой поток; после fork он запускается заново.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        thread = threading.Thread(target=self._run, name='leaderboards', daemon=True)
+        thread.start()
+
+    def _run(self):
+        try:
+            self.load_snapshot()
+            self.refresh()
+            self.ready = True
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Не удалось загрузить рейтинги: {e}")
+        last_snapshot = time.monotonic()
+        while True:
+            self._wake_event.wait(self.refresh_interval)
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.refresh()
+                self.ready = True
+                if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    last_snapshot = time.monotonic()
+                    self.save_snapshot()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Ошибка обновления рейтингов: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._pid == os.getpid() and self.ready:
+            try:
+                self.save_snapshot()
+            except OSError:
+                pass
+
+    def period_key(self, period):
+        if period == 'week':
+            return week_key(datetime.now())
+        if period == 'all':
+            return 'all'
+        raise ValueError('Invalid period')
+
+    def page(self, period='all', material=None, offset=0, limit=20, user_id=None):
+        key = self.period_key(period)
+        with self._lock:
+            board = self._boards.get((key, material))
+            if board is None:
+                return {'total': 0, 'entries': [], 'me': None}
+            me = board.rank(user_id) if user_id is not None else None
+            return {
+                'total': len(board),
+                'entries': board.page(offset, limit),
+                'me': {'rank': me[0], 'score': me[1]} if me else None
+            }
+
+    def rank(self, user_id, period='all', material=None):
+        """{'position', 'total', 'score'} или None."""
+        key = self.period_key(period)
+        with self._lock:
+            board = self._boards.get((key, material))
+            found = board.rank(user_id) if board is not None else None
+            if found is None:
+                return None
+            return {'position': found[0], 'total': len(board), 'score': found[1]}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'cursor': self._cursor,
+                'applied': self.applied,
+                'boards': len(self._boards),
+                'users': len(self._boards.get(('all', None), ())),
+                'snapshots': self.snapshots,
+                'last_error': self.last_error
+            }
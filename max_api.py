@@ -0,0 +1,230 @@
+"""Клиент MAX Bot API.
+
+MAX принимает токен бота двумя способами: в пути (/bot{TOKEN}/method) или
+в заголовке Authorization (/bot/method). Клиент держит общий пул keep-alive
+соединений, запоминает вариант, который сработал последним, и сразу идет в
+него. Для каждого варианта работает circuit breaker: после серии ошибок
+вариант пропускается до истечения паузы, а затем пробуется одним запросом.
+
+Ошибками варианта считаются сбои соединения, таймауты, 5xx и 401 (токен
+не принят именно этим способом): после них клиент пробует другой вариант.
+Остальные 4xx от варианта, который уже отвечал 200, относятся к конкретному
+запросу (бот заблокирован, чат не найден) и сразу возвращаются вызывающему
+коду. Пока вариант ни разу не сработал, его 4xx может означать, что
+платформа не поддерживает такой адрес, поэтому клиент пробует другой
+вариант, не открывая при этом circuit breaker.
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Histogram
+
+VARIANTS = ('path', 'bearer')
+
+
+class MaxApiError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def unavailable(self):
+        """API недоступно целиком (нет связи, 5xx, токен, circuit breaker), а не отказ по запросу."""
+        return is_variant_failure(self.status_code)
+
+
+def is_variant_failure(status_code):
+    return status_code is None or status_code == 401 or status_code >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Пропускаем один пробный запрос, следующий ждет новой паузы.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class EndpointStats:
+    __slots__ = ('calls', 'errors', 'total_latency', 'max_latency', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.latency = Histogram()
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_latency_ms': round(self.total_latency / self.calls * 1000, 2) if self.calls else 0.0,
+            'max_latency_ms': round(self.max_latency * 1000, 2)
+        }
+
+
+class MaxApiClient:
+    def __init__(self, token, base_url='https://platform-api.max.ru', timeout=(3.05, 10),
+                 pool_size=20, failure_threshold=5, reset_timeout=30.0):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.preferred = VARIANTS[0]
+        # Варианты, которые хотя бы раз ответили 200.
+        self.confirmed = set()
+        self.breakers = {
+            variant: CircuitBreaker(failure_threshold, reset_timeout) for variant in VARIANTS
+        }
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        # Успешные вызовы не первым по порядку вариантом и вызовы, отклоненные
+        # без запроса, потому что оба варианта отключены circuit breaker.
+        self.fallbacks = 0
+        self.rejected = 0
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._session_lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.headers['Content-Type'] = 'application/json'
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def _request_args(self, variant, method):
+        if variant == 'path':
+            return f"{self.base_url}/bot{self.token}/{method}", {}
+        return f"{self.base_url}/bot/{method}", {"Authorization": f"Bearer {self.token}"}
+
+    def _record(self, method, variant, latency, ok):
+        with self._stats_lock:
+            stats = self._stats.get((method, variant))
+            if stats is None:
+                stats = self._stats[(method, variant)] = EndpointStats()
+            stats.calls += 1
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+            stats.latency.observe(latency)
+            if not ok:
+                stats.errors += 1
+
+    def call(self, method, payload=None, timeout=None):
+        """timeout переопределяет таймаут клиента, например для long polling."""
+        if not self.token:
+            raise MaxApiError('BOT_TOKEN не настроен')
+
+        preferred = self.preferred
+        order = [preferred] + [v for v in VARIANTS if v != preferred]
+        last_error = None
+        attempted = False
+
+        for variant in order:
+            breaker = self.breakers[variant]
+            if not breaker.allow():
+                continue
+            attempted = True
+            url, headers = self._request_args(variant, method)
+            started = time.perf_counter()
+            try:
+                response = self.session.post(url, json=payload or {}, headers=headers,
+                                             timeout=timeout or self.timeout)
+            except requests.exceptions.RequestException as e:
+                self._record(method, variant, time.perf_counter() - started, False)
+                breaker.record_failure()
+                last_error = MaxApiError(str(e))
+                continue
+
+            status_code = response.status_code
+            ok = status_code == 200
+            self._record(method, variant, time.perf_counter() - started, ok)
+            if not ok and not is_variant_failure(status_code):
+                breaker.record_success()
+                if variant in self.confirmed:
+                    # Вариант работает, отказ относится к самому запросу: другой вариант ответит так же.
+                    raise MaxApiError(f"Status code: {status_code}", status_code)
+                last_error = MaxApiError(f"Status code: {status_code}", status_code)
+                continue
+            if ok:
+                breaker.record_success()
+                if variant != preferred:
+                    with self._stats_lock:
+                        self.fallbacks += 1
+                self.confirmed.add(variant)
+                self.preferred = variant
+                try:
+                    return response.json()
+                except ValueError:
+                    return {}
+            breaker.record_failure()
+            last_error = MaxApiError(f"Status code: {status_code}", status_code)
+
+        if not attempted:
+            with self._stats_lock:
+                self.rejected += 1
+            raise MaxApiError('MAX API временно недоступен (circuit breaker)')
+        raise last_error
+
+    def stats(self):
+        with self._stats_lock:
+            endpoints = {
+                f'{method}:{variant}': stats.as_dict()
+                for (method, variant), stats in self._stats.items()
+            }
+            fallbacks, rejected = self.fallbacks, self.rejected
+        return {
+            'preferred': self.preferred,
+            'fallbacks': fallbacks,
+            'rejected': rejected,
+            'circuits': {variant: breaker.state for variant, breaker in self.breakers.items()},
+            'endpoints': endpoints
+        }
+
+    def latency_histograms(self):
+        """{(метод, вариант): гистограмма задержек} для экспорта метрик."""
+        with self._stats_lock:
+            return {key: stats.latency.as_dict() for key, stats in self._stats.items()}
@@ -0,0 +1,342 @@
+"""Метрики приложения в формате Prometheus.
+
+Каждый воркер gunicorn считает метрики в памяти: счетчик или гистограмма —
+это несколько сложений под блокировкой, поэтому их можно не выключать в
+продакшене. Раз в flush_interval секунд (и при запросе /metrics) воркер
+записывает свои значения в METRICS_DIR/<pid>.json. /metrics, в какой бы
+воркер он ни попал, складывает файлы всех воркеров: счетчики и гистограммы
+суммируются, gauge — только по живым процессам.
+
+Чтобы счетчики не уменьшались при перезапуске воркера, мастер gunicorn
+(gunicorn.conf.py) переносит значения завершившегося воркера в archive.json
+и удаляет его файл, а при старте очищает каталог.
+
+Значения из stats() компонентов (очереди, кэши, клиент MAX API) снимаются
+функциями-сборщиками в момент записи, а не на каждом событии.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = 'archive.json'
+
+# Значение из сборщика. aggregate — как складывать gauge разных воркеров:
+# 'sum' (очереди, кэши) или 'max' (одинаковое во всех воркерах, например размер каталога).
+Sample = namedtuple('Sample', 'name kind help labels value aggregate', defaults=('sum',))
+
+
+class Histogram:
+    """Гистограмма без собственной блокировки: вызывающий держит свою."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Последняя корзина — +Inf.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class _Family:
+    def __init__(self, registry, name, kind, help_text, labelnames, buckets=None, aggregate='sum'):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self.aggregate = aggregate
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def export(self):
+        if self.kind == 'histogram':
+            samples = [[list(key), histogram.as_dict()] for key, histogram in self.values.items()]
+        else:
+            samples = [[list(key), value] for key, value in self.values.items()]
+        return {'type': self.kind, 'help': self.help, 'labels': list(self.labelnames),
+                'aggregate': self.aggregate, 'samples': samples}
+
+
+class MetricsRegistry:
+    def __init__(self, directory, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._families = {}
+        self._collectors = []
+        self._pid = None
+        self._stop_event = threading.Event()
+
+    def _family(self, name, kind, help_text, labelnames, buckets=None, aggregate='sum'):
+        family = _Family(self, name, kind, help_text, labelnames, buckets, aggregate)
+        self._families[name] = family
+        return family
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._family(name, 'counter', help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=(), aggregate='sum'):
+        return self._family(name, 'gauge', help_text, labelnames, aggregate=aggregate)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._family(name, 'histogram', help_text, labelnames, buckets)
+
+    def add_collector(self, collector):
+        """collector() возвращает список Sample."""
+        self._collectors.append(collector)
+
+    def _collected(self):
+        families = {}
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Ошибка сборщика метрик: {e}")
+                continue
+            for sample in samples:
+                family = families.get(sample.name)
+                if family is None:
+                    family = families[sample.name] = {'type': sample.kind, 'help': sample.help,
+                                                      'labels': sorted(sample.labels),
+                                                      'aggregate': sample.aggregate, 'samples': []}
+                family['samples'].append([[str(sample.labels[label]) for label in family['labels']],
+                                          sample.value])
+        return families
+
+    def export(self):
+        with self.lock:
+            families = {name: family.export() for name, family in self._families.items()}
+        families.update(self._collected())
+        return families
+
+    def flush(self):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        # Записывать могут и фоновый поток, и запрос /metrics: у каждого свой временный файл.
+        partial = f'{path}.{threading.get_ident()}.part'
+        with open(partial, 'w') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(), 'families': self.export()}, f)
+        os.replace(partial, path)
+
+    def ensure_running(self):
+        # Поток записи у каждого воркера свой; после fork он запускается заново.
+        if self.flush_interval <= 0 or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+        thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Не удалось записать метрики: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._pid == os.getpid():
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def render(self):
+        """Метрики всех воркеров в текстовом формате Prometheus."""
+        try:
+            self.flush()
+        except OSError as e:
+            print(f"Не удалось записать метрики: {e}")
+        if not self.directory:
+            return render_families(merge_families([self.export()]))
+        return render_families(read_directory(self.directory))
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        return {}
+
+
+def merge_families(sources, skip_gauges=()):
+    """Складывает экспорт нескольких процессов; skip_gauges — индексы источников без gauge."""
+    merged = {}
+    for index, families in enumerate(sources):
+        for name, family in families.items():
+            if family['type'] == 'gauge' and index in skip_gauges:
+                continue
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {'type': family['type'], 'help': family['help'],
+                                         'labels': family['labels'],
+                                         'aggregate': family.get('aggregate', 'sum'), 'samples': {}}
+            for key, value in family['samples']:
+                key = tuple(key)
+                current = target['samples'].get(key)
+                if current is None and family['type'] != 'histogram':
+                    target['samples'][key] = value
+                elif family['type'] != 'histogram':
+                    target['samples'][key] = max(current, value) if target['aggregate'] == 'max' else current + value
+                elif current is None:
+                    target['samples'][key] = dict(value, counts=list(value['counts']))
+                else:
+                    current['counts'] = [a + b for a, b in zip(current['counts'], value['counts'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+    return merged
+
+
+def read_directory(directory):
+    for _ in range(3):
+        try:
+            names = [name for name in os.listdir(directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            names = []
+        archive = _read_json(os.path.join(directory, ARCHIVE_FILE)) or {}
+        merged_pids = set(archive.get('pids', ()))
+        sources = [archive.get('families', {})]
+        skip_gauges = {0}
+        complete = True
+        for name in names:
+            if name == ARCHIVE_FILE:
+                continue
+            data = _read_json(os.path.join(directory, name))
+            if data is None:
+                # Файл перенесли в архив между чтениями: перечитываем все заново.
+                complete = False
+                break
+            pid = data.get('pid')
+            if not data or pid in merged_pids:
+                continue
+            if not _process_alive(pid):
+                skip_gauges.add(len(sources))
+            sources.append(data.get('families', {}))
+        if complete:
+            break
+    return merge_families(sources, skip_gauges)
+
+
+def mark_process_dead(directory, pid):
+    """Переносит счетчики завершившегося процесса в архив (вызывается мастером gunicorn)."""
+    path = os.path.join(directory, f'{pid}.json')
+    data = _read_json(path)
+    if data is None:
+        return
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    archive = _read_json(archive_path) or {}
+    families = merge_families([archive.get('families', {}), data.get('families', {})], skip_gauges={0, 1})
+    archive = {
+        'pids': sorted(set(archive.get('pids', ())) | {pid}),
+        'families': {
+            name: dict(family, samples=[[list(key), value] for key, value in family['samples'].items()])
+            for name, family in families.items()
+        }
+    }
+    partial = f'{archive_path}.part'
+    with open(partial, 'w') as f:
+        json.dump(archive, f)
+    # Сначала архив с pid, потом удаление файла: читатель не посчитает воркер дважды.
+    os.replace(partial, archive_path)
+    os.remove(path)
+
+
+def clear_directory(directory):
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith('.json') or name.endswith('.part'):
+            os.remove(os.path.join(directory, name))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def render_families(families):
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        names = family['labels']
+        for key in sorted(family['samples']):
+            value = family['samples'][key]
+            if family['type'] != 'histogram':
+                lines.append(f'{name}{_labels(names, key)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip([*value['buckets'], float('inf')], value['counts']):
+                cumulative += count
+                le = 'le="%s"' % _number(float(bound))
+                lines.append(f'{name}_bucket{_labels(names, key, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(names, key)} {_number(value["sum"])}')
+            lines.append(f'{name}_count{_labels(names, key)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
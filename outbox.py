@@ -0,0 +1,182 @@
+"""Фоновая очередь исходящих сообщений бота.
+
+Webhook только ставит ответ в очередь и сразу отвечает платформе, а отправку
+выполняет пул потоков. Сообщения одного чата всегда попадают в один и тот же
+поток, поэтому уходят в том порядке, в котором были поставлены. Общий и
+початовый лимиты скорости реализованы token bucket'ами. Отправка, которая
+упала с исключением (API недоступно), повторяется с экспоненциальной
+задержкой; отказ получателя (job вернул falsy) не повторяется.
+"""
+import os
+import queue
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Забирает токен и возвращает, сколько секунд нужно подождать до отправки."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, stop_event=None):
+        delay = self.reserve()
+        if delay > 0:
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+class SendQueue:
+    def __init__(self, workers=4, maxsize=1000, rate=30.0, chat_rate=1.0, chat_burst=3,
+                 retries=3, backoff=0.5, max_backoff=10.0):
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.global_bucket = TokenBucket(rate) if rate > 0 else None
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+
+        self._queues = []
+        self._threads = []
+        self._pid = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._stop = threading.Event()
+            per_worker = max(1, self.maxsize // self.workers)
+            self._queues = [queue.Queue(per_worker) for _ in range(self.workers)]
+            self._threads = []
+            for index, jobs in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._worker, args=(jobs,), name=f'send-queue-{index}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._pid = pid
+
+    def submit(self, chat_id, job):
+        """Ставит job() в очередь чата.
+
+        job возвращает truthy, если сообщение доставлено, и falsy, если
+        получатель его не принял; исключение означает временный сбой и повтор.
+        """
+        self._ensure_started()
+        jobs = self._queues[hash(chat_id) % self.workers]
+        try:
+            jobs.put_nowait((chat_id, job))
+        except queue.Full:
+            self._count('dropped')
+            print(f"Очередь отправки переполнена, сообщение в чат {chat_id} отброшено")
+            return False
+        return True
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def _worker(self, jobs):
+        chat_buckets = {}
+        last_prune = time.monotonic()
+        while True:
+            item = jobs.get()
+            if item is None:
+                jobs.task_done()
+                break
+            chat_id, job = item
+            try:
+                bucket = chat_buckets.get(chat_id)
+                if bucket is None and self.chat_rate > 0:
+                    bucket = chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                self._deliver(job, bucket)
+            finally:
+                jobs.task_done()
+
+            now = time.monotonic()
+            if now - last_prune > 60:
+                idle = [key for key, b in chat_buckets.items() if now - b.updated > 60]
+                for key in idle:
+                    del chat_buckets[key]
+                last_prune = now
+
+    def _deliver(self, job, chat_bucket):
+        for attempt in range(self.retries + 1):
+            if chat_bucket is not None:
+                chat_bucket.acquire(self._stop)
+            if self.global_bucket is not None:
+                self.global_bucket.acquire(self._stop)
+            try:
+                if job():
+                    self._count('sent')
+                    return True
+                break
+            except Exception as e:
+                print(f"Ошибка отправки сообщения: {e}")
+            if attempt < self.retries:
+                self._count('retried')
+                delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+                if self._stop.wait(delay):
+                    break
+        self._count('failed')
+        return False
+
+    def join(self):
+        for jobs in self._queues:
+            jobs.join()
+
+    def stop(self, timeout=5.0):
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        for jobs in self._queues:
+            try:
+                jobs.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._stop.set()
+        self._pid = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queued': sum(jobs.qsize() for jobs in self._queues),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped
+            }
@@ -0,0 +1,124 @@
+"""Перцептивные хэши фото чеков и поиск почти-дубликатов.
+
+dHash — 64-битный отпечаток изображения: картинка в оттенках серого
+сжимается до 9x8 и для каждой пары соседних пикселей записывается, растет
+ли яркость. Повторная съемка, пережатие или небольшая обрезка того же чека
+меняют лишь несколько бит, поэтому дубликат — это хэш на расстоянии
+Хэмминга не больше k.
+
+Поиск использует multi-index hashing: хэш режется на k + 1 кусков, и по
+принципу Дирихле у хэшей на расстоянии <= k хотя бы один кусок совпадает
+целиком. Каждый кусок — ключ своего словаря, так что проверяются только
+кандидаты из k + 1 корзин, а не вся история.
+"""
+import threading
+
+HASH_BITS = 64
+
+
+def dhash(image, size=8):
+    from PIL import Image
+
+    small = image.convert('L').resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for column in range(size):
+            value = (value << 1) | (pixels[offset + column + 1] > pixels[offset + column])
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class HashIndex:
+    def __init__(self, max_distance=6, bits=HASH_BITS):
+        self.max_distance = max_distance
+        self.bits = bits
+        chunks = max_distance + 1
+        # Куски почти равной длины: первые bits % chunks длиннее на бит.
+        self._chunks = []
+        shift = bits
+        for i in range(chunks):
+            width = bits // chunks + (1 if i < bits % chunks else 0)
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+        self._tables = [{} for _ in self._chunks]
+        self._values = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value_hash, value):
+        self._size += 1
+        values = self._values.get(value_hash)
+        if values is None:
+            self._values[value_hash] = [value]
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                table.setdefault((value_hash >> shift) & mask, []).append(value_hash)
+        else:
+            values.append(value)
+
+    def search(self, value_hash, max_distance=None):
+        """Значения с хэшем на расстоянии <= max_distance, от ближних к дальним."""
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        seen = set()
+        found = []
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for candidate in table.get((value_hash >> shift) & mask, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = hamming(candidate, value_hash)
+                if distance <= max_distance:
+                    found.extend((distance, value) for value in self._values[candidate])
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class ReceiptHashIndex:
+    """HashIndex поверх таблицы хэшей в хранилище.
+
+    Хэши пишут все воркеры gunicorn, поэтому перед поиском индекс догоняет
+    хранилище, читая только строки с id больше последнего загруженного.
+    """
+
+    def __init__(self, storage, max_distance=6):
+        self.storage = storage
+        self.index = HashIndex(max_distance)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            for row_id, receipt_id, value_hash in self.storage.receipt_hashes(self._last_id):
+                self.index.add(value_hash, receipt_id)
+                self._last_id = row_id
+            return self._last_id
+
+    def find(self, value_hash, max_distance=None):
+        self.refresh()
+        with self._lock:
+            return self.index.search(value_hash, max_distance)
+
+    def check(self, value_hash, fetch):
+        """Есть ли зачтенный чек на расстоянии <= max_distance (receipt_check для storage.credit).
+
+        fetch(after_id) читает чеки внутри транзакции начисления: строки,
+        которых еще нет в индексе, сравниваются напрямую и в индекс не
+        попадают, пока не будут прочитаны обычным refresh после коммита.
+        """
+        if self.find(value_hash):
+            return True
+        with self._lock:
+            last_id = self._last_id
+        return any(hamming(value_hash, candidate) <= self.index.max_distance
+                   for _, _, candidate in fetch(last_id))
+
+    def stats(self):
+        with self._lock:
+            return {'hashes': len(self.index), 'last_id': self._last_id}
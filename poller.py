@@ -0,0 +1,240 @@
+"""Бот ТрешКеш в отдельном процессе: long polling вместо webhook.
+
+Запуск:
+    python poller.py --workers 4
+
+Процесс забирает обновления методом getUpdates через общий пул соединений
+MaxApiClient и раскладывает их по пулу потоков: обновления одного чата
+всегда обрабатываются одним потоком и по порядку. Команды разбирает тот же
+диспетчер, что и /webhook (bot.py). После обработки пачки offset
+сохраняется в файл, поэтому после перезапуска приходят только
+необработанные обновления, а редкие повторы отсекает дедупликация по
+update_id. Webhook и long polling взаимоисключающие: при старте webhook
+удаляется (если не указан --keep-webhook).
+"""
+import argparse
+import os
+import queue
+import signal
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from bot import Bot
+from max_api import MaxApiClient, MaxApiError
+from outbox import SendQueue
+from storage import create_storage
+
+
+class OffsetCheckpoint:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, offset):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        partial = f'{self.path}.part'
+        with open(partial, 'w') as f:
+            f.write(str(offset))
+        os.replace(partial, self.path)
+
+
+def update_chat_id(update):
+    message = update.get('message')
+    if isinstance(message, dict):
+        return (message.get('chat') or {}).get('id')
+    return None
+
+
+class ChatWorkers:
+    """Пул потоков, где обновления одного чата обрабатываются по порядку."""
+
+    def __init__(self, handler, workers=4, maxsize=1000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        per_worker = max(1, maxsize // self.workers)
+        self._queues = [queue.Queue(per_worker) for _ in range(self.workers)]
+        self._threads = []
+        for index, jobs in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(jobs,), name=f'updates-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, chat_id, update):
+        # Блокирующий put: если обработчики не успевают, поллер ждет, а не теряет обновления.
+        self._queues[hash(chat_id) % self.workers].put(update)
+
+    def _worker(self, jobs):
+        while True:
+            update = jobs.get()
+            try:
+                if update is None:
+                    break
+                self.handler(update)
+            finally:
+                jobs.task_done()
+
+    def join(self):
+        for jobs in self._queues:
+            jobs.join()
+
+    def stop(self):
+        for jobs in self._queues:
+            jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class UpdatePoller:
+    def __init__(self, max_api, bot, checkpoint, workers=4, limit=100, timeout=25,
+                 backoff=1.0, max_backoff=30.0):
+        self.max_api = max_api
+        self.bot = bot
+        self.checkpoint = checkpoint
+        self.limit = limit
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.offset = checkpoint.load()
+        self.workers = ChatWorkers(bot.dispatch, workers)
+        self.stop_event = threading.Event()
+
+        self.polls = 0
+        self.received = 0
+        self.processed = 0
+        self.errors = 0
+        self._fetching = False
+
+    def fetch(self):
+        payload = {'limit': self.limit, 'timeout': self.timeout}
+        if self.offset is not None:
+            payload['offset'] = self.offset
+        self._fetching = True
+        try:
+            # Таймаут чтения больше времени ожидания сервера, иначе пустой long poll считается ошибкой.
+            response = self.max_api.call('getUpdates', payload, timeout=(3.05, self.timeout + 10))
+        finally:
+            self._fetching = False
+        updates = (response.get('result') or []) if isinstance(response, dict) else None
+        if not isinstance(updates, list):
+            raise MaxApiError('Некорректный ответ getUpdates')
+        return [update for update in updates if isinstance(update, dict)]
+
+    def poll_once(self):
+        updates = self.fetch()
+        self.polls += 1
+        if not updates:
+            return 0
+
+        fresh = self.bot.fresh_updates(updates)
+        submitted = 0
+        try:
+            for update in fresh:
+                self.workers.submit(update_chat_id(update), update)
+                submitted += 1
+            self.workers.join()
+        except BaseException:
+            # Поставленные в очередь обновления обработаются, остальные должны прийти снова.
+            self.bot.release_updates(fresh[submitted:])
+            raise
+
+        self.received += len(updates)
+        self.processed += len(fresh)
+        update_ids = [u['update_id'] for u in updates if isinstance(u.get('update_id'), int)]
+        if update_ids:
+            # Offset в памяти сдвигается и без файла: пачка уже обработана.
+            self.offset = max(update_ids) + 1
+            self.checkpoint.save(self.offset)
+        return len(updates)
+
+    def run(self):
+        delay = self.backoff
+        while not self.stop_event.is_set():
+            try:
+                self.poll_once()
+                delay = self.backoff
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                # Ни ошибка API, ни сбой записи offset не должны останавливать поллер.
+                self.errors += 1
+                print(f"Ошибка long polling: {e}, повтор через {delay:.1f} с")
+                self.stop_event.wait(delay)
+                delay = min(self.max_backoff, delay * 2)
+
+    def request_stop(self, signum=None, frame=None):
+        self.stop_event.set()
+        # Прерываем только ожидание long poll; начатая пачка дорабатывается до конца.
+        if self._fetching:
+            raise KeyboardInterrupt
+
+    def close(self):
+        self.workers.stop()
+
+    def stats(self):
+        return {
+            'offset': self.offset,
+            'polls': self.polls,
+            'received': self.received,
+            'processed': self.processed,
+            'errors': self.errors
+        }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Long polling бота ТрешКеш')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('POLL_WORKERS', '4')))
+    parser.add_argument('--limit', type=int, default=100, help='обновлений за запрос')
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('POLL_TIMEOUT', '25')),
+                        help='время ожидания long poll, секунды')
+    parser.add_argument('--checkpoint', default=os.getenv('POLL_CHECKPOINT', 'data/poller.offset'),
+                        help='файл с сохраненным offset')
+    parser.add_argument('--keep-webhook', action='store_true', help='не удалять webhook при старте')
+    args = parser.parse_args()
+
+    token = os.getenv('BOT_TOKEN', '')
+    if not token:
+        parser.error('BOT_TOKEN не настроен')
+
+    storage = create_storage()
+    send_queue = SendQueue(
+        workers=int(os.getenv('SEND_WORKERS', '4')),
+        maxsize=int(os.getenv('SEND_QUEUE_SIZE', '1000')),
+        rate=float(os.getenv('SEND_RATE', '30')),
+        chat_rate=float(os.getenv('SEND_CHAT_RATE', '1')),
+        retries=int(os.getenv('SEND_RETRIES', '3'))
+    )
+    max_api = MaxApiClient(token, os.getenv('MAX_API_BASE_URL', 'https://platform-api.max.ru'))
+    bot = Bot(max_api, send_queue, storage, os.getenv('WEBAPP_URL', 'http://46.173.29.103/'),
+              int(os.getenv('UPDATE_DEDUP_TTL', '600')))
+    poller = UpdatePoller(max_api, bot, OffsetCheckpoint(args.checkpoint),
+                          workers=args.workers, limit=args.limit, timeout=args.timeout)
+
+    if not args.keep_webhook:
+        max_api.call('deleteWebhook')
+    signal.signal(signal.SIGTERM, poller.request_stop)
+    signal.signal(signal.SIGINT, poller.request_stop)
+
+    print(f"Long polling запущен, offset={poller.offset}")
+    started = time.monotonic()
+    try:
+        poller.run()
+    finally:
+        poller.close()
+        send_queue.join()
+        send_queue.stop()
+        storage.close()
+    print(f"Long polling остановлен за {time.monotonic() - started:.0f} с: {poller.stats()}")
+
+
+if __name__ == '__main__':
+    main()
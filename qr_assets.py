@@ -0,0 +1,270 @@
+"""Готовые изображения QR-кодов пунктов приема.
+
+PNG и SVG каждого пункта рендерятся заранее, в пуле процессов, когда
+каталог загружается или меняется, и лежат на диске под именем — SHA-256
+от всего, что влияет на результат (версия рендера, формат, размер, текст
+кода). Поэтому имя файла и служит сильным ETag: пока в каталоге тот же
+qr_code, ответ не меняется, а новые размеры или другой код получают
+новые файлы, без инвалидации старых.
+
+Несколько воркеров gunicorn загружают один и тот же каталог; рендер
+сериализуется блокировкой файла prerender.lock, и следующий воркер
+находит все файлы уже готовыми. Если файла нет (например, кэш очистили),
+он рендерится прямо в запросе — это единицы миллисекунд.
+
+Архив для печати собирается потоково: ZIP пишется в буфер, который
+отдается клиенту после каждого файла, так что в памяти не бывает больше
+одного изображения.
+"""
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+RENDER_VERSION = 1
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+BORDER = 4
+BATCH_SIZE = 50
+CHUNK_SIZE = 64 * 1024
+_ARCNAME_RE = re.compile(r'[^\w.-]+')
+
+
+def asset_key(text, fmt, size):
+    data = f'{RENDER_VERSION}\0{fmt}\0{size}\0{text}'.encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def qr_matrix(text):
+    import qrcode
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=BORDER)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def _png(matrix, size):
+    from PIL import Image
+
+    modules = len(matrix)
+    image = Image.new('1', (modules, modules), 1)
+    image.putdata([0 if dark else 1 for row in matrix for dark in row])
+    # Целое число пикселей на модуль, остаток — белое поле: код остается четким.
+    box = max(size // modules, 1)
+    image = image.resize((modules * box, modules * box), Image.NEAREST)
+    if image.width != size:
+        canvas = Image.new('1', (max(size, image.width),) * 2, 1)
+        offset = (canvas.width - image.width) // 2
+        canvas.paste(image, (offset, offset))
+        image = canvas
+    return image
+
+
+def _svg(matrix, size):
+    modules = len(matrix)
+    path = ''.join(f'M{x} {y}h1v1h-1z' for y, row in enumerate(matrix) for x, dark in enumerate(row) if dark)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+        f'<rect width="{modules}" height="{modules}" fill="#fff"/>'
+        f'<path d="{path}" fill="#000"/></svg>\n'
+    )
+
+
+def render_assets(text, variants):
+    """Рендерит код text в файлы variants = [(fmt, size, path), ...].
+
+    Матрица кода (самая долгая часть) считается один раз на все варианты.
+    Запись атомарная: .part с pid и потоком, затем os.replace.
+    """
+    matrix = qr_matrix(text)
+    for fmt, size, path in variants:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        if fmt == 'png':
+            _png(matrix, size).save(partial, 'PNG')
+        else:
+            with open(partial, 'w', encoding='utf-8') as f:
+                f.write(_svg(matrix, size))
+        os.replace(partial, path)
+    return len(variants)
+
+
+def render_batch(jobs):
+    return sum(render_assets(text, variants) for text, variants in jobs)
+
+
+class _StreamBuffer:
+    """Неперематываемый файл для zipfile: написанное забирается через take()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def archive_name(point, fmt):
+    code = _ARCNAME_RE.sub('_', str(point['qr_code'])).strip('._') or 'qr'
+    return f"{point['id']}_{code}.{fmt}"
+
+
+class QrAssetStore:
+    def __init__(self, root, sizes=(256, 512, 1024), default_size=512, workers=1):
+        self.root = root
+        self.sizes = tuple(sorted(set(sizes)))
+        self.default_size = default_size if default_size in self.sizes else self.sizes[0]
+        self.workers = workers
+        self.rendered = 0
+        self.failures = 0
+        self.last_error = None
+        self.prerendered_version = None
+        self.prerendered_at = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._pid = None
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, text, fmt, size):
+        key = asset_key(text, fmt, size)
+        return os.path.join(self.root, key[:2], f'{key}.{fmt}'), key
+
+    def asset(self, text, fmt, size=None):
+        """(путь, ETag) готового изображения; рендерит его, если файла нет."""
+        size = self.default_size if size is None else size
+        if fmt not in FORMATS or size not in self.sizes:
+            raise ValueError('unsupported format or size')
+        path, key = self.path(text, fmt, size)
+        if not os.path.exists(path):
+            render_assets(text, [(fmt, size, path)])
+            with self._lock:
+                self.rendered += 1
+        return path, key
+
+    def schedule(self, snapshot):
+        """Слушатель загрузки каталога: рендер в фоне, последний снимок побеждает."""
+        with self._lock:
+            self._snapshot = snapshot
+        self._wake.set()
+
+    def ensure_running(self):
+        # Поток и пул у каждого воркера свои; снимок, загруженный до fork, тоже рендерится.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        thread = threading.Thread(target=self._run, name='qr-prerender', daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            if self._stop_event.is_set():
+                return
+            self._wake.clear()
+            with self._lock:
+                snapshot = self._snapshot
+            if snapshot is None:
+                continue
+            try:
+                self.prerender(snapshot)
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                    self.last_error = str(e)
+                print(f"Ошибка рендера QR-кодов: {e}")
+
+    def _missing(self, snapshot):
+        jobs = []
+        for text in dict.fromkeys(point['qr_code'] for point in snapshot.points if point.get('qr_code')):
+            variants = []
+            for fmt in FORMATS:
+                for size in self.sizes:
+                    path, _ = self.path(text, fmt, size)
+                    if not os.path.exists(path):
+                        variants.append((fmt, size, path))
+            if variants:
+                jobs.append((text, variants))
+        return jobs
+
+    def prerender(self, snapshot):
+        """Рендерит все недостающие изображения снимка; возвращает их число."""
+        rendered = 0
+        with open(os.path.join(self.root, 'prerender.lock'), 'w') as lock:
+            # Воркеры рендерят по очереди; следующий найдет файлы готовыми.
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            jobs = self._missing(snapshot)
+            if jobs:
+                batches = [jobs[i:i + BATCH_SIZE] for i in range(0, len(jobs), BATCH_SIZE)]
+                context = multiprocessing.get_context('spawn')
+                # Пул нужен только на время рендера: каталог меняется редко.
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+                    for count in pool.map(render_batch, batches):
+                        rendered += count
+                        with self._lock:
+                            self.rendered += count
+                        if self._stop_event.is_set():
+                            pool.shutdown(wait=True, cancel_futures=True)
+                            return rendered
+        with self._lock:
+            self.prerendered_version = snapshot.version
+            self.prerendered_at = time.time()
+        return rendered
+
+    def iter_zip(self, snapshot, fmt, size=None):
+        """Поток байтов ZIP-архива с кодами всех пунктов снимка."""
+        size = self.default_size if size is None else size
+        if fmt not in FORMATS or size not in self.sizes:
+            raise ValueError('unsupported format or size')
+        # PNG уже сжат, SVG сжимается в разы.
+        compression = zipfile.ZIP_STORED if fmt == 'png' else zipfile.ZIP_DEFLATED
+        return self._zip_chunks([p for p in snapshot.points if p.get('qr_code')], fmt, size, compression)
+
+    def _zip_chunks(self, points, fmt, size, compression):
+        buffer = _StreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', compression=compression) as archive:
+            for point in points:
+                path, _ = self.asset(point['qr_code'], fmt, size)
+                info = zipfile.ZipInfo(archive_name(point, fmt), date_time=time.localtime()[:6])
+                info.compress_type = compression
+                with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                    while True:
+                        chunk = source.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                data = buffer.take()
+                if data:
+                    yield data
+        yield buffer.take()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sizes': list(self.sizes),
+                'rendered': self.rendered,
+                'failures': self.failures,
+                'last_error': self.last_error,
+                'prerendered_version': self.prerendered_version,
+                'prerendered_at': self.prerendered_at
+            }
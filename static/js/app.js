@@ -8,6 +8,7 @@ const AppState = {
     myRewards: [],
     transactions: [],
     currentPoint: null,
+    receiptFile: null,
     stats: {
         totalRecycled: 0,
         totalTransactions: 0,
@@ -22,20 +23,22 @@ document.addEventListener('DOMContentLoaded', async () => {
         await new Promise(resolve => setTimeout(resolve, 100));
     }
     
-    await validateUser();
-    await loadInitialData();
-    await loadUserStats();
+    await bootstrapApp();
     setupEventHandlers();
     
     document.getElementById('loading').classList.add('hidden');
     document.getElementById('main-screen').classList.remove('hidden');
+    
+    loadRecyclingPoints();
+    window.addEventListener('online', flushPendingDrops);
+    flushPendingDrops();
 });
 
-async function validateUser() {
+async function bootstrapApp() {
     const initData = window.maxBridge.getInitData();
     
     try {
-        const response = await fetch('/api/validate', {
+        const response = await fetch('/api/bootstrap', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -45,28 +48,49 @@ async function validateUser() {
         
         const data = await response.json();
         
-        if (data.valid && data.userId) {
-            AppState.userId = data.userId;
-            
-            const userData = window.maxBridge.getUserData();
-            if (userData) {
-                AppState.userData = userData;
-                updateProfileDisplay(userData);
-            } else if (data.user) {
-                AppState.userData = {
-                    id: data.user.id,
-                    first_name: data.user.first_name || '',
-                    last_name: data.user.last_name || '',
-                    username: data.user.username || '',
-                    photo_url: data.user.photo_url || null
-                };
-                updateProfileDisplay(AppState.userData);
-            }
-            
-            return true;
-        } else {
+        if (!data.valid || !data.userId) {
             throw new Error('Не удалось авторизоваться');
         }
+        
+        AppState.userId = data.userId;
+        
+        const userData = window.maxBridge.getUserData();
+        if (userData) {
+            AppState.userData = userData;
+            updateProfileDisplay(userData);
+        } else if (data.user) {
+            AppState.userData = {
+                id: data.user.id,
+                first_name: data.user.first_name || '',
+                last_name: data.user.last_name || '',
+                username: data.user.username || '',
+                photo_url: data.user.photo_url || null
+            };
+            updateProfileDisplay(AppState.userData);
+        }
+        
+        AppState.balance = data.balance || 0;
+        updateBalanceDisplay();
+        
+        AppState.myRewards = data.myRewards || [];
+        AppState.transactions = data.transactions || [];
+        renderTransactions();
+        
+        AppState.rewards = data.rewards || [];
+        renderRewards();
+        
+        AppState.recyclingPoints = data.points || [];
+        renderRecyclingPoints();
+        initMap();
+        
+        if (data.stats) {
+            AppState.stats = data.stats;
+            updateStatsDisplay();
+        } else {
+            calculateStatsFromTransactions();
+        }
+        
+        return true;
     } catch (error) {
         console.error('Ошибка валидации:', error);
         alert('Ошибка авторизации. Пожалуйста, перезагрузите приложение.');
@@ -74,16 +98,6 @@ async function validateUser() {
     }
 }
 
-async function loadInitialData() {
-    await Promise.all([
-        loadBalance(),
-        loadRecyclingPoints(),
-        loadRewards(),
-        loadTransactions(),
-        loadMyRewards()
-    ]);
-}
-
 async function loadMyRewards() {
     try {
         const initData = window.maxBridge.getInitData();
@@ -152,22 +166,6 @@ function updateProfileDisplay(userData) {
     }
 }
 
-async function loadUserStats() {
-    try {
-        const initData = window.maxBridge.getInitData();
-        const response = await fetch(`/api/user/stats?initData=${encodeURIComponent(initData)}`);
-        const data = await response.json();
-        
-        if (data.stats) {
-            AppState.stats = data.stats;
-            updateStatsDisplay();
-        }
-    } catch (error) {
-        console.error('Ошибка загрузки статистики:', error);
-        calculateStatsFromTransactions();
-    }
-}
-
 function calculateStatsFromTransactions() {
     const transactions = AppState.transactions || [];
     
@@ -195,7 +193,8 @@ function calculateStatsFromTransactions() {
         totalTransactions,
         totalRewards,
         level,
-        points: Math.round(points)
+        points: Math.round(points),
+        rank: AppState.stats.rank || null
     };
     
     updateStatsDisplay();
@@ -224,7 +223,9 @@ function updateStatsDisplay() {
     
     const levelElement = document.getElementById('profile-level');
     if (levelElement) {
-        levelElement.textContent = `Уровень ${stats.level}`;
+        levelElement.textContent = stats.rank
+            ? `Уровень ${stats.level} · ${stats.rank.position} место из ${stats.rank.total}`
+            : `Уровень ${stats.level}`;
     }
     
     const levelProgress = document.getElementById('level-progress');
@@ -253,17 +254,13 @@ async function loadRecyclingPoints() {
             }
         }
         
-        let url = '/api/recycling-points';
-        if (lat && lng) {
-            url += `?lat=${lat}&lng=${lng}`;
-        }
+        if (!lat || !lng) return;
         
-        const response = await fetch(url);
+        const response = await fetch(`/api/recycling-points?lat=${lat}&lng=${lng}`);
         const data = await response.json();
         
         AppState.recyclingPoints = data.points || [];
         renderRecyclingPoints();
-        initMap();
     } catch (error) {
         console.error('Ошибка загрузки пунктов:', error);
     }
@@ -374,40 +371,8 @@ function initMap() {
             controls: ['zoomControl', 'fullscreenControl']
         });
         
-        const markerIcon = createMarkerIcon();
-        
-        AppState.recyclingPoints.forEach(point => {
-            const marker = new ymaps.Placemark(
-                [point.lat, point.lng],
-                {
-                    balloonContentHeader: `<strong>${point.name}</strong>`,
-                    balloonContentBody: `
-                        <p>📍 ${point.address}</p>
-                        <p>🕐 ${point.hours}</p>
-                        <p><strong>Принимает:</strong></p>
-                        <p>${point.types.map(t => `<span style="display: inline-block; background: #4CAF50; color: white; padding: 2px 8px; border-radius: 10px; margin: 2px; font-size: 11px;">${t}</span>`).join('')}</p>
-                        <button onclick="window.showPointDetailsFromMap(${point.id})" style="margin-top: 8px; padding: 8px 16px; background: #4CAF50; color: white; border: none; border-radius: 8px; cursor: pointer; width: 100%;">
-                            Сдать мусор
-                        </button>
-                    `,
-                    balloonContentFooter: `<small>ID: ${point.qr_code}</small>`
-                },
-                {
-                    iconLayout: 'default#imageWithContent',
-                    iconImageHref: markerIcon,
-                    iconImageSize: [48, 48],
-                    iconImageOffset: [-24, -48],
-                    iconContentOffset: [24, 24]
-                }
-            );
-            
-            marker.events.add('click', () => {
-                showPointDetails(point.id);
-            });
-            
-            yandexMap.geoObjects.add(marker);
-            mapMarkers.push({ marker, pointId: point.id });
-        });
+        yandexMap.events.add('boundschange', scheduleMapClustersLoad);
+        loadMapClusters();
         
         if (navigator.geolocation) {
             navigator.geolocation.getCurrentPosition(
@@ -439,6 +404,110 @@ function initMap() {
     });
 }
 
+let markerIcon = null;
+let clustersTimer = null;
+let clustersRequestId = 0;
+
+function getMarkerIcon() {
+    if (!markerIcon) {
+        markerIcon = createMarkerIcon();
+    }
+    return markerIcon;
+}
+
+function scheduleMapClustersLoad() {
+    clearTimeout(clustersTimer);
+    clustersTimer = setTimeout(loadMapClusters, 250);
+}
+
+// Карта запрашивает только кластеры видимой области: размер ответа зависит
+// от экрана, а не от числа пунктов в каталоге.
+async function loadMapClusters() {
+    if (!yandexMap) return;
+    
+    const [[lat1, lng1], [lat2, lng2]] = yandexMap.getBounds();
+    const zoom = Math.round(yandexMap.getZoom());
+    const requestId = ++clustersRequestId;
+    
+    try {
+        const response = await fetch(`/api/recycling-points/clusters?bbox=${lat1},${lng1},${lat2},${lng2}&zoom=${zoom}`);
+        if (!response.ok) return;
+        const data = await response.json();
+        // Пока ответ шел, карту могли сдвинуть еще раз.
+        if (requestId !== clustersRequestId) return;
+        renderMapClusters(data.clusters || []);
+    } catch (error) {
+        console.error('Ошибка загрузки кластеров:', error);
+    }
+}
+
+function renderMapClusters(clusters) {
+    mapMarkers.forEach(({ marker }) => yandexMap.geoObjects.remove(marker));
+    mapMarkers = [];
+    
+    clusters.forEach(cluster => {
+        const marker = cluster.point ? createPointMarker(cluster.point) : createClusterMarker(cluster);
+        yandexMap.geoObjects.add(marker);
+        mapMarkers.push({ marker, pointId: cluster.point ? cluster.point.id : null });
+    });
+}
+
+function createClusterMarker(cluster) {
+    const materials = Object.entries(cluster.materials)
+        .sort((a, b) => b[1] - a[1])
+        .map(([type, count]) => `${type}: ${count}`)
+        .join(', ');
+    const marker = new ymaps.Placemark(
+        [cluster.lat, cluster.lng],
+        {
+            iconContent: cluster.count,
+            hintContent: `${cluster.count} пунктов (${materials})`
+        },
+        {
+            preset: 'islands#greenCircleIcon'
+        }
+    );
+    
+    marker.events.add('click', () => {
+        const [lat1, lng1, lat2, lng2] = cluster.bounds;
+        yandexMap.setBounds([[lat1, lng1], [lat2, lng2]], { checkZoomRange: true, zoomMargin: 40 });
+    });
+    
+    return marker;
+}
+
+function createPointMarker(point) {
+    const marker = new ymaps.Placemark(
+        [point.lat, point.lng],
+        {
+            balloonContentHeader: `<strong>${point.name}</strong>`,
+            balloonContentBody: `
+                <p>📍 ${point.address}</p>
+                <p>🕐 ${point.hours}</p>
+                <p><strong>Принимает:</strong></p>
+                <p>${point.types.map(t => `<span style="display: inline-block; background: #4CAF50; color: white; padding: 2px 8px; border-radius: 10px; margin: 2px; font-size: 11px;">${t}</span>`).join('')}</p>
+                <button onclick="window.showPointDetailsFromMap(${point.id})" style="margin-top: 8px; padding: 8px 16px; background: #4CAF50; color: white; border: none; border-radius: 8px; cursor: pointer; width: 100%;">
+                    Сдать мусор
+                </button>
+            `,
+            balloonContentFooter: `<small>ID: ${point.qr_code}</small>`
+        },
+        {
+            iconLayout: 'default#imageWithContent',
+            iconImageHref: getMarkerIcon(),
+            iconImageSize: [48, 48],
+            iconImageOffset: [-24, -48],
+            iconContentOffset: [24, 24]
+        }
+    );
+    
+    marker.events.add('click', () => {
+        showPointDetails(point.id);
+    });
+    
+    return marker;
+}
+
 function createMarkerIcon() {
     const canvas = document.createElement('canvas');
     canvas.width = 48;
@@ -552,6 +621,56 @@ function getRewardGradient(type) {
     return gradients[type] || 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)';
 }
 
+// Повтор запроса с тем же ключом не спишет и не начислит монеты второй раз.
+function newIdempotencyKey() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Ключ живет, пока операция не получит окончательный ответ: повтор после
+// обрыва связи или 5xx (в том числе повторное нажатие) уходит с тем же ключом.
+const pendingIdempotencyKeys = new Map();
+const IDEMPOTENT_ATTEMPTS = 3;
+
+function idempotencyKeyFor(operation) {
+    if (!pendingIdempotencyKeys.has(operation)) {
+        pendingIdempotencyKeys.set(operation, newIdempotencyKey());
+    }
+    return pendingIdempotencyKeys.get(operation);
+}
+
+async function postIdempotent(url, operation, body) {
+    const key = idempotencyKeyFor(operation);
+    const initData = window.maxBridge.getInitData();
+    let lastError = null;
+    for (let attempt = 0; attempt < IDEMPOTENT_ATTEMPTS; attempt++) {
+        if (attempt > 0) {
+            await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+        }
+        try {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-Init-Data': initData,
+                    'Idempotency-Key': key
+                },
+                body: JSON.stringify({ initData, ...body })
+            });
+            if (response.status < 500) {
+                pendingIdempotencyKeys.delete(operation);
+                return response;
+            }
+            lastError = new Error(`Сервер временно недоступен (${response.status})`);
+        } catch (error) {
+            lastError = error;
+        }
+    }
+    throw lastError;
+}
+
 async function purchaseReward(rewardId) {
     if (!window.maxBridge.showConfirm) {
         if (!confirm('Вы уверены, что хотите купить эту награду?')) {
@@ -565,14 +684,7 @@ async function purchaseReward(rewardId) {
     }
     
     try {
-        const initData = window.maxBridge.getInitData();
-        const response = await fetch(`/api/rewards/${rewardId}/purchase`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ initData })
-        });
+        const response = await postIdempotent(`/api/rewards/${rewardId}/purchase`, `purchase:${rewardId}`, {});
         
         const data = await response.json();
         
@@ -820,20 +932,49 @@ function handleReceiptSelect(e) {
     const file = e.target.files[0];
     if (!file) return;
     
-    const reader = new FileReader();
-    reader.onload = (event) => {
-        const preview = document.getElementById('receipt-preview');
-        if (preview) {
-            preview.innerHTML = `<img src="${event.target.result}" alt="Чек">`;
-            preview.classList.remove('hidden');
-        }
-        
-        const btnSubmit = document.getElementById('btn-submit-receipt');
-        if (btnSubmit) {
-            btnSubmit.disabled = false;
-        }
-    };
-    reader.readAsDataURL(file);
+    AppState.receiptFile = file;
+    const preview = document.getElementById('receipt-preview');
+    if (preview) {
+        const previous = preview.querySelector('img');
+        if (previous) URL.revokeObjectURL(previous.src);
+        preview.innerHTML = `<img src="${URL.createObjectURL(file)}" alt="Чек">`;
+        preview.classList.remove('hidden');
+    }
+    
+    const btnSubmit = document.getElementById('btn-submit-receipt');
+    if (btnSubmit) {
+        btnSubmit.disabled = false;
+    }
+}
+
+async function uploadReceipt(file) {
+    const response = await fetch('/api/receipts/upload', {
+        method: 'POST',
+        headers: {
+            'Content-Type': file.type || 'image/jpeg',
+            'X-Init-Data': window.maxBridge.getInitData()
+        },
+        body: file
+    });
+    
+    const data = await response.json();
+    if (!response.ok) {
+        throw new Error(data.error || 'Не удалось загрузить фото чека');
+    }
+    
+    // Начисление принимается только после проверки фото на дубликаты.
+    let status = data.status;
+    for (let attempt = 0; status === 'processing' && attempt < 30; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        const statusResponse = await fetch(`/api/receipts/${data.receiptId}`, {
+            headers: { 'X-Init-Data': window.maxBridge.getInitData() }
+        });
+        status = (await statusResponse.json()).status;
+    }
+    if (status !== 'ready') {
+        throw new Error('Не удалось обработать фото чека');
+    }
+    return data.receiptId;
 }
 
 async function loadPointsForReceipt() {
@@ -841,11 +982,15 @@ async function loadPointsForReceipt() {
     if (!select) return;
     
     try {
-        const response = await fetch('/api/recycling-points');
-        const data = await response.json();
+        let points = AppState.recyclingPoints;
+        if (points.length === 0) {
+            const response = await fetch('/api/recycling-points');
+            const data = await response.json();
+            points = data.points || [];
+        }
         
         select.innerHTML = '<option value="">Выберите пункт</option>' +
-            data.points.map(p => `<option value="${p.id}">${p.name} - ${p.address}</option>`).join('');
+            points.map(p => `<option value="${p.id}">${p.name} - ${p.address}</option>`).join('');
     } catch (error) {
         console.error('Ошибка загрузки пунктов:', error);
     }
@@ -855,7 +1000,6 @@ async function submitReceipt() {
     const pointSelect = document.getElementById('receipt-point-select');
     const materialSelect = document.getElementById('receipt-material-select');
     const weightInput = document.getElementById('receipt-weight');
-    const preview = document.getElementById('receipt-preview');
     
     if (!pointSelect || !materialSelect || !weightInput) return;
     
@@ -868,28 +1012,43 @@ async function submitReceipt() {
         return;
     }
     
-    const receiptPhoto = preview?.querySelector('img')?.src || '';
+    let receiptId = null;
+    if (AppState.receiptFile) {
+        try {
+            receiptId = await uploadReceipt(AppState.receiptFile);
+        } catch (error) {
+            console.error('Ошибка загрузки чека:', error);
+            alert(error.message);
+            return;
+        }
+    }
     
-    await submitRecycling('receipt', pointId, null, receiptPhoto, materialType, weight);
+    await submitRecycling('receipt', pointId, null, receiptId, materialType, weight);
 }
 
-async function submitRecycling(method, pointId, qrCode, receiptPhoto, materialType, weight) {
+async function submitRecycling(method, pointId, qrCode, receiptId, materialType, weight) {
+    // Тот же ключ служит clientId в очереди: дошедшая до сервера сдача не зачтется дважды.
+    const operation = `submit:${method}:${pointId}:${qrCode}:${receiptId}:${materialType}:${weight}`;
+    const clientId = idempotencyKeyFor(operation);
+    const offlineDrop = { clientId, method, qrCode, materialType, weight, recordedAt: new Date().toISOString() };
+    const queueOffline = () => {
+        // Дальше ключом владеет очередь сдач.
+        pendingIdempotencyKeys.delete(operation);
+        queueDrop(offlineDrop);
+    };
+    if (method === 'qr' && !navigator.onLine) {
+        queueOffline();
+        return;
+    }
+    
     try {
-        const initData = window.maxBridge.getInitData();
-        const response = await fetch('/api/recycling/submit', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                initData,
-                method,
-                pointId,
-                qrCode,
-                receiptPhoto,
-                materialType,
-                weight
-            })
+        const response = await postIdempotent('/api/recycling/submit', operation, {
+            method,
+            pointId,
+            qrCode,
+            receiptId,
+            materialType,
+            weight
         });
         
         const data = await response.json();
@@ -915,11 +1074,102 @@ async function submitRecycling(method, pointId, qrCode, receiptPhoto, materialTy
             throw new Error(data.error || 'Ошибка обработки сдачи');
         }
     } catch (error) {
+        // TypeError от fetch — нет связи; ответ сервера с ошибкой повторять бесполезно.
+        if (method === 'qr' && error instanceof TypeError) {
+            queueOffline();
+            return;
+        }
         console.error('Ошибка отправки:', error);
         alert(error.message || 'Не удалось обработать сдачу мусора');
     }
 }
 
+// Сдачи по QR-коду без связи копятся в localStorage и уходят пачкой, когда связь появится.
+const PENDING_DROPS_BATCH = 50;
+let flushingDrops = false;
+
+function pendingDropsKey() {
+    return `trashcash.pendingDrops.${AppState.userId}`;
+}
+
+function loadPendingDrops() {
+    try {
+        return JSON.parse(localStorage.getItem(pendingDropsKey())) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function savePendingDrops(drops) {
+    try {
+        localStorage.setItem(pendingDropsKey(), JSON.stringify(drops));
+    } catch (error) {
+        console.error('Не удалось сохранить очередь сдач:', error);
+    }
+}
+
+function queueDrop(drop) {
+    savePendingDrops([...loadPendingDrops(), drop]);
+    closeModal('modal-receipt');
+    window.maxBridge.showAlert('Нет связи с сервером. Сдача сохранена и будет отправлена автоматически.');
+}
+
+async function flushPendingDrops() {
+    if (flushingDrops || !navigator.onLine || !AppState.userId || loadPendingDrops().length === 0) return;
+    
+    flushingDrops = true;
+    let coins = 0;
+    let sent = 0;
+    let credited = 0;
+    const errors = [];
+    try {
+        let drops = loadPendingDrops();
+        while (drops.length > 0) {
+            const batch = drops.slice(0, PENDING_DROPS_BATCH);
+            const initData = window.maxBridge.getInitData();
+            const response = await fetch('/api/recycling/submit-batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-Init-Data': initData
+                },
+                body: JSON.stringify({ initData, drops: batch })
+            });
+            const data = await response.json();
+            if (!data.success) {
+                throw new Error(data.error || 'Ошибка отправки');
+            }
+            
+            // Каждый результат окончательный: начислено, уже было зачтено или отклонено.
+            data.results.forEach(result => {
+                if (result.status === 'credited') credited += 1;
+                if (result.status === 'error') errors.push(result.error);
+            });
+            coins += data.coins;
+            AppState.balance = data.balance;
+            sent += batch.length;
+            const done = new Set(batch.map(drop => drop.clientId));
+            drops = loadPendingDrops().filter(drop => !done.has(drop.clientId));
+            savePendingDrops(drops);
+        }
+    } catch (error) {
+        console.error('Не удалось отправить накопленные сдачи:', error);
+    } finally {
+        flushingDrops = false;
+    }
+    
+    if (sent === 0) return;
+    updateBalanceDisplay();
+    await loadTransactions();
+    calculateStatsFromTransactions();
+    if (credited === 0 && errors.length === 0) return;
+    let message = `Отправлены сохраненные сдачи: начислено ${coins} трешкоинов.`;
+    if (errors.length > 0) {
+        message += ` Не приняты (${errors.length}): ${[...new Set(errors)].join('; ')}`;
+    }
+    window.maxBridge.showAlert(message);
+}
+
 function openModal(modalId) {
     const modal = document.getElementById(modalId);
     if (modal) {
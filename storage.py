@@ -0,0 +1,1279 @@
+"""Хранилище балансов, транзакций и купленных наград.
+
+Gunicorn запускает несколько воркеров, поэтому состояние пользователей
+нельзя держать в памяти процесса. По умолчанию используется SQLite в режиме
+WAL: все воркеры читают один файл, а записи каждого процесса собираются
+фоновым потоком в пакеты и фиксируются одним COMMIT (group commit).
+Для тестов и локальной отладки есть MemoryStorage с тем же интерфейсом.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from itertools import count
+from operator import itemgetter
+
+IDEMPOTENCY_TTL = 24 * 3600
+# Часы аналитики отсчитываются от этого момента по местному времени транзакций.
+ANALYTICS_EPOCH = datetime(1970, 1, 1)
+HOUR = timedelta(hours=1)
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+class DuplicateReceipt(Exception):
+    pass
+
+
+def empty_stats():
+    return {
+        'total_weight': 0.0,
+        'coins_earned': 0,
+        'coins_spent': 0,
+        'transaction_count': 0,
+        'recycling_count': 0,
+        'purchase_count': 0,
+        'materials': {}
+    }
+
+
+def apply_transaction_stats(stats, transaction):
+    coins = transaction.get('coins', 0)
+    stats['transaction_count'] += 1
+    if coins > 0:
+        stats['coins_earned'] += coins
+    else:
+        stats['coins_spent'] -= coins
+    if transaction.get('type') == 'recycling':
+        stats['recycling_count'] += 1
+        weight = transaction.get('weight') or 0
+        stats['total_weight'] += weight
+        material = transaction.get('material_type')
+        if material:
+            stats['materials'][material] = stats['materials'].get(material, 0) + weight
+    elif transaction.get('type') == 'purchase':
+        stats['purchase_count'] += 1
+    return stats
+
+
+def analytics_hour(date, round_up=False):
+    """Номер часа с ANALYTICS_EPOCH для даты в ISO 8601; round_up — до следующего часа."""
+    moment = datetime.fromisoformat(date).replace(tzinfo=None)
+    hours, rest = divmod(moment - ANALYTICS_EPOCH, HOUR)
+    return hours + 1 if round_up and rest else hours
+
+
+def analytics_delta(transaction):
+    """Ключ (час, пункт, материал) и прибавки счетчиков
+    (кг, сдачи, начислено, списано, покупки) или None."""
+    try:
+        hour = analytics_hour(transaction['date'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    coins = transaction.get('coins', 0)
+    recycling = transaction.get('type') == 'recycling'
+    try:
+        point_id = int(transaction.get('point_id') or 0)
+    except (TypeError, ValueError):
+        point_id = 0
+    key = (hour, point_id, transaction.get('material_type') or '')
+    return key, (
+        (transaction.get('weight') or 0) if recycling else 0,
+        1 if recycling else 0,
+        max(coins, 0),
+        max(-coins, 0),
+        1 if transaction.get('type') == 'purchase' else 0
+    )
+
+
+class Storage:
+    def ensure_user(self, user_id):
+        raise NotImplementedError
+
+    def get_balance(self, user_id):
+        raise NotImplementedError
+
+    def credit(self, user_id, transaction, receipt=None, idempotency_key=None, receipt_check=None):
+        """Начисление; receipt=(receipt_id, phash) привязывает фото чека к транзакции.
+
+        Один и тот же receipt_id нельзя зачесть дважды: в этом случае
+        поднимается DuplicateReceipt, и баланс не меняется. Если операция с
+        тем же idempotency_key уже выполнялась, возвращается ее результат.
+
+        receipt_check(phash, fetch) вызывается атомарно с записью чека;
+        fetch(after_id) читает зачтенные чеки так же, как receipt_hashes.
+        Если проверка вернула True (почти-дубликат), тоже поднимается
+        DuplicateReceipt.
+        """
+        raise NotImplementedError
+
+    def credit_batch(self, user_id, items):
+        """Начисляет несколько транзакций одним изменением баланса.
+
+        items — пары (transaction, idempotency_key). Транзакции с ключом,
+        который уже встречался (раньше или в этой же пачке), не начисляются
+        повторно. Возвращает (balance, [(transaction, replayed), ...]) в
+        порядке items; для каждого нового ключа запоминается результат
+        (balance, transaction), как у credit.
+        """
+        raise NotImplementedError
+
+    def purchase(self, user_id, price, purchase, transaction, idempotency_key=None):
+        raise NotImplementedError
+
+    def idempotent_result(self, user_id, key):
+        """Сохраненный результат credit/purchase с этим ключом или None."""
+        raise NotImplementedError
+
+    def list_transactions(self, user_id, limit=50, before=None, after=None,
+                          types=None, material=None, date_from=None, date_to=None):
+        """Страница истории от новых к старым.
+
+        before/after — курсоры по id транзакции (строго меньше / строго больше).
+        С одним after возвращаются limit ближайших к курсору более новых записей.
+        date_from включительно, date_to не включительно (строки ISO 8601).
+        """
+        raise NotImplementedError
+
+    def list_rewards(self, user_id):
+        raise NotImplementedError
+
+    def get_stats(self, user_id):
+        raise NotImplementedError
+
+    def rebuild_stats(self):
+        """Пересчитывает статистику пользователей и аналитику по журналу транзакций."""
+        raise NotImplementedError
+
+    def analytics(self, hour_from, hour_to, bucket_hours=None, by_point=False, by_material=False,
+                  point_id=None, material=None):
+        """Суммы часовых агрегатов за часы [hour_from, hour_to).
+
+        Строки (час начала корзины, пункт, материал, кг, сдачи, начислено,
+        списано, покупки) по возрастанию ключа. Корзина — bucket_hours часов
+        (None — весь период); пункт и материал равны None, если по ним
+        не группировали. Покупки записаны на пункт 0 и пустой материал.
+        """
+        raise NotImplementedError
+
+    def claim_updates(self, keys, ttl):
+        """Отмечает ключи обновлений бота как обработанные на ttl секунд.
+
+        Возвращает множество ключей, которые до этого не встречались
+        (или истекли); остальные — повторные доставки.
+        """
+        raise NotImplementedError
+
+    def release_updates(self, keys):
+        """Снимает отметки claim_updates с обновлений, которые не удалось обработать."""
+        raise NotImplementedError
+
+    def save_chat(self, chat_id, user_id=None):
+        """Запоминает личный чат с ботом (из /start) как получателя рассылок."""
+        raise NotImplementedError
+
+    def chat_ids(self, after=None, limit=1000):
+        """Страница id чатов бота по возрастанию, строго больше after."""
+        raise NotImplementedError
+
+    def count_chats(self):
+        raise NotImplementedError
+
+    def create_broadcast(self, payload, total):
+        raise NotImplementedError
+
+    def get_broadcast(self, job_id):
+        raise NotImplementedError
+
+    def list_broadcasts(self, limit=20):
+        raise NotImplementedError
+
+    def claim_broadcast(self, job_id, owner, lease):
+        """Захватывает рассылку для выполнения на lease секунд.
+
+        Возвращает задание или None, если оно завершено, отменено или
+        выполняется другим процессом, чья аренда еще не истекла.
+        """
+        raise NotImplementedError
+
+    def save_broadcast_progress(self, job_id, owner, cursor, sent, failed, elapsed, lease, finished=False):
+        """Прибавляет счетчики пачки и сдвигает курсор, продлевая аренду.
+
+        Возвращает False, если аренда потеряна или рассылка отменена:
+        выполнение нужно остановить.
+        """
+        raise NotImplementedError
+
+    def release_broadcast(self, job_id, owner):
+        raise NotImplementedError
+
+    def cancel_broadcast(self, job_id):
+        raise NotImplementedError
+
+    def transactions_after(self, after_id=0, limit=1000):
+        """Журнал транзакций всех пользователей: кортежи (id, user_id, transaction)
+        с id больше after_id по возрастанию id. Записи с меньшим id после чтения
+        не появляются, поэтому журнал можно дочитывать по последнему id.
+        """
+        raise NotImplementedError
+
+    def receipt_hashes(self, after_id=0):
+        """Зачтенные чеки с id больше after_id: кортежи (id, receipt_id, phash) по возрастанию id."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def new_broadcast(job_id, payload, total, created):
+    return {
+        'id': job_id,
+        'status': 'pending',
+        'payload': payload,
+        'total': total,
+        'cursor': None,
+        'sent': 0,
+        'failed': 0,
+        'created': created,
+        'started': None,
+        'finished': None,
+        'elapsed': 0.0,
+        'lease_owner': None,
+        'lease_until': None
+    }
+
+
+class _MemoryUser:
+    __slots__ = ('balance', 'transactions', 'rewards', 'stats')
+
+    def __init__(self):
+        self.balance = 0
+        self.transactions = []
+        self.rewards = []
+        self.stats = empty_stats()
+
+
+class LockStripes:
+    """Фиксированный набор блокировок, выбираемых по хэшу ключа.
+
+    Операции одного пользователя выполняются последовательно, а разные
+    пользователи почти никогда не делят блокировку, при этом память не
+    растет с числом пользователей.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def acquire_all(self):
+        for lock in self._locks:
+            lock.acquire()
+
+    def release_all(self):
+        for lock in reversed(self._locks):
+            lock.release()
+
+
+class MemoryStorage(Storage):
+    def __init__(self, stripes=64, idempotency_ttl=IDEMPOTENCY_TTL):
+        self._users = {}
+        self._locks = LockStripes(stripes)
+        self._log = []
+        self._log_lock = threading.Lock()
+        self._analytics = {}
+        self._purchase_ids = count(1)
+        self._receipts = []
+        self._receipt_ids = set()
+        # Повторно входимая: receipt_check внутри начисления сам читает чеки.
+        self._receipts_lock = threading.RLock()
+        self._idempotency = {}
+        self.idempotency_ttl = idempotency_ttl
+        self._idempotency_lock = threading.Lock()
+        self._updates = {}
+        self._updates_lock = threading.Lock()
+        self._chats = {}
+        self._chats_lock = threading.Lock()
+        self._broadcasts = {}
+        self._broadcast_ids = count(1)
+        self._broadcasts_lock = threading.Lock()
+
+    def _user(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users.setdefault(user_id, _MemoryUser())
+        return user
+
+    def _remember(self, user_id, key, result):
+        now = time.monotonic()
+        with self._idempotency_lock:
+            self._idempotency.pop((user_id, key), None)
+            self._idempotency[(user_id, key)] = (now, result)
+            # Словарь упорядочен по времени вставки, устаревшие ключи срезаются с начала.
+            while self._idempotency:
+                oldest = next(iter(self._idempotency))
+                if now - self._idempotency[oldest][0] < self.idempotency_ttl:
+                    break
+                del self._idempotency[oldest]
+        return result
+
+    def _append_log(self, user_id, transaction):
+        # id выдается под той же блокировкой, что и запись в журнал: журнал идет по id без пропусков.
+        with self._log_lock:
+            transaction = dict(transaction, id=len(self._log) + 1)
+            self._log.append((transaction['id'], user_id, transaction))
+            self._add_analytics(transaction)
+        return transaction
+
+    def _add_analytics(self, transaction):
+        delta = analytics_delta(transaction)
+        if delta is None:
+            return
+        key, values = delta
+        counters = self._analytics.get(key)
+        if counters is None:
+            self._analytics[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                counters[i] += value
+
+    def idempotent_result(self, user_id, key):
+        entry = self._idempotency.get((user_id, key))
+        if entry is None or time.monotonic() - entry[0] >= self.idempotency_ttl:
+            return None
+        return entry[1]
+
+    def ensure_user(self, user_id):
+        self._user(user_id)
+
+    def get_balance(self, user_id):
+        user = self._users.get(user_id)
+        return user.balance if user else 0
+
+    def credit(self, user_id, transaction, receipt=None, idempotency_key=None, receipt_check=None):
+        with self._locks(user_id):
+            if idempotency_key is not None:
+                replay = self.idempotent_result(user_id, idempotency_key)
+                if replay is not None:
+                    return replay
+            if receipt is not None:
+                with self._receipts_lock:
+                    if receipt[0] in self._receipt_ids:
+                        raise DuplicateReceipt(receipt[0])
+                    receipt_id, phash = receipt
+                    if phash is not None and receipt_check is not None and receipt_check(phash, self.receipt_hashes):
+                        raise DuplicateReceipt(receipt_id)
+                    self._receipt_ids.add(receipt_id)
+                    self._receipts.append((len(self._receipts) + 1, receipt_id, phash))
+            user = self._user(user_id)
+            transaction = self._append_log(user_id, transaction)
+            user.balance += transaction['coins']
+            user.transactions.append(transaction)
+            apply_transaction_stats(user.stats, transaction)
+            result = (user.balance, transaction)
+            if idempotency_key is not None:
+                self._remember(user_id, idempotency_key, result)
+            return result
+
+    def credit_batch(self, user_id, items):
+        with self._locks(user_id):
+            user = self._user(user_id)
+            results, credited, seen = [], [], {}
+            for transaction, key in items:
+                replay = seen.get(key) or (self.idempotent_result(user_id, key) if key is not None else None)
+                if replay is not None:
+                    results.append((replay[1], True))
+                    continue
+                transaction = self._append_log(user_id, transaction)
+                user.transactions.append(transaction)
+                apply_transaction_stats(user.stats, transaction)
+                results.append((transaction, False))
+                credited.append((key, transaction))
+                if key is not None:
+                    seen[key] = (None, transaction)
+            user.balance += sum(transaction['coins'] for _, transaction in credited)
+            for key, transaction in credited:
+                if key is not None:
+                    self._remember(user_id, key, (user.balance, transaction))
+            return user.balance, results
+
+    def purchase(self, user_id, price, purchase, transaction, idempotency_key=None):
+        with self._locks(user_id):
+            if idempotency_key is not None:
+                replay = self.idempotent_result(user_id, idempotency_key)
+                if replay is not None:
+                    return replay
+            user = self._user(user_id)
+            if user.balance < price:
+                raise InsufficientFunds()
+            user.balance -= price
+            purchase = dict(purchase, id=next(self._purchase_ids))
+            transaction = self._append_log(user_id, transaction)
+            user.rewards.append(purchase)
+            user.transactions.append(transaction)
+            apply_transaction_stats(user.stats, transaction)
+            result = (user.balance, purchase, transaction)
+            if idempotency_key is not None:
+                self._remember(user_id, idempotency_key, result)
+            return result
+
+    def list_transactions(self, user_id, limit=50, before=None, after=None,
+                          types=None, material=None, date_from=None, date_to=None):
+        user = self._users.get(user_id)
+        if not user:
+            return []
+        transactions = user.transactions
+        lo = bisect_right(transactions, after, key=itemgetter('id')) if after is not None else 0
+        hi = bisect_left(transactions, before, key=itemgetter('id')) if before is not None else len(transactions)
+        forward = after is not None and before is None
+        indexes = range(lo, hi) if forward else range(hi - 1, lo - 1, -1)
+
+        page = []
+        for index in indexes:
+            if limit is not None and len(page) >= limit:
+                break
+            transaction = transactions[index]
+            if types and transaction['type'] not in types:
+                continue
+            if material and transaction.get('material_type') != material:
+                continue
+            if date_from and transaction['date'] < date_from:
+                continue
+            if date_to and transaction['date'] >= date_to:
+                continue
+            page.append(transaction)
+        return page[::-1] if forward else page
+
+    def list_rewards(self, user_id):
+        user = self._users.get(user_id)
+        return list(user.rewards) if user else []
+
+    def get_stats(self, user_id):
+        user = self._users.get(user_id)
+        if not user:
+            return empty_stats()
+        with self._locks(user_id):
+            return dict(user.stats, materials=dict(user.stats['materials']))
+
+    def rebuild_stats(self):
+        self._locks.acquire_all()
+        try:
+            for user in self._users.values():
+                user.stats = empty_stats()
+                for transaction in user.transactions:
+                    apply_transaction_stats(user.stats, transaction)
+            with self._log_lock:
+                self._analytics = {}
+                for _, _, transaction in self._log:
+                    self._add_analytics(transaction)
+            return len(self._users)
+        finally:
+            self._locks.release_all()
+
+    def analytics(self, hour_from, hour_to, bucket_hours=None, by_point=False, by_material=False,
+                  point_id=None, material=None):
+        groups = {}
+        with self._log_lock:
+            for (hour, point, kind), counters in self._analytics.items():
+                if not hour_from <= hour < hour_to:
+                    continue
+                if (point_id is not None and point != point_id) or (material is not None and kind != material):
+                    continue
+                key = (hour // bucket_hours * bucket_hours if bucket_hours else None,
+                       point if by_point else None, kind if by_material else None)
+                total = groups.setdefault(key, [0] * len(counters))
+                for i, value in enumerate(counters):
+                    total[i] += value
+        return [key + tuple(total) for key, total in sorted(groups.items())]
+
+    def claim_updates(self, keys, ttl):
+        now = time.monotonic()
+        claimed = set()
+        with self._updates_lock:
+            while self._updates:
+                oldest = next(iter(self._updates))
+                if self._updates[oldest] > now:
+                    break
+                del self._updates[oldest]
+            for key in keys:
+                if key not in self._updates:
+                    self._updates[key] = now + ttl
+                    claimed.add(key)
+        return claimed
+
+    def release_updates(self, keys):
+        with self._updates_lock:
+            for key in keys:
+                self._updates.pop(key, None)
+
+    def save_chat(self, chat_id, user_id=None):
+        with self._chats_lock:
+            self._chats.setdefault(chat_id, user_id)
+
+    def chat_ids(self, after=None, limit=1000):
+        with self._chats_lock:
+            chat_ids = sorted(self._chats)
+        start = bisect_right(chat_ids, after) if after is not None else 0
+        return chat_ids[start:start + limit]
+
+    def count_chats(self):
+        return len(self._chats)
+
+    def create_broadcast(self, payload, total):
+        with self._broadcasts_lock:
+            job = new_broadcast(next(self._broadcast_ids), payload, total, time.time())
+            self._broadcasts[job['id']] = job
+            return dict(job)
+
+    def get_broadcast(self, job_id):
+        with self._broadcasts_lock:
+            job = self._broadcasts.get(job_id)
+            return dict(job) if job else None
+
+    def list_broadcasts(self, limit=20):
+        with self._broadcasts_lock:
+            jobs = sorted(self._broadcasts.values(), key=itemgetter('id'), reverse=True)
+            return [dict(job) for job in jobs[:limit]]
+
+    def claim_broadcast(self, job_id, owner, lease):
+        now = time.time()
+        with self._broadcasts_lock:
+            job = self._broadcasts.get(job_id)
+            if job is None or job['status'] in ('done', 'cancelled'):
+                return None
+            if job['lease_owner'] not in (None, owner) and job['lease_until'] > now:
+                return None
+            job.update(status='running', lease_owner=owner, lease_until=now + lease)
+            if job['started'] is None:
+                job['started'] = now
+            return dict(job)
+
+    def save_broadcast_progress(self, job_id, owner, cursor, sent, failed, elapsed, lease, finished=False):
+        now = time.time()
+        with self._broadcasts_lock:
+            job = self._broadcasts.get(job_id)
+            if job is None or job['lease_owner'] != owner or job['status'] != 'running':
+                return False
+            job['cursor'] = cursor
+            job['sent'] += sent
+            job['failed'] += failed
+            job['elapsed'] += elapsed
+            job['lease_until'] = now + lease
+            if finished:
+                job.update(status='done', finished=now, lease_owner=None, lease_until=None)
+            return True
+
+    def release_broadcast(self, job_id, owner):
+        with self._broadcasts_lock:
+            job = self._broadcasts.get(job_id)
+            if job is not None and job['lease_owner'] == owner:
+                job.update(lease_owner=None, lease_until=None)
+                if job['status'] == 'running':
+                    job['status'] = 'paused'
+
+    def cancel_broadcast(self, job_id):
+        with self._broadcasts_lock:
+            job = self._broadcasts.get(job_id)
+            if job is None:
+                return None
+            if job['status'] != 'done':
+                job.update(status='cancelled', finished=time.time(), lease_owner=None, lease_until=None)
+            return dict(job)
+
+    def transactions_after(self, after_id=0, limit=1000):
+        with self._log_lock:
+            return self._log[after_id:after_id + limit]
+
+    def receipt_hashes(self, after_id=0):
+        with self._receipts_lock:
+            return [row for row in self._receipts[after_id:] if row[2] is not None]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    balance INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    coins INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, id);
+CREATE TABLE IF NOT EXISTS purchases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases (user_id, id);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,
+    total_weight REAL NOT NULL DEFAULT 0,
+    coins_earned INTEGER NOT NULL DEFAULT 0,
+    coins_spent INTEGER NOT NULL DEFAULT 0,
+    transaction_count INTEGER NOT NULL DEFAULT 0,
+    recycling_count INTEGER NOT NULL DEFAULT 0,
+    purchase_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_material_stats (
+    user_id INTEGER NOT NULL,
+    material TEXT NOT NULL,
+    weight REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, material)
+) WITHOUT ROWID;
+"""
+
+# Изменения схемы поверх SCHEMA; номер применённой миграции хранится в PRAGMA user_version.
+MIGRATIONS = [
+    """
+    ALTER TABLE transactions ADD COLUMN material TEXT;
+    UPDATE transactions SET material = json_extract(data, '$.material_type');
+    CREATE INDEX idx_transactions_user_type ON transactions (user_id, type, id);
+    CREATE INDEX idx_transactions_user_material ON transactions (user_id, material, id);
+    """,
+    """
+    CREATE TABLE receipts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        receipt_id TEXT NOT NULL UNIQUE,
+        user_id INTEGER NOT NULL,
+        transaction_id INTEGER NOT NULL,
+        phash INTEGER
+    );
+    """,
+    """
+    CREATE TABLE idempotency_keys (
+        user_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        created REAL NOT NULL,
+        result TEXT NOT NULL,
+        PRIMARY KEY (user_id, key)
+    ) WITHOUT ROWID;
+    CREATE INDEX idx_idempotency_created ON idempotency_keys (created);
+    """,
+    """
+    CREATE TABLE seen_updates (
+        key TEXT PRIMARY KEY,
+        expires REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX idx_seen_updates_expires ON seen_updates (expires);
+    """,
+    """
+    CREATE TABLE broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        cursor INTEGER,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL,
+        elapsed REAL NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_until REAL
+    );
+    """,
+    """
+    CREATE TABLE analytics_hourly (
+        hour INTEGER NOT NULL,
+        point_id INTEGER NOT NULL,
+        material TEXT NOT NULL,
+        weight REAL NOT NULL DEFAULT 0,
+        drops INTEGER NOT NULL DEFAULT 0,
+        coins_issued INTEGER NOT NULL DEFAULT 0,
+        coins_redeemed INTEGER NOT NULL DEFAULT 0,
+        purchases INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, point_id, material)
+    ) WITHOUT ROWID;
+    CREATE INDEX idx_analytics_point ON analytics_hourly (point_id, hour);
+    INSERT INTO analytics_hourly
+        SELECT CAST(strftime('%s', date) AS INTEGER) / 3600,
+               CAST(COALESCE(json_extract(data, '$.point_id'), 0) AS INTEGER),
+               COALESCE(material, ''),
+               SUM(CASE WHEN type = 'recycling' THEN COALESCE(json_extract(data, '$.weight'), 0) ELSE 0 END),
+               SUM(type = 'recycling'), SUM(MAX(coins, 0)), SUM(MAX(-coins, 0)), SUM(type = 'purchase')
+        FROM transactions WHERE strftime('%s', date) IS NOT NULL
+        GROUP BY 1, 2, 3;
+    """,
+    """
+    CREATE TABLE bot_chats (
+        chat_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        created REAL NOT NULL
+    );
+    """,
+]
+
+BROADCAST_COLUMNS = ('id', 'status', 'payload', 'total', 'cursor', 'sent', 'failed', 'created',
+                     'started', 'finished', 'elapsed', 'lease_owner', 'lease_until')
+
+_INT64_SIGN = 1 << 63
+
+
+def _to_sqlite_int(value):
+    # SQLite хранит знаковые 64-битные целые, а хэш беззнаковый.
+    return value - (1 << 64) if value >= _INT64_SIGN else value
+
+
+def _from_sqlite_int(value):
+    return value & ((1 << 64) - 1)
+
+
+class SQLiteStorage(Storage):
+    # Устаревшие ключи идемпотентности и обновлений удаляются раз в столько записей.
+    IDEMPOTENCY_PRUNE_EVERY = 1000
+
+    def __init__(self, path, batch_size=256, busy_timeout=5.0, idempotency_ttl=IDEMPOTENCY_TTL):
+        self.path = path
+        self.batch_size = batch_size
+        self.busy_timeout = busy_timeout
+        self.idempotency_ttl = idempotency_ttl
+        self._idempotency_writes = count(1)
+        self._update_claims = count(1)
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _migrate(conn):
+        # Воркеры стартуют одновременно, поэтому версия перечитывается под блокировкой записи.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in script.split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {number}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_writer(self):
+        pid = os.getpid()
+        if self._writer is not None and self._writer_pid == pid:
+            return
+        with self._writer_lock:
+            if self._writer is not None and self._writer_pid == pid:
+                return
+            if self._writer_pid != pid:
+                self._queue = queue.Queue()
+            self._writer_pid = pid
+            self._writer = threading.Thread(target=self._write_loop, name='storage-writer', daemon=True)
+            self._writer.start()
+
+    def _write(self, fn):
+        self._ensure_writer()
+        future = Future()
+        self._queue.put((fn, future))
+        return future.result()
+
+    def _write_loop(self):
+        conn = self._connect()
+        pending = self._queue
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    pending.put(None)
+                    break
+                batch.append(item)
+            self._commit_batch(conn, batch)
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, future in batch:
+                conn.execute('SAVEPOINT op')
+                try:
+                    results.append((future, fn(conn), None))
+                    conn.execute('RELEASE op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO op')
+                    conn.execute('RELEASE op')
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _upsert_user(conn, user_id):
+        conn.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+
+    @staticmethod
+    def _insert_transaction(conn, user_id, transaction):
+        cursor = conn.execute(
+            'INSERT INTO transactions (user_id, type, material, date, coins, data) VALUES (?, ?, ?, ?, ?, ?)',
+            (user_id, transaction['type'], transaction.get('material_type'), transaction['date'],
+             transaction['coins'], json.dumps(transaction, ensure_ascii=False))
+        )
+        SQLiteStorage._add_stats(conn, user_id, apply_transaction_stats(empty_stats(), transaction))
+        delta = analytics_delta(transaction)
+        if delta is not None:
+            SQLiteStorage._add_analytics(conn, [delta[0] + delta[1]])
+        return dict(transaction, id=cursor.lastrowid)
+
+    @staticmethod
+    def _add_analytics(conn, rows):
+        conn.executemany(
+            '''INSERT INTO analytics_hourly (hour, point_id, material, weight, drops, coins_issued,
+                                             coins_redeemed, purchases)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (hour, point_id, material) DO UPDATE SET
+                   weight = weight + excluded.weight,
+                   drops = drops + excluded.drops,
+                   coins_issued = coins_issued + excluded.coins_issued,
+                   coins_redeemed = coins_redeemed + excluded.coins_redeemed,
+                   purchases = purchases + excluded.purchases''',
+            rows
+        )
+
+    @staticmethod
+    def _add_stats(conn, user_id, delta):
+        conn.execute(
+            '''INSERT INTO user_stats (user_id, total_weight, coins_earned, coins_spent,
+                                       transaction_count, recycling_count, purchase_count)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   total_weight = total_weight + excluded.total_weight,
+                   coins_earned = coins_earned + excluded.coins_earned,
+                   coins_spent = coins_spent + excluded.coins_spent,
+                   transaction_count = transaction_count + excluded.transaction_count,
+                   recycling_count = recycling_count + excluded.recycling_count,
+                   purchase_count = purchase_count + excluded.purchase_count''',
+            (user_id, delta['total_weight'], delta['coins_earned'], delta['coins_spent'],
+             delta['transaction_count'], delta['recycling_count'], delta['purchase_count'])
+        )
+        for material, weight in delta['materials'].items():
+            conn.execute(
+                '''INSERT INTO user_material_stats (user_id, material, weight) VALUES (?, ?, ?)
+                   ON CONFLICT (user_id, material) DO UPDATE SET weight = weight + excluded.weight''',
+                (user_id, material, weight)
+            )
+
+    @staticmethod
+    def _load_idempotent(conn, user_id, key, ttl):
+        row = conn.execute(
+            'SELECT result FROM idempotency_keys WHERE user_id = ? AND key = ? AND created >= ?',
+            (user_id, key, time.time() - ttl)
+        ).fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def _store_idempotent(self, conn, user_id, key, result):
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO idempotency_keys (user_id, key, created, result) VALUES (?, ?, ?, ?)',
+            (user_id, key, now, json.dumps(result, ensure_ascii=False))
+        )
+        if next(self._idempotency_writes) % self.IDEMPOTENCY_PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM idempotency_keys WHERE created < ?', (now - self.idempotency_ttl,))
+        return result
+
+    def idempotent_result(self, user_id, key):
+        return self._load_idempotent(self._reader(), user_id, key, self.idempotency_ttl)
+
+    def ensure_user(self, user_id):
+        if self._reader().execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone():
+            return
+        self._write(lambda conn: self._upsert_user(conn, user_id))
+
+    def get_balance(self, user_id):
+        row = self._reader().execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def credit(self, user_id, transaction, receipt=None, idempotency_key=None, receipt_check=None):
+        def op(conn):
+            if idempotency_key is not None:
+                replay = self._load_idempotent(conn, user_id, idempotency_key, self.idempotency_ttl)
+                if replay is not None:
+                    return replay
+            if receipt is not None and receipt[1] is not None and receipt_check is not None:
+                # Проверка внутри BEGIN IMMEDIATE видит чеки, зачтенные всеми процессами.
+                if receipt_check(receipt[1], lambda after_id: self._receipt_hashes(conn, after_id)):
+                    raise DuplicateReceipt(receipt[0])
+            self._upsert_user(conn, user_id)
+            conn.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?',
+                         (transaction['coins'], user_id))
+            stored = self._insert_transaction(conn, user_id, transaction)
+            if receipt is not None:
+                receipt_id, phash = receipt
+                try:
+                    conn.execute(
+                        'INSERT INTO receipts (receipt_id, user_id, transaction_id, phash) VALUES (?, ?, ?, ?)',
+                        (receipt_id, user_id, stored['id'], None if phash is None else _to_sqlite_int(phash))
+                    )
+                except sqlite3.IntegrityError:
+                    raise DuplicateReceipt(receipt_id) from None
+            balance = conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+            if idempotency_key is not None:
+                self._store_idempotent(conn, user_id, idempotency_key, (balance, stored))
+            return balance, stored
+        return self._write(op)
+
+    def credit_batch(self, user_id, items):
+        def op(conn):
+            self._upsert_user(conn, user_id)
+            results, credited, seen = [], [], {}
+            for transaction, key in items:
+                replay = seen.get(key) or (
+                    self._load_idempotent(conn, user_id, key, self.idempotency_ttl) if key is not None else None
+                )
+                if replay is not None:
+                    results.append((replay[1], True))
+                    continue
+                stored = self._insert_transaction(conn, user_id, transaction)
+                results.append((stored, False))
+                credited.append((key, stored))
+                if key is not None:
+                    seen[key] = (None, stored)
+            conn.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?',
+                         (sum(stored['coins'] for _, stored in credited), user_id))
+            balance = conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+            for key, stored in credited:
+                if key is not None:
+                    self._store_idempotent(conn, user_id, key, (balance, stored))
+            return balance, results
+        return self._write(op)
+
+    def purchase(self, user_id, price, purchase, transaction, idempotency_key=None):
+        def op(conn):
+            if idempotency_key is not None:
+                replay = self._load_idempotent(conn, user_id, idempotency_key, self.idempotency_ttl)
+                if replay is not None:
+                    return replay
+            self._upsert_user(conn, user_id)
+            updated = conn.execute(
+                'UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ?',
+                (price, user_id, price)
+            ).rowcount
+            if not updated:
+                raise InsufficientFunds()
+            cursor = conn.execute('INSERT INTO purchases (user_id, data) VALUES (?, ?)',
+                                  (user_id, json.dumps(purchase, ensure_ascii=False)))
+            stored_purchase = dict(purchase, id=cursor.lastrowid)
+            stored_transaction = self._insert_transaction(conn, user_id, transaction)
+            balance = conn.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+            if idempotency_key is not None:
+                self._store_idempotent(conn, user_id, idempotency_key,
+                                       (balance, stored_purchase, stored_transaction))
+            return balance, stored_purchase, stored_transaction
+        return self._write(op)
+
+    def list_transactions(self, user_id, limit=50, before=None, after=None,
+                          types=None, material=None, date_from=None, date_to=None):
+        clauses = ['user_id = ?']
+        params = [user_id]
+        if before is not None:
+            clauses.append('id < ?')
+            params.append(before)
+        if after is not None:
+            clauses.append('id > ?')
+            params.append(after)
+        if types:
+            clauses.append(f"type IN ({', '.join('?' * len(types))})")
+            params.extend(types)
+        if material:
+            clauses.append('material = ?')
+            params.append(material)
+        if date_from:
+            clauses.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            clauses.append('date < ?')
+            params.append(date_to)
+
+        forward = after is not None and before is None
+        sql = f"SELECT id, data FROM transactions WHERE {' AND '.join(clauses)} ORDER BY id {'ASC' if forward else 'DESC'}"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        page = [dict(json.loads(data), id=row_id) for row_id, data in self._reader().execute(sql, params)]
+        return page[::-1] if forward else page
+
+    def list_rewards(self, user_id):
+        rows = self._reader().execute(
+            'SELECT id, data FROM purchases WHERE user_id = ? ORDER BY id', (user_id,)
+        )
+        return [dict(json.loads(data), id=row_id) for row_id, data in rows]
+
+    def get_stats(self, user_id):
+        conn = self._reader()
+        stats = empty_stats()
+        row = conn.execute(
+            '''SELECT total_weight, coins_earned, coins_spent, transaction_count,
+                      recycling_count, purchase_count
+               FROM user_stats WHERE user_id = ?''', (user_id,)
+        ).fetchone()
+        if row:
+            for key, value in zip(('total_weight', 'coins_earned', 'coins_spent', 'transaction_count',
+                                   'recycling_count', 'purchase_count'), row):
+                stats[key] = value
+            stats['materials'] = dict(conn.execute(
+                'SELECT material, weight FROM user_material_stats WHERE user_id = ?', (user_id,)
+            ))
+        return stats
+
+    def rebuild_stats(self):
+        def op(conn):
+            conn.execute('DELETE FROM user_stats')
+            conn.execute('DELETE FROM user_material_stats')
+            conn.execute('DELETE FROM analytics_hourly')
+            rows = conn.execute('SELECT user_id, data FROM transactions ORDER BY user_id, id')
+            users = 0
+            current, stats = None, None
+            analytics = {}
+            for user_id, data in rows:
+                if user_id != current:
+                    if current is not None:
+                        self._add_stats(conn, current, stats)
+                    current, stats = user_id, empty_stats()
+                    users += 1
+                transaction = json.loads(data)
+                apply_transaction_stats(stats, transaction)
+                delta = analytics_delta(transaction)
+                if delta is not None:
+                    counters = analytics.setdefault(delta[0], [0] * len(delta[1]))
+                    for i, value in enumerate(delta[1]):
+                        counters[i] += value
+            if current is not None:
+                self._add_stats(conn, current, stats)
+            self._add_analytics(conn, [key + tuple(counters) for key, counters in analytics.items()])
+            return users
+        return self._write(op)
+
+    def analytics(self, hour_from, hour_to, bucket_hours=None, by_point=False, by_material=False,
+                  point_id=None, material=None):
+        clauses = ['hour >= ?', 'hour < ?']
+        params = [hour_from, hour_to]
+        if point_id is not None:
+            clauses.append('point_id = ?')
+            params.append(point_id)
+        if material is not None:
+            clauses.append('material = ?')
+            params.append(material)
+        bucket = f'hour / {int(bucket_hours)} * {int(bucket_hours)}' if bucket_hours else 'NULL'
+        rows = self._reader().execute(
+            f'''SELECT {bucket}, {'point_id' if by_point else 'NULL'}, {'material' if by_material else 'NULL'},
+                       SUM(weight), SUM(drops), SUM(coins_issued), SUM(coins_redeemed), SUM(purchases)
+                FROM analytics_hourly WHERE {' AND '.join(clauses)}
+                GROUP BY 1, 2, 3 ORDER BY 1, 2, 3''',
+            params
+        )
+        return [tuple(row) for row in rows]
+
+    def claim_updates(self, keys, ttl):
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return set()
+
+        def op(conn):
+            now = time.time()
+            claimed = set()
+            for key in keys:
+                changed = conn.execute(
+                    '''INSERT INTO seen_updates (key, expires) VALUES (?, ?)
+                       ON CONFLICT (key) DO UPDATE SET expires = excluded.expires
+                       WHERE seen_updates.expires <= ?''',
+                    (key, now + ttl, now)
+                ).rowcount
+                if changed:
+                    claimed.add(key)
+            if next(self._update_claims) % self.IDEMPOTENCY_PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM seen_updates WHERE expires <= ?', (now,))
+            return claimed
+        return self._write(op)
+
+    def release_updates(self, keys):
+        keys = list(dict.fromkeys(keys))
+        if keys:
+            self._write(lambda conn: conn.executemany('DELETE FROM seen_updates WHERE key = ?',
+                                                      [(key,) for key in keys]))
+
+    def save_chat(self, chat_id, user_id=None):
+        self._write(lambda conn: conn.execute(
+            'INSERT OR IGNORE INTO bot_chats (chat_id, user_id, created) VALUES (?, ?, ?)',
+            (chat_id, user_id, time.time())
+        ))
+
+    def chat_ids(self, after=None, limit=1000):
+        rows = self._reader().execute(
+            'SELECT chat_id FROM bot_chats WHERE chat_id > ? ORDER BY chat_id LIMIT ?',
+            (after if after is not None else -(1 << 63), limit)
+        )
+        return [row[0] for row in rows]
+
+    def count_chats(self):
+        return self._reader().execute('SELECT COUNT(*) FROM bot_chats').fetchone()[0]
+
+    @staticmethod
+    def _broadcast_row(row):
+        if row is None:
+            return None
+        job = dict(zip(BROADCAST_COLUMNS, row))
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def _select_broadcast(self, conn, job_id):
+        return self._broadcast_row(conn.execute(
+            f"SELECT {', '.join(BROADCAST_COLUMNS)} FROM broadcasts WHERE id = ?", (job_id,)
+        ).fetchone())
+
+    def create_broadcast(self, payload, total):
+        def op(conn):
+            cursor = conn.execute(
+                'INSERT INTO broadcasts (status, payload, total, created) VALUES (?, ?, ?, ?)',
+                ('pending', json.dumps(payload, ensure_ascii=False), total, time.time())
+            )
+            return self._select_broadcast(conn, cursor.lastrowid)
+        return self._write(op)
+
+    def get_broadcast(self, job_id):
+        return self._select_broadcast(self._reader(), job_id)
+
+    def list_broadcasts(self, limit=20):
+        rows = self._reader().execute(
+            f"SELECT {', '.join(BROADCAST_COLUMNS)} FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        return [self._broadcast_row(row) for row in rows]
+
+    def claim_broadcast(self, job_id, owner, lease):
+        def op(conn):
+            now = time.time()
+            claimed = conn.execute(
+                '''UPDATE broadcasts
+                   SET status = 'running', lease_owner = ?, lease_until = ?, started = COALESCE(started, ?)
+                   WHERE id = ? AND status NOT IN ('done', 'cancelled')
+                     AND (lease_owner IS NULL OR lease_owner = ? OR lease_until <= ?)''',
+                (owner, now + lease, now, job_id, owner, now)
+            ).rowcount
+            return self._select_broadcast(conn, job_id) if claimed else None
+        return self._write(op)
+
+    def save_broadcast_progress(self, job_id, owner, cursor, sent, failed, elapsed, lease, finished=False):
+        def op(conn):
+            now = time.time()
+            updated = conn.execute(
+                '''UPDATE broadcasts
+                   SET cursor = ?, sent = sent + ?, failed = failed + ?, elapsed = elapsed + ?,
+                       lease_until = ?
+                   WHERE id = ? AND lease_owner = ? AND status = 'running' ''',
+                (cursor, sent, failed, elapsed, now + lease, job_id, owner)
+            ).rowcount
+            if updated and finished:
+                conn.execute(
+                    '''UPDATE broadcasts SET status = 'done', finished = ?, lease_owner = NULL, lease_until = NULL
+                       WHERE id = ?''', (now, job_id)
+                )
+            return bool(updated)
+        return self._write(op)
+
+    def release_broadcast(self, job_id, owner):
+        self._write(lambda conn: conn.execute(
+            '''UPDATE broadcasts
+               SET lease_owner = NULL, lease_until = NULL,
+                   status = CASE WHEN status = 'running' THEN 'paused' ELSE status END
+               WHERE id = ? AND lease_owner = ?''', (job_id, owner)
+        ))
+
+    def cancel_broadcast(self, job_id):
+        def op(conn):
+            conn.execute(
+                '''UPDATE broadcasts SET status = 'cancelled', finished = ?, lease_owner = NULL, lease_until = NULL
+                   WHERE id = ? AND status != 'done' ''', (time.time(), job_id)
+            )
+            return self._select_broadcast(conn, job_id)
+        return self._write(op)
+
+    def transactions_after(self, after_id=0, limit=1000):
+        # Записи пишутся под блокировкой базы, поэтому id становятся видимы строго по порядку.
+        rows = self._reader().execute(
+            'SELECT id, user_id, data FROM transactions WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit)
+        )
+        return [(row_id, user_id, dict(json.loads(data), id=row_id)) for row_id, user_id, data in rows]
+
+    def receipt_hashes(self, after_id=0):
+        return self._receipt_hashes(self._reader(), after_id)
+
+    @staticmethod
+    def _receipt_hashes(conn, after_id):
+        rows = conn.execute(
+            'SELECT id, receipt_id, phash FROM receipts WHERE id > ? AND phash IS NOT NULL ORDER BY id',
+            (after_id,)
+        )
+        return [(row_id, receipt_id, _from_sqlite_int(phash)) for row_id, receipt_id, phash in rows]
+
+
+def create_storage(backend=None, path=None):
+    backend = (backend or os.getenv('STORAGE_BACKEND', 'sqlite')).lower()
+    idempotency_ttl = float(os.getenv('IDEMPOTENCY_TTL', IDEMPOTENCY_TTL))
+    if backend == 'memory':
+        return MemoryStorage(idempotency_ttl=idempotency_ttl)
+    if backend == 'sqlite':
+        return SQLiteStorage(path or os.getenv('DATABASE_PATH', 'data/trashcash.db'), idempotency_ttl=idempotency_ttl)
+    raise ValueError(f'Неизвестный STORAGE_BACKEND: {backend}')
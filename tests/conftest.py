@@ -0,0 +1,72 @@
+"""Общие фикстуры тестов: заглушка MAX Bot API и приложение поверх нее.
+
+Приложение читает настройки из окружения при импорте, поэтому app
+импортируется один раз за сессию, после того как окружение указывает на
+заглушку и временные каталоги. Пользователи в тестах — разные id, так что
+тесты не мешают друг другу в общем хранилище.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from max_api_stub import StubServer  # noqa: E402
+
+SECRET = 'test-secret'
+BOT_TOKEN = 'test-bot-token'
+ADMIN_TOKEN = 'test-admin-token'
+
+_user_ids = itertools.count(1000)
+
+
+def sign_init_data(user_id, secret=SECRET):
+    data = json.dumps({'user': {'id': user_id, 'first_name': 'Test'}, 'auth_date': int(time.time())},
+                      separators=(',', ':'))
+    key = hashlib.sha256(secret.encode()).digest()
+    return urllib.parse.urlencode({'data': data, 'hash': hmac.new(key, data.encode(), hashlib.sha256).hexdigest()})
+
+
+@pytest.fixture
+def stub():
+    with StubServer(token=BOT_TOKEN) as server:
+        yield server
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('app')
+    session_stub = StubServer(token=BOT_TOKEN).start()
+    os.environ.update(
+        MAX_SECRET_KEY=SECRET, BOT_TOKEN=BOT_TOKEN, ADMIN_TOKEN=ADMIN_TOKEN,
+        MAX_API_BASE_URL=session_stub.url, STORAGE_BACKEND='memory',
+        UPLOAD_DIR=str(directory / 'uploads'), UPLOAD_WORKERS='1', QR_DIR=str(directory / 'qr'),
+        QR_PRERENDER='0', METRICS_DIR='', CATALOG_WATCH_INTERVAL='0', LEADERBOARD_SNAPSHOT='',
+        LEADERBOARD_REFRESH_INTERVAL='0.05', SEND_CHAT_RATE='0'
+    )
+    import app
+    app.app.config['TESTING'] = True
+    app.stub = session_stub
+    yield app
+    session_stub.stop()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def user(app_module):
+    """Новый пользователь: id и заголовки с подписанным initData."""
+    user_id = next(_user_ids)
+    return {'id': user_id, 'headers': {'X-Init-Data': sign_init_data(user_id)}}
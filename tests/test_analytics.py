@@ -0,0 +1,140 @@
+import re
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from conftest import ADMIN_TOKEN
+from storage import MIGRATIONS, SQLiteStorage, create_storage
+
+EPOCH = datetime(1970, 1, 1)
+FROM, TO = 0, 10 ** 7
+GROUPINGS = [(bucket, by_point, by_material)
+             for bucket in (1, 24, None) for by_point in (False, True) for by_material in (False, True)]
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    backend = create_storage(request.param, str(tmp_path / 'analytics.db'))
+    yield backend
+    backend.close()
+
+
+def drop(date, point_id, material, weight):
+    return {'date': date, 'type': 'recycling', 'point_id': point_id, 'point_name': f'Пункт {point_id}',
+            'material_type': material, 'weight': weight, 'coins': int(weight * 10), 'method': 'qr'}
+
+
+def fill(storage):
+    storage.credit(1, drop('2026-03-01T09:15:00', 1, 'пластик', 1.5))
+    storage.credit(1, drop('2026-03-01T09:45:00.123456', 1, 'стекло', 2.0))
+    storage.credit(2, drop('2026-03-01T23:59:59', 2, 'пластик', 0.5))
+    # Повтор по ключу идемпотентности не должен попасть в аналитику второй раз.
+    for _ in range(2):
+        storage.credit(2, drop('2026-03-02T00:00:00', 2, 'бумага', 3.0), idempotency_key='submit:a')
+    storage.credit_batch(3, [(drop('2026-03-03T12:00:00', 1, 'пластик', 4.0), 'submit:b'),
+                             (drop('2026-03-03T12:30:00', 2, 'стекло', 1.0), 'submit:c'),
+                             (drop('2026-03-03T12:30:00', 2, 'стекло', 1.0), 'submit:c')])
+    storage.purchase(1, 20, {'reward_id': 1}, {'date': '2026-03-02T10:00:00', 'type': 'purchase',
+                                                'reward_id': 1, 'reward_name': 'Скидка', 'coins': -20})
+    storage.purchase(3, 30, {'reward_id': 2}, {'date': '2026-03-03T18:10:00', 'type': 'purchase',
+                                                'reward_id': 2, 'reward_name': 'Кофе', 'coins': -30})
+
+
+def from_log(storage, bucket, by_point, by_material):
+    """Те же суммы, посчитанные напрямую по журналу транзакций."""
+    groups = {}
+    for _, _, transaction in storage.transactions_after(0, 10 ** 6):
+        hour = int((datetime.fromisoformat(transaction['date']) - EPOCH).total_seconds() // 3600)
+        recycling = transaction['type'] == 'recycling'
+        key = (hour // bucket * bucket if bucket else None,
+               (transaction.get('point_id') or 0) if by_point else None,
+               (transaction.get('material_type') or '') if by_material else None)
+        counters = groups.setdefault(key, [0.0, 0, 0, 0, 0])
+        counters[0] += transaction['weight'] if recycling else 0
+        counters[1] += recycling
+        counters[2] += max(transaction['coins'], 0)
+        counters[3] += max(-transaction['coins'], 0)
+        counters[4] += transaction['type'] == 'purchase'
+    return {key: (round(counters[0], 6), *counters[1:]) for key, counters in groups.items()}
+
+
+def from_table(storage, bucket, by_point, by_material):
+    rows = storage.analytics(FROM, TO, bucket, by_point, by_material)
+    return {tuple(row[:3]): (round(row[3], 6), *row[4:]) for row in rows}
+
+
+def assert_matches_log(storage):
+    for grouping in GROUPINGS:
+        assert from_table(storage, *grouping) == from_log(storage, *grouping), grouping
+
+
+def test_analytics_match_transaction_log(storage):
+    fill(storage)
+
+    assert_matches_log(storage)
+    assert from_table(storage, None, False, False) == {(None, None, None): (12.0, 6, 120, 50, 2)}
+
+
+def test_rebuild_stats_restores_analytics(storage):
+    fill(storage)
+    before = {grouping: from_table(storage, *grouping) for grouping in GROUPINGS}
+
+    storage.rebuild_stats()
+
+    assert {grouping: from_table(storage, *grouping) for grouping in GROUPINGS} == before
+    assert_matches_log(storage)
+
+
+def test_analytics_filters(storage):
+    fill(storage)
+
+    rows = storage.analytics(FROM, TO, None, point_id=2, material='стекло')
+    assert [tuple(row[3:]) for row in rows] == [(1.0, 1, 10, 0, 0)]
+    day = int((datetime(2026, 3, 1) - EPOCH).total_seconds() // 3600)
+    rows = storage.analytics(day, day + 24, 24)
+    assert [(row[0], row[4]) for row in rows] == [(day, 3)]
+
+
+def test_migration_backfills_existing_transactions(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    storage = SQLiteStorage(path)
+    fill(storage)
+    expected = {grouping: from_log(storage, *grouping) for grouping in GROUPINGS}
+    storage.close()
+
+    # База до миграции аналитики: таблицы нет, журнал транзакций уже есть.
+    number = next(i for i, script in enumerate(MIGRATIONS) if 'analytics_hourly' in script)
+    conn = sqlite3.connect(path)
+    for script in MIGRATIONS[number:]:
+        for table in re.findall(r'CREATE TABLE (\w+)', script):
+            conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'PRAGMA user_version = {number}')
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteStorage(path)
+    try:
+        assert {grouping: from_table(storage, *grouping) for grouping in GROUPINGS} == expected
+    finally:
+        storage.close()
+
+
+def test_admin_analytics_endpoint(app_module, client, user):
+    point = app_module.catalog.current.points[0]
+    body = {'method': 'qr', 'qrCode': point['qr_code'], 'materialType': point['types'][0], 'weight': 2}
+    assert client.post('/api/recycling/submit', json=body, headers=user['headers']).status_code == 200
+    headers = {'X-Admin-Token': ADMIN_TOKEN}
+
+    assert client.get('/api/admin/analytics').status_code == 403
+    assert client.get('/api/admin/analytics?granularity=week', headers=headers).status_code == 400
+    for granularity in ('hour', 'day', 'total'):
+        response = client.get(f'/api/admin/analytics?granularity={granularity}&group=point,material',
+                              headers=headers)
+        assert response.status_code == 200, response.get_json()
+        data = response.get_json()
+        entries = [entry for entry in data['buckets']
+                   if entry['pointId'] == point['id'] and entry['material'] == point['types'][0]]
+        assert entries and sum(entry['drops'] for entry in entries) >= 1
+        assert data['totals']['drops'] >= 1
+        assert ('start' in entries[0]) == (granularity != 'total')
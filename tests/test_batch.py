@@ -0,0 +1,107 @@
+import pytest
+
+from storage import create_storage
+
+
+@pytest.fixture
+def point(app_module):
+    return app_module.catalog.current.points[0]
+
+
+def qr_drop(point, client_id, weight=1, **fields):
+    return dict({'clientId': client_id, 'method': 'qr', 'qrCode': point['qr_code'],
+                 'materialType': point['types'][0], 'weight': weight}, **fields)
+
+
+def submit_batch(client, user, drops):
+    return client.post('/api/recycling/submit-batch', json={'drops': drops}, headers=user['headers'])
+
+
+def test_batch_reports_result_per_drop(app_module, client, user, point):
+    drops = [
+        qr_drop(point, 'a', 1),
+        qr_drop(point, 'b', 2),
+        qr_drop(point, 'c', qrCode='нет такого'),
+        qr_drop(point, 'd', weight=-1),
+        qr_drop(point, 'e', method='receipt'),
+        {'method': 'qr'},
+        'не объект',
+    ]
+
+    response = submit_batch(client, user, drops)
+
+    assert response.status_code == 200, response.get_json()
+    data = response.get_json()
+    assert [result['status'] for result in data['results']] == ['credited', 'credited'] + ['error'] * 5
+    coins = [result['transaction']['coins'] for result in data['results'][:2]]
+    assert data['coins'] == sum(coins) > 0
+    assert data['balance'] == app_module.storage.get_balance(user['id']) == sum(coins)
+
+
+def test_repeated_client_id_in_one_batch_credits_once(app_module, client, user, point):
+    response = submit_batch(client, user, [qr_drop(point, 'same', 1), qr_drop(point, 'same', 1)])
+
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == ['credited', 'duplicate']
+    assert results[0]['transaction']['id'] == results[1]['transaction']['id']
+    assert app_module.storage.get_balance(user['id']) == results[0]['transaction']['coins']
+
+
+def test_replayed_client_id_is_not_credited_again(app_module, client, user, point):
+    # Сдача уже дошла по одиночному эндпоинту с тем же ключом, затем ушла еще и в пачке.
+    single = client.post('/api/recycling/submit', json=qr_drop(point, 'x'),
+                         headers=dict(user['headers'], **{'Idempotency-Key': 'x'}))
+    assert single.status_code == 200
+    first = submit_batch(client, user, [qr_drop(point, 'x'), qr_drop(point, 'y')]).get_json()
+    again = submit_batch(client, user, [qr_drop(point, 'x'), qr_drop(point, 'y')]).get_json()
+
+    assert [result['status'] for result in first['results']] == ['duplicate', 'credited']
+    assert [result['status'] for result in again['results']] == ['duplicate', 'duplicate']
+    assert again['coins'] == 0
+    expected = single.get_json()['coins'] + first['coins']
+    assert again['balance'] == app_module.storage.get_balance(user['id']) == expected
+    assert len(app_module.storage.list_transactions(user['id'], limit=None)) == 2
+
+
+def test_batch_size_limit(app_module, client, user, point):
+    limit = app_module.SUBMIT_BATCH_MAX
+
+    too_many = submit_batch(client, user, [qr_drop(point, str(i)) for i in range(limit + 1)])
+    assert too_many.status_code == 400 and too_many.get_json()['max'] == limit
+    assert submit_batch(client, user, []).status_code == 400
+    assert client.post('/api/recycling/submit-batch', json=[qr_drop(point, 'z')],
+                       headers=user['headers']).status_code == 400
+    assert app_module.storage.get_balance(user['id']) == 0
+
+    full = submit_batch(client, user, [qr_drop(point, str(i)) for i in range(limit)])
+    assert full.status_code == 200
+    assert {result['status'] for result in full.get_json()['results']} == {'credited'}
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    backend = create_storage(request.param, str(tmp_path / 'batch.db'))
+    yield backend
+    backend.close()
+
+
+def drop(coins):
+    return {'date': '2026-01-01T12:00:00', 'type': 'recycling', 'point_id': 1,
+            'material_type': 'пластик', 'weight': 1.0, 'coins': coins}
+
+
+def test_credit_batch_changes_balance_once_per_credited_drop(storage):
+    storage.credit(1, drop(5), idempotency_key='submit:old')
+
+    balance, results = storage.credit_batch(1, [(drop(10), 'submit:a'), (drop(20), 'submit:b'),
+                                                (drop(10), 'submit:a'), (drop(5), 'submit:old')])
+
+    assert [replayed for _, replayed in results] == [False, False, True, True]
+    assert results[0][0]['id'] == results[2][0]['id']
+    assert balance == storage.get_balance(1) == 35
+    assert storage.get_stats(1)['transaction_count'] == 3
+    assert storage.idempotent_result(1, 'submit:b') == (35, results[1][0])
+
+    balance, results = storage.credit_batch(1, [(drop(10), 'submit:a'), (drop(20), 'submit:b')])
+    assert [replayed for _, replayed in results] == [True, True]
+    assert balance == storage.get_balance(1) == 35
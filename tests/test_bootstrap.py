@@ -0,0 +1,45 @@
+import pytest
+
+SECTIONS = {'balance', 'stats', 'myRewards', 'transactions', 'rewards', 'points'}
+
+
+def test_bootstrap_returns_all_sections(client, user):
+    response = client.get('/api/bootstrap', headers=user['headers'])
+
+    assert response.status_code == 200, response.get_json()
+    data = response.get_json()
+    assert data['valid'] is True and data['userId'] == user['id']
+    assert SECTIONS.issubset(data)
+    assert data['balance'] == 0 and data['transactions'] == []
+
+
+def test_bootstrap_returns_requested_sections(client, user):
+    response = client.get('/api/bootstrap?sections=balance,rewards', headers=user['headers'])
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert SECTIONS.intersection(data) == {'balance', 'rewards'}
+
+
+def test_bootstrap_reads_options_from_json_body(client, user):
+    response = client.post('/api/bootstrap', json={'sections': ['points'], 'open_now': True, 'points_limit': 2},
+                           headers=user['headers'])
+
+    assert response.status_code == 200, response.get_json()
+    data = response.get_json()
+    assert SECTIONS.intersection(data) == {'points'}
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    'points',
+    {'open_at': 5},
+    {'sections': [1]},
+    {'sections': 'points', 'lat': {'value': 55}},
+    {'sections': 'points', 'bbox': [[1, 2]]},
+])
+def test_bootstrap_rejects_malformed_body(client, user, body):
+    response = client.post('/api/bootstrap', json=body, headers=user['headers'])
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from broadcast import BroadcastRunner
+from conftest import BOT_TOKEN
+from max_api import MaxApiClient
+from storage import MemoryStorage
+
+CHATS = 300
+BLOCKED = range(1, 21)
+
+
+@pytest.fixture
+def storage(stub):
+    storage = MemoryStorage()
+    for chat_id in range(1, CHATS + 1):
+        storage.save_chat(chat_id, chat_id)
+    for chat_id in BLOCKED:
+        stub.state.chat_statuses[chat_id] = 403
+    return storage
+
+
+def make_runner(storage, stub):
+    max_api = MaxApiClient(BOT_TOKEN, stub.url, failure_threshold=2, reset_timeout=0.2)
+    return BroadcastRunner(storage, max_api, rate=0, workers=4, page_size=100, retries=1, backoff=0.01)
+
+
+def run(storage, runner):
+    job = storage.create_broadcast({'text': 'Новости'}, storage.count_chats())
+    return runner.run(job['id'])
+
+
+def test_broadcast_reaches_every_chat(storage, stub):
+    runner = make_runner(storage, stub)
+
+    job = run(storage, runner)
+
+    assert job['status'] == 'done'
+    assert (job['sent'], job['failed']) == (CHATS - len(BLOCKED), len(BLOCKED))
+    assert sorted(message['chat_id'] for message in stub.state.messages) == list(range(21, CHATS + 1))
+    assert runner.stats()['pauses'] == 0
+
+
+def test_outage_pauses_instead_of_writing_off_chats(storage, stub):
+    runner = make_runner(storage, stub)
+    stub.state.fail_rate = 1.0
+    recovery = threading.Timer(0.5, setattr, (stub.state, 'fail_rate', 0.0))
+    recovery.start()
+
+    job = run(storage, runner)
+    recovery.join()
+
+    assert job['status'] == 'done'
+    assert (job['sent'], job['failed']) == (CHATS - len(BLOCKED), len(BLOCKED))
+    assert {message['chat_id'] for message in stub.state.messages} == set(range(21, CHATS + 1))
+    assert runner.stats()['pauses'] >= 1
+
+
+def test_stop_during_outage_keeps_cursor(storage, stub):
+    runner = make_runner(storage, stub)
+    stub.state.fail_rate = 1.0
+    job = storage.create_broadcast({'text': 'Новости'}, storage.count_chats())
+    stop_event = threading.Event()
+    threading.Timer(0.3, stop_event.set).start()
+
+    job = runner.run(job['id'], stop_event)
+
+    assert job['status'] != 'done'
+    assert (job['cursor'], job['sent'], job['failed']) == (None, 0, 0)
@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from catalog_import import validate_point
+from hours import HoursIndex
+
+POINTS = [
+    {'id': 1, 'hours': 'круглосуточно'},
+    {'id': 2, 'hours': 'круглосуточно', 'timezone': 'Mars/Olympus_Mons'},
+    {'id': 3, 'hours': 'круглосуточно', 'timezone': 'Asia/Yekaterinburg'},
+    {'id': 4, 'hours': 'как придется'},
+]
+
+
+def test_unknown_point_timezone_is_reported_not_raised():
+    index = HoursIndex(POINTS, 'Europe/Moscow')
+
+    assert index.bad_timezones == {2: 'Mars/Olympus_Mons'}
+    assert index.unparsed == 1
+    is_open = index.predicate(datetime.now(timezone.utc))
+    assert [point['id'] for point in POINTS if is_open(point)] == [1, 3]
+
+
+def test_unknown_default_timezone_is_a_value_error():
+    with pytest.raises(ValueError, match='часовой пояс'):
+        HoursIndex(POINTS, 'Nowhere/Special')
+
+
+def test_import_rejects_unknown_timezone():
+    raw = {'id': 5, 'name': 'Пункт', 'address': 'ул. Тестовая, 1', 'lat': 55.75, 'lng': 37.62,
+           'types': 'пластик', 'timezone': 'Mars/Olympus_Mons'}
+    with pytest.raises(ValueError, match='часовой пояс'):
+        validate_point(raw)
@@ -0,0 +1,33 @@
+import time
+from datetime import datetime
+
+from leaderboard import Leaderboards
+from storage import MemoryStorage
+
+
+def drop(weight):
+    return {'date': datetime.now().isoformat(), 'type': 'recycling', 'material_type': 'plastic',
+            'weight': weight, 'coins': int(weight * 10)}
+
+
+def test_request_refresh_wakes_background_thread():
+    storage = MemoryStorage()
+    storage.credit(1, drop(2.0))
+    leaderboards = Leaderboards(storage, refresh_interval=60)
+    leaderboards.ensure_running()
+    try:
+        deadline = time.monotonic() + 5
+        while not leaderboards.ready:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        storage.credit(2, drop(5.0))
+        leaderboards.request_refresh()
+        while leaderboards.rank(2) is None:
+            assert time.monotonic() < deadline, 'фоновый поток не проснулся'
+            time.sleep(0.01)
+
+        assert leaderboards.rank(2)['position'] == 1
+        assert leaderboards.rank(1)['position'] == 2
+    finally:
+        leaderboards.stop()
@@ -0,0 +1,83 @@
+import pytest
+
+from conftest import BOT_TOKEN
+from max_api import MaxApiClient, MaxApiError
+
+
+def client_for(stub, token=BOT_TOKEN):
+    return MaxApiClient(token, stub.url, failure_threshold=3, reset_timeout=60)
+
+
+def test_recipient_errors_do_not_open_breakers(stub):
+    stub.state.chat_statuses.update({1: 403, 2: 404, 3: 400})
+    client = client_for(stub)
+    assert client.call('sendMessage', {'chat_id': 10, 'text': 'hi'})['ok']
+
+    for _ in range(5):
+        for chat_id in (1, 2, 3):
+            with pytest.raises(MaxApiError) as error:
+                client.call('sendMessage', {'chat_id': chat_id, 'text': 'hi'})
+            assert error.value.status_code == stub.state.chat_statuses[chat_id]
+            assert not error.value.unavailable
+
+    assert client.stats()['circuits'] == {'path': 'closed', 'bearer': 'closed'}
+    # Отказ по чату не повторяется другим способом авторизации.
+    assert len(stub.state.requests) == 16
+
+
+def test_unsupported_route_falls_back_to_bearer(stub):
+    stub.state.variant_statuses['path'] = 404
+    client = client_for(stub)
+
+    for _ in range(5):
+        assert client.call('sendMessage', {'chat_id': 10, 'text': 'hi'})['ok']
+
+    assert client.stats()['preferred'] == 'bearer'
+    assert client.stats()['circuits'] == {'path': 'closed', 'bearer': 'closed'}
+    # После первого успеха клиент сразу идет в рабочий вариант.
+    assert [r['path'] for r in stub.state.requests] == ['/bot' + BOT_TOKEN + '/sendMessage'] + ['/bot/sendMessage'] * 5
+
+    stub.state.chat_statuses[1] = 403
+    with pytest.raises(MaxApiError) as error:
+        client.call('sendMessage', {'chat_id': 1, 'text': 'hi'})
+    assert error.value.status_code == 403
+    assert len(stub.state.requests) == 7
+
+
+def test_request_error_before_any_success_tries_both_variants(stub):
+    stub.state.chat_statuses[1] = 403
+    client = client_for(stub)
+
+    with pytest.raises(MaxApiError) as error:
+        client.call('sendMessage', {'chat_id': 1, 'text': 'hi'})
+
+    assert error.value.status_code == 403 and not error.value.unavailable
+    assert client.stats()['preferred'] == 'path'
+    assert len(stub.state.requests) == 2
+
+
+def test_server_errors_fail_over_and_open_breakers(stub):
+    stub.state.fail_rate = 1.0
+    client = client_for(stub)
+
+    for _ in range(3):
+        with pytest.raises(MaxApiError) as error:
+            client.call('sendMessage', {'chat_id': 10, 'text': 'hi'})
+        assert error.value.status_code == 503
+    assert len(stub.state.requests) == 6
+    assert client.stats()['circuits'] == {'path': 'open', 'bearer': 'open'}
+
+    with pytest.raises(MaxApiError) as error:
+        client.call('sendMessage', {'chat_id': 10, 'text': 'hi'})
+    assert error.value.status_code is None and error.value.unavailable
+    assert len(stub.state.requests) == 6
+
+
+def test_rejected_token_is_a_variant_failure(stub):
+    client = client_for(stub, token='wrong')
+
+    with pytest.raises(MaxApiError) as error:
+        client.call('sendMessage', {'chat_id': 10, 'text': 'hi'})
+
+    assert error.value.status_code == 401 and error.value.unavailable
+    assert len(stub.state.requests) == 2
@@ -0,0 +1,87 @@
+import pytest
+
+from bot import Bot
+from conftest import BOT_TOKEN
+from max_api import VARIANTS, MaxApiClient
+from outbox import SendQueue
+from storage import MemoryStorage
+
+RETRIES = 3
+
+
+@pytest.fixture
+def bot(stub):
+    send_queue = SendQueue(workers=2, rate=0, chat_rate=0, retries=RETRIES, backoff=0.01)
+    max_api = MaxApiClient(BOT_TOKEN, stub.url, failure_threshold=100)
+    yield Bot(max_api, send_queue, MemoryStorage(), 'https://example.test/app')
+    send_queue.stop()
+
+
+def start(bot, chat_id, update_id=None):
+    update = {'update_type': 'message_created',
+              'message': {'chat': {'id': chat_id}, 'from': {'id': chat_id, 'first_name': 'Test'}, 'text': '/start'}}
+    if update_id is not None:
+        update['update_id'] = update_id
+    bot.process_updates([update])
+    bot.send_queue.join()
+
+
+def test_reply_is_sent_once_with_webapp_button(bot, stub):
+    start(bot, 42)
+
+    assert len(stub.state.messages) == 1
+    message = stub.state.messages[0]
+    assert message['chat_id'] == 42
+    assert message['reply_markup']['inline_keyboard'][0][0]['web_app']['url'] == 'https://example.test/app'
+    assert bot.send_queue.stats()['sent'] == 1
+
+
+def test_unparsed_success_body_counts_as_delivered(bot, stub):
+    stub.state.plain_responses = True
+
+    start(bot, 42)
+
+    assert len(stub.state.messages) == 1
+    assert len(stub.state.requests) == 1
+    assert bot.stats()['fallbacks'] == {'url': 0, 'simple_link': 0}
+    assert bot.send_queue.stats() | {'queued': 0} == {'queued': 0, 'sent': 1, 'failed': 0, 'retried': 0, 'dropped': 0}
+
+
+def test_recipient_refusal_tries_fallbacks_once_without_retries(bot, stub):
+    stub.state.chat_statuses[42] = 403
+    # Способ авторизации уже подтвержден успешной отправкой.
+    start(bot, 7)
+    stub.state.reset()
+
+    start(bot, 42)
+
+    # Клавиатура мини-приложения, кнопка-ссылка, текст со ссылкой — по одному запросу.
+    assert len(stub.state.requests) == 3
+    stats = bot.send_queue.stats()
+    assert (stats['sent'], stats['failed'], stats['retried']) == (1, 1, 0)
+
+
+def test_unavailable_api_is_retried_within_bound(bot, stub):
+    stub.state.fail_rate = 1.0
+
+    start(bot, 42)
+
+    assert len(stub.state.requests) <= len(VARIANTS) * (RETRIES + 1)
+    assert bot.stats()['fallbacks'] == {'url': 0, 'simple_link': 0}
+    stats = bot.send_queue.stats()
+    assert (stats['sent'], stats['failed'], stats['retried']) == (0, 1, RETRIES)
+
+
+def test_redelivered_update_is_answered_once(bot, stub):
+    start(bot, 42, update_id=7)
+    start(bot, 42, update_id=7)
+
+    assert len(stub.state.messages) == 1
+
+
+def test_start_remembers_chat_for_broadcasts(bot, stub):
+    start(bot, 42)
+    start(bot, 42)
+
+    assert bot.storage.chat_ids() == [42]
+    assert bot.storage.count_chats() == 1
@@ -0,0 +1,185 @@
+import threading
+import time
+
+import pytest
+
+from bot import Bot
+from conftest import BOT_TOKEN
+from max_api import MaxApiClient
+from outbox import SendQueue
+from poller import ChatWorkers, OffsetCheckpoint, UpdatePoller
+from storage import MemoryStorage
+
+
+def message(chat_id, text='/start'):
+    return {'update_type': 'message_created',
+            'message': {'chat': {'id': chat_id}, 'from': {'id': chat_id, 'first_name': 'Test'}, 'text': text}}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'условие не выполнилось'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_poller(stub, tmp_path):
+    created = []
+
+    def make(**options):
+        send_queue = SendQueue(workers=2, rate=0, chat_rate=0, retries=1, backoff=0.01)
+        max_api = MaxApiClient(BOT_TOKEN, stub.url, failure_threshold=100)
+        bot = Bot(max_api, send_queue, MemoryStorage(), 'https://example.test/app')
+        options.setdefault('timeout', 0)
+        poller = UpdatePoller(max_api, bot, OffsetCheckpoint(str(tmp_path / 'poller.offset')), workers=2, **options)
+        created.append(poller)
+        return poller
+
+    yield make
+    for poller in created:
+        poller.stop_event.set()
+        poller.close()
+        poller.bot.send_queue.stop()
+
+
+def test_poll_answers_updates_and_saves_offset(make_poller, stub):
+    stub.state.push_updates([message(chat_id) for chat_id in (1, 2, 3)])
+    poller = make_poller()
+
+    assert poller.poll_once() == 3
+    poller.bot.send_queue.join()
+
+    assert sorted(m['chat_id'] for m in stub.state.messages) == [1, 2, 3]
+    assert poller.checkpoint.load() == poller.offset == 4
+    assert poller.stats()['processed'] == 3
+
+
+def test_restart_resumes_from_checkpoint(make_poller, stub):
+    stub.state.push_updates([message(1), message(2)])
+    make_poller().poll_once()
+
+    restarted = make_poller()
+    assert restarted.offset == 3
+    assert restarted.poll_once() == 0
+
+    stub.state.push_updates([message(3)])
+    assert restarted.poll_once() == 1
+    restarted.bot.send_queue.join()
+    assert sorted(m['chat_id'] for m in stub.state.messages) == [1, 2, 3]
+
+
+def test_long_poll_waits_for_updates(make_poller, stub):
+    poller = make_poller(timeout=1)
+    thread = threading.Thread(target=poller.run)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        assert poller.stats()['received'] == 0
+        stub.state.push_updates([message(7)])
+        wait_for(lambda: poller.stats()['processed'] == 1)
+    finally:
+        poller.stop_event.set()
+        thread.join()
+    assert poller.stats()['errors'] == 0
+
+
+def test_run_backs_off_on_errors_and_recovers(make_poller, stub):
+    poller = make_poller(backoff=0.01, max_backoff=0.05)
+    stub.state.fail_rate = 1.0
+    thread = threading.Thread(target=poller.run)
+    thread.start()
+    try:
+        wait_for(lambda: poller.stats()['errors'] >= 2)
+        stub.state.fail_rate = 0.0
+        stub.state.push_updates([message(5)])
+        wait_for(lambda: poller.stats()['processed'] == 1)
+    finally:
+        poller.stop_event.set()
+        thread.join()
+
+
+def test_chat_workers_keep_per_chat_order():
+    handled = []
+    lock = threading.Lock()
+
+    def handler(update):
+        with lock:
+            handled.append(update)
+
+    workers = ChatWorkers(handler, workers=4)
+    for n in range(50):
+        for chat_id in (1, 2, 3):
+            workers.submit(chat_id, (chat_id, n))
+    workers.join()
+    workers.stop()
+
+    for chat_id in (1, 2, 3):
+        assert [n for c, n in handled if c == chat_id] == list(range(50))
+
+
+def test_checkpoint_failure_does_not_stop_poller(make_poller, stub, monkeypatch):
+    poller = make_poller(backoff=0.01, max_backoff=0.05)
+    save = poller.checkpoint.save
+    failures = iter([OSError('диск переполнен')])
+
+    def flaky_save(offset):
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        save(offset)
+
+    monkeypatch.setattr(poller.checkpoint, 'save', flaky_save)
+    stub.state.push_updates([message(1)])
+    thread = threading.Thread(target=poller.run)
+    thread.start()
+    try:
+        wait_for(lambda: poller.stats()['errors'] == 1)
+        stub.state.push_updates([message(2)])
+        wait_for(lambda: poller.checkpoint.load() == 3)
+    finally:
+        poller.stop_event.set()
+        thread.join()
+    poller.bot.send_queue.join()
+    assert sorted(m['chat_id'] for m in stub.state.messages) == [1, 2]
+
+
+def test_malformed_response_is_an_error(make_poller, monkeypatch):
+    poller = make_poller(backoff=0.01, max_backoff=0.05)
+    responses = iter([['not', 'a', 'dict'], {'result': 'oops'}])
+
+    def call(method, payload=None, timeout=None):
+        response = next(responses, None)
+        if response is None:
+            poller.stop_event.set()
+            return {'result': []}
+        return response
+
+    monkeypatch.setattr(poller.max_api, 'call', call)
+    poller.run()
+
+    assert poller.stats()['errors'] == 2
+
+
+def test_failed_batch_releases_unhandled_updates(make_poller, stub, monkeypatch):
+    stub.state.push_updates([message(1), message(2)])
+    poller = make_poller()
+    submit = poller.workers.submit
+    calls = []
+
+    def flaky_submit(chat_id, update):
+        calls.append(chat_id)
+        if len(calls) == 2:
+            raise RuntimeError('сбой посреди пачки')
+        submit(chat_id, update)
+
+    monkeypatch.setattr(poller.workers, 'submit', flaky_submit)
+    with pytest.raises(RuntimeError):
+        poller.poll_once()
+    assert poller.offset is None
+
+    # Пачка приходит снова: необработанное обновление принимается, обработанное — нет.
+    assert poller.poll_once() == 2
+    poller.bot.send_queue.join()
+    assert sorted(m['chat_id'] for m in stub.state.messages) == [1, 2]
+    assert poller.stats()['processed'] == 1
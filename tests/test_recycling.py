@@ -0,0 +1,181 @@
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from idempotency import IdempotencyCache
+from phash import ReceiptHashIndex
+from storage import DuplicateReceipt, InsufficientFunds, create_storage
+
+
+def receipt_photo(seed):
+    """Фото «чека»: крупные случайные блоки, у разных seed далекие dHash."""
+    rng = random.Random(seed)
+    image = Image.new('L', (9, 8))
+    image.putdata([rng.randrange(256) for _ in range(72)])
+    return jpeg(image.resize((320, 480), Image.Resampling.BILINEAR).convert('RGB'))
+
+
+def jpeg(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def recapture(photo):
+    """Тот же чек, снятый заново: слегка обрезан и пережат."""
+    return jpeg(Image.open(io.BytesIO(photo)).crop((6, 6, 314, 474)), quality=40)
+
+
+def upload_receipt(client, user, photo):
+    response = client.post('/api/receipts/upload', data=photo, content_type='image/jpeg', headers=user['headers'])
+    assert response.status_code in (200, 201), response.get_json()
+    receipt_id = response.get_json()['receiptId']
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        status = client.get(f'/api/receipts/{receipt_id}', headers=user['headers']).get_json()['status']
+        if status != 'processing':
+            assert status == 'ready'
+            return receipt_id
+        time.sleep(0.1)
+    pytest.fail('фото чека не обработалось за 60 секунд')
+
+
+def test_submit_processed_receipt(app_module, client, user):
+    point = app_module.catalog.current.points[0]
+    receipt_id = upload_receipt(client, user, receipt_photo(1))
+    body = {'method': 'receipt', 'pointId': point['id'], 'receiptId': receipt_id,
+            'materialType': point['types'][0], 'weight': 2}
+
+    response = client.post('/api/recycling/submit', json=body, headers=user['headers'])
+
+    assert response.status_code == 200, response.get_json()
+    data = response.get_json()
+    assert data['transaction']['receipt_id'] == receipt_id
+    assert data['balance'] == data['coins'] > 0
+
+    again = client.post('/api/recycling/submit', json=body, headers=user['headers'])
+    assert again.status_code == 409
+    assert again.get_json()['duplicate'] is True
+
+
+def test_recaptured_receipt_is_rejected(app_module, client, user):
+    point = app_module.catalog.current.points[0]
+    photo = receipt_photo(2)
+    body = {'method': 'receipt', 'pointId': point['id'], 'materialType': point['types'][0], 'weight': 1}
+
+    first = client.post('/api/recycling/submit', json=dict(body, receiptId=upload_receipt(client, user, photo)),
+                        headers=user['headers'])
+    assert first.status_code == 200, first.get_json()
+
+    copy_id = upload_receipt(client, user, recapture(photo))
+    again = client.post('/api/recycling/submit', json=dict(body, receiptId=copy_id), headers=user['headers'])
+    assert again.status_code == 409
+    assert again.get_json()['duplicate'] is True
+    assert app_module.storage.get_balance(user['id']) == first.get_json()['balance']
+
+
+def test_concurrent_submits_with_one_idempotency_key(app_module, user):
+    point = app_module.catalog.current.points[0]
+    body = {'method': 'qr', 'qrCode': point['qr_code'], 'materialType': point['types'][0], 'weight': 1}
+    headers = dict(user['headers'], **{'Idempotency-Key': 'same-drop'})
+
+    def submit(_):
+        return app_module.app.test_client().post('/api/recycling/submit', json=body, headers=headers)
+
+    with ThreadPoolExecutor(16) as pool:
+        responses = list(pool.map(submit, range(32)))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.get_json()['transaction']['id'] for response in responses}) == 1
+    assert app_module.storage.get_balance(user['id']) == responses[0].get_json()['coins']
+    assert len(app_module.storage.list_transactions(user['id'], limit=None)) == 1
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    backend = create_storage(request.param, str(tmp_path / 'test.db'))
+    yield backend
+    backend.close()
+
+
+def credit(storage, user_id, coins, key=None):
+    transaction = {'date': '2026-01-01T12:00:00', 'type': 'recycling', 'point_id': 1,
+                   'material_type': 'пластик', 'weight': 1.0, 'coins': coins}
+    return storage.credit(user_id, transaction, idempotency_key=key)
+
+
+def test_concurrent_credits_keep_every_coin(storage):
+    users = range(1, 9)
+    with ThreadPoolExecutor(32) as pool:
+        list(pool.map(lambda i: credit(storage, users[i % len(users)], 3), range(400)))
+
+    assert [storage.get_balance(user_id) for user_id in users] == [150] * len(users)
+    assert storage.get_stats(1)['transaction_count'] == 50
+
+
+def test_concurrent_purchases_never_overdraw(storage):
+    credit(storage, 1, 100)
+    barrier = threading.Barrier(20)
+
+    def purchase(i):
+        barrier.wait()
+        transaction = {'date': '2026-01-01T12:00:00', 'type': 'purchase', 'coins': -50}
+        try:
+            storage.purchase(1, 50, {'reward_id': i}, transaction)
+            return True
+        except InsufficientFunds:
+            return False
+
+    with ThreadPoolExecutor(20) as pool:
+        results = list(pool.map(purchase, range(20)))
+
+    assert sum(results) == 2
+    assert storage.get_balance(1) == 0
+    assert len(storage.list_rewards(1)) == 2
+
+
+def test_concurrent_credits_with_one_key_credit_once(storage):
+    with ThreadPoolExecutor(16) as pool:
+        results = list(pool.map(lambda _: credit(storage, 1, 10, key='submit:k'), range(40)))
+
+    assert {transaction['id'] for _, transaction in results} == {results[0][1]['id']}
+    assert storage.get_balance(1) == 10
+
+
+def test_concurrent_near_duplicate_receipts_credit_once(storage):
+    index = ReceiptHashIndex(storage, max_distance=6)
+    phash = 0x0123456789abcdef
+    barrier = threading.Barrier(16)
+
+    def submit(i):
+        transaction = {'date': '2026-01-01T12:00:00', 'type': 'recycling', 'point_id': 1,
+                       'material_type': 'пластик', 'weight': 1.0, 'coins': 10, 'method': 'receipt'}
+        barrier.wait()
+        try:
+            # Разные фото одного чека: хэши различаются на пару бит.
+            storage.credit(100 + i, transaction, (f'r{i}', phash ^ (1 << i) ^ (1 << (i + 20))),
+                           receipt_check=index.check)
+            return True
+        except DuplicateReceipt:
+            return False
+
+    with ThreadPoolExecutor(16) as pool:
+        results = list(pool.map(submit, range(16)))
+
+    assert sum(results) == 1
+    assert len(storage.receipt_hashes()) == 1
+
+
+def test_idempotency_ttl_is_one_setting(monkeypatch, tmp_path):
+    monkeypatch.setenv('IDEMPOTENCY_TTL', '120')
+    for backend in ('memory', 'sqlite'):
+        storage = create_storage(backend, str(tmp_path / 'ttl.db'))
+        try:
+            assert storage.idempotency_ttl == IdempotencyCache(storage).ttl == 120
+        finally:
+            storage.close()
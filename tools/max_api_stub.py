@@ -0,0 +1,236 @@
+"""Локальная заглушка MAX Bot API (platform-api.max.ru) для тестов и нагрузки.
+
+Запуск:
+    python tools/max_api_stub.py --port 8081 --delay 0.05 --fail-rate 0.1
+
+после чего приложение запускается с MAX_API_BASE_URL=http://127.0.0.1:8081.
+Заглушка принимает оба варианта адресов (/bot{TOKEN}/... и /bot/... с
+заголовком Authorization: Bearer), запоминает отправленные сообщения и
+отдает их по GET /__stub__/messages. POST /__stub__/reset очищает журнал.
+StubState.chat_statuses задает код ответа sendMessage для отдельных чатов
+(например, 403 — бот заблокирован пользователем), variant_statuses — код
+ответа для всех запросов одним способом авторизации ('path' или 'bearer'),
+а plain_responses — ответ 200 с телом не в JSON.
+
+Для long polling есть getUpdates (offset/limit/timeout): обновления
+добавляются через POST /__stub__/updates — объект или массив, update_id
+проставляется автоматически, если его нет.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, token='', delay=0.0, fail_rate=0.0):
+        self.token = token
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.chat_statuses = {}
+        self.variant_statuses = {}
+        self.plain_responses = False
+        self.messages = []
+        self.requests = []
+        self.updates = []
+        self.next_update_id = 1
+        self.lock = threading.Lock()
+        self.updates_changed = threading.Condition(self.lock)
+
+    def reset(self):
+        with self.lock:
+            self.messages.clear()
+            self.requests.clear()
+            self.updates.clear()
+
+    def push_updates(self, updates):
+        with self.lock:
+            for update in updates:
+                update = dict(update)
+                update.setdefault('update_id', self.next_update_id)
+                self.next_update_id = max(self.next_update_id, update['update_id']) + 1
+                self.updates.append(update)
+            self.updates_changed.notify_all()
+            return len(updates)
+
+    def get_updates(self, offset=None, limit=100, timeout=0):
+        deadline = time.monotonic() + min(float(timeout or 0), 50.0)
+        with self.lock:
+            if offset is not None:
+                # Как в Bot API: запрос с offset подтверждает все обновления до него.
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.updates_changed.wait(remaining)
+            return self.updates[:max(1, min(int(limit or 100), 100))]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_plain(self, status, text):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+
+    def _authorize(self):
+        """Возвращает имя метода API или None, если токен не подошел."""
+        path = self.path.split('?', 1)[0]
+        if not path.startswith('/bot'):
+            return None
+        prefix, _, method = path[len('/bot'):].partition('/')
+        token = prefix or self.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if self.state.token and token != self.state.token:
+            return None
+        return method
+
+    def do_GET(self):
+        if self.path.startswith('/__stub__/messages'):
+            with self.state.lock:
+                messages = list(self.state.messages)
+            return self._send_json(200, {'messages': messages})
+        if self.path.startswith('/__stub__/requests'):
+            with self.state.lock:
+                requests_log = list(self.state.requests)
+            return self._send_json(200, {'requests': requests_log})
+        return self._send_json(404, {'ok': False, 'error': 'not found'})
+
+    def do_POST(self):
+        if self.path.startswith('/__stub__/reset'):
+            self._read_json()
+            self.state.reset()
+            return self._send_json(200, {'ok': True})
+        if self.path.startswith('/__stub__/updates'):
+            payload = self._read_json()
+            if not isinstance(payload, (list, dict)):
+                return self._send_json(400, {'ok': False, 'error': 'bad json'})
+            updates = payload if isinstance(payload, list) else [payload]
+            return self._send_json(200, {'ok': True, 'queued': self.state.push_updates(updates)})
+
+        payload = self._read_json()
+        method = self._authorize()
+        with self.state.lock:
+            self.state.requests.append({'path': self.path.split('?', 1)[0], 'time': time.time()})
+        if self.state.delay:
+            time.sleep(self.state.delay)
+        if method is None:
+            return self._send_json(401, {'ok': False, 'error': 'unauthorized'})
+        if payload is None:
+            return self._send_json(400, {'ok': False, 'error': 'bad json'})
+        variant = 'bearer' if self.path.startswith('/bot/') else 'path'
+        status = self.state.variant_statuses.get(variant)
+        if status is not None:
+            return self._send_json(status, {'ok': False, 'error': f'{variant} error {status}'})
+        if self.state.fail_rate and random.random() < self.state.fail_rate:
+            return self._send_json(503, {'ok': False, 'error': 'temporary failure'})
+
+        if method == 'sendMessage':
+            status = self.state.chat_statuses.get(payload.get('chat_id'))
+            if status is not None:
+                return self._send_json(status, {'ok': False, 'error': f'chat error {status}'})
+            with self.state.lock:
+                message_id = len(self.state.messages) + 1
+                self.state.messages.append(dict(payload, message_id=message_id, time=time.time()))
+            if self.state.plain_responses:
+                return self._send_plain(200, 'OK')
+            return self._send_json(200, {'ok': True, 'result': {'message_id': message_id}})
+        if method in ('setWebhook', 'deleteWebhook'):
+            return self._send_json(200, {'ok': True, 'result': True})
+        if method == 'getUpdates':
+            updates = self.state.get_updates(payload.get('offset'), payload.get('limit', 100),
+                                             payload.get('timeout', 0))
+            return self._send_json(200, {'ok': True, 'result': updates})
+        return self._send_json(404, {'ok': False, 'error': f'unknown method {method}'})
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиент long polling может закрыть соединение, не дождавшись ответа.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubServer:
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.state = StubState(**options)
+        handler = type('BoundStubHandler', (StubHandler,), {'state': self.state})
+        self.httpd = _QuietServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка MAX Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--token', default='', help='ожидаемый BOT_TOKEN (пусто — любой)')
+    parser.add_argument('--delay', type=float, default=0.0, help='задержка ответа, секунды')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля ответов 503')
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, token=args.token, delay=args.delay, fail_rate=args.fail_rate)
+    print(f'Заглушка MAX API слушает {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
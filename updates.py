@@ -0,0 +1,71 @@
+"""Разбор и дедупликация обновлений бота.
+
+Платформа повторяет доставку webhook, если ответ пришел поздно, поэтому
+каждое обновление проверяется по ключу: сначала в памяти воркера
+(SeenUpdates — окно по времени с ограничением размера, O(1) на проверку),
+затем в общем хранилище, чтобы повтор, попавший в другой воркер gunicorn,
+тоже был отброшен.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def iter_updates(payload):
+    """Обновления из тела запроса: один объект, массив или {"updates": [...]}."""
+    if isinstance(payload, list):
+        updates = payload
+    elif isinstance(payload, dict) and isinstance(payload.get('updates'), list):
+        updates = payload['updates']
+    elif isinstance(payload, dict):
+        updates = [payload]
+    else:
+        updates = []
+    return [update for update in updates if isinstance(update, dict)]
+
+
+def update_key(update):
+    """Ключ для дедупликации или None, если у обновления нет идентификатора."""
+    update_id = update.get('update_id')
+    if update_id is not None:
+        return f'u:{update_id}'
+    message = update.get('message')
+    if isinstance(message, dict):
+        message_id = message.get('message_id') or (message.get('body') or {}).get('mid')
+        if message_id is not None:
+            return f'm:{message_id}'
+    return None
+
+
+class SeenUpdates:
+    def __init__(self, ttl=600, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def add(self, key):
+        """True, если ключ новый; False — повторная доставка в пределах окна."""
+        now = time.monotonic()
+        with self._lock:
+            # Окно одинаковое для всех ключей, поэтому порядок вставки совпадает
+            # с порядком истечения и устаревшие ключи снимаются с начала.
+            while self._seen:
+                oldest, expires_at = next(iter(self._seen.items()))
+                if expires_at > now and len(self._seen) < self.max_size:
+                    break
+                del self._seen[oldest]
+            if key in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen[key] = now + self.ttl
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._seen), 'duplicates': self.duplicates}
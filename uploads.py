@@ -0,0 +1,305 @@
+"""Загрузка и обработка фотографий чеков.
+
+Фото принимается отдельным запросом (сырое тело image/* или multipart-поле
+photo) и пишется на диск кусками, с подсчетом SHA-256 и проверкой размера
+по ходу чтения, так что воркер API никогда не держит изображение в памяти
+целиком. Файлы адресуются хэшем содержимого: повторная загрузка того же
+файла не создает копий. Удаление EXIF, уменьшение и миниатюра выполняются
+в ограниченном пуле процессов; после обработки оригинал удаляется.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.exceptions import RequestEntityTooLarge, ServiceUnavailable
+from werkzeug.formparser import parse_form_data
+
+CHUNK_SIZE = 64 * 1024
+RECEIPT_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    description = 'Файл слишком большой'
+
+
+class UploadBusy(ServiceUnavailable):
+    description = 'Обработка чеков перегружена, попробуйте позже'
+
+
+def is_receipt_id(value):
+    return isinstance(value, str) and bool(RECEIPT_ID_RE.match(value))
+
+
+def _write_meta(path, info):
+    partial = f'{path}.part'
+    with open(partial, 'w') as f:
+        json.dump(info, f)
+    os.replace(partial, path)
+
+
+def process_receipt(source, image_path, thumb_path, meta_path, max_side, thumb_side):
+    from PIL import Image, ImageOps
+    from phash import dhash
+
+    with Image.open(source) as original:
+        original.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    image.thumbnail((max_side, max_side))
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumb_side, thumb_side))
+    info = {'width': image.width, 'height': image.height, 'phash': dhash(thumbnail)}
+
+    # Метаданные пишутся раньше изображения: статус ready гарантирует, что хэш уже есть.
+    _write_meta(meta_path, info)
+    # Сохраняем без exif=..., поэтому метаданные (в т.ч. геотеги) не переносятся.
+    for path, picture in ((thumb_path, thumbnail), (image_path, image)):
+        partial = f'{path}.part'
+        picture.save(partial, 'JPEG', quality=85, optimize=True)
+        os.replace(partial, path)
+
+    return info
+
+
+class _HashingFile:
+    def __init__(self, directory, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=directory, suffix='.upload', delete=False)
+        self.name = self._file.name
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge()
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def flush(self):
+        return self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+
+class ReceiptStore:
+    def __init__(self, root, max_bytes=10 * 1024 * 1024, workers=2, max_pending=32,
+                 max_side=2048, thumb_side=320):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_side = max_side
+        self.thumb_side = thumb_side
+        self.incoming = os.path.join(root, 'incoming')
+        self.objects = os.path.join(root, 'receipts')
+        os.makedirs(self.incoming, exist_ok=True)
+        os.makedirs(self.objects, exist_ok=True)
+
+        self.processed = 0
+        self.failed = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    def _paths(self, receipt_id):
+        directory = os.path.join(self.objects, receipt_id[:2])
+        base = os.path.join(directory, receipt_id)
+        return {
+            'dir': directory,
+            'original': base + '.orig',
+            'image': base + '.jpg',
+            'thumbnail': base + '_thumb.jpg',
+            'meta': base + '.json',
+            'failed': base + '.failed'
+        }
+
+    def _executor(self):
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            context = multiprocessing.get_context('spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            self._pool_pid = pid
+        return self._pool
+
+    def check_capacity(self):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise UploadBusy()
+
+    def save_stream(self, stream):
+        self.check_capacity()
+        target = _HashingFile(self.incoming, self.max_bytes)
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                target.write(chunk)
+            target.close()
+        except BaseException:
+            target.discard()
+            raise
+        return self._finalize(target)
+
+    def save_multipart(self, environ, field='photo'):
+        self.check_capacity()
+        containers = []
+
+        def stream_factory(total_content_length, content_type, filename, content_length=None):
+            container = _HashingFile(self.incoming, self.max_bytes)
+            containers.append(container)
+            return container
+
+        try:
+            _, _, files = parse_form_data(
+                environ,
+                stream_factory=stream_factory,
+                max_content_length=self.max_bytes + CHUNK_SIZE,
+                silent=False
+            )
+        except BaseException:
+            for container in containers:
+                container.discard()
+            raise
+
+        upload = files.get(field)
+        target = upload.stream if upload is not None else None
+        for container in containers:
+            if container is not target:
+                container.discard()
+        if target is None or not target.size:
+            if target is not None:
+                target.discard()
+            return None
+        target.close()
+        return self._finalize(target)
+
+    def _finalize(self, upload):
+        if not upload.size:
+            upload.discard()
+            return None
+        receipt_id = upload.sha256.hexdigest()
+        paths = self._paths(receipt_id)
+        if os.path.exists(paths['image']) or os.path.exists(paths['original']):
+            upload.discard()
+        else:
+            os.makedirs(paths['dir'], exist_ok=True)
+            if os.path.exists(paths['failed']):
+                os.remove(paths['failed'])
+            os.replace(upload.name, paths['original'])
+        self._schedule(receipt_id)
+        return receipt_id
+
+    def _schedule(self, receipt_id):
+        paths = self._paths(receipt_id)
+        with self._lock:
+            if receipt_id in self._pending or not os.path.exists(paths['original']):
+                return
+            self._pending.add(receipt_id)
+        future = self._executor().submit(
+            process_receipt, paths['original'], paths['image'], paths['thumbnail'], paths['meta'],
+            self.max_side, self.thumb_side
+        )
+        future.add_done_callback(lambda f: self._on_processed(receipt_id, f))
+
+    def _on_processed(self, receipt_id, future):
+        paths = self._paths(receipt_id)
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            # Упавший пул не принимает новых задач, следующая загрузка создаст новый.
+            with self._lock:
+                if self._pool_pid == os.getpid():
+                    self._pool = None
+        try:
+            if error is None:
+                with self._lock:
+                    self.processed += 1
+            else:
+                with open(paths['failed'], 'w') as marker:
+                    marker.write(str(error))
+                with self._lock:
+                    self.failed += 1
+                print(f"Ошибка обработки чека {receipt_id}: {error}")
+            if os.path.exists(paths['original']):
+                os.remove(paths['original'])
+        finally:
+            with self._lock:
+                self._pending.discard(receipt_id)
+
+    def status(self, receipt_id):
+        if not is_receipt_id(receipt_id):
+            return None
+        paths = self._paths(receipt_id)
+        if os.path.exists(paths['image']):
+            return 'ready'
+        if os.path.exists(paths['failed']):
+            return 'failed'
+        if os.path.exists(paths['original']):
+            return 'processing'
+        return None
+
+    def info(self, receipt_id):
+        """Размеры и перцептивный хэш обработанного фото или None, если оно не готово."""
+        if self.status(receipt_id) != 'ready':
+            return None
+        paths = self._paths(receipt_id)
+        try:
+            with open(paths['meta']) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        # Фото, обработанные до появления хэшей, досчитываются по миниатюре.
+        from PIL import Image
+        from phash import dhash
+
+        with Image.open(paths['thumbnail']) as thumbnail, Image.open(paths['image']) as image:
+            info = {'width': image.width, 'height': image.height, 'phash': dhash(thumbnail)}
+        _write_meta(paths['meta'], info)
+        return info
+
+    def thumbnail_path(self, receipt_id):
+        if not is_receipt_id(receipt_id):
+            return None
+        path = self._paths(receipt_id)['thumbnail']
+        return path if os.path.exists(path) else None
+
+    def wait(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+            time.sleep(0.05)
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'processed': self.processed, 'failed': self.failed}